@@ -1,8 +1,12 @@
 import os
+import sys
+import django
 import environ 
 from pathlib import Path
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -31,6 +35,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     #Third-party apps
     'corsheaders',
     'rest_framework',
@@ -41,14 +46,50 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'trego.authentication.RoleJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Same output as DRF's JSONRenderer, encoded by orjson
+    'DEFAULT_RENDERER_CLASSES': [
+        'trego.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Keyset (cursor) pagination on (created_at, id); clients can ask for
+    # up to KeysetPagination.max_page_size rows with ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'trego.pagination.KeysetPagination',
+    'PAGE_SIZE': env.int('PAGE_SIZE', default=20),
+    # Load shedding first, so shed requests don't use up tokens
+    'DEFAULT_THROTTLE_CLASSES': [
+        'trego.throttling.LoadSheddingThrottle',
+        'trego.throttling.TokenBucketThrottle',
+    ],
+    # Token bucket per user (or IP) and scope, see THROTTLE_SCOPES; None
+    # means unlimited
+    'DEFAULT_THROTTLE_RATES': {
+        'auth': env.str('THROTTLE_AUTH_RATE', default='10/min'),
+        'checkout': env.str('THROTTLE_CHECKOUT_RATE', default='20/min'),
+        'payment': env.str('THROTTLE_PAYMENT_RATE', default='20/min'),
+        'write': env.str('THROTTLE_WRITE_RATE', default='300/min'),
+        # Anonymous clients can make the image view render derivatives
+        'image': env.str('THROTTLE_IMAGE_RATE', default='60/min'),
+        'read': env.str('THROTTLE_READ_RATE', default=None),
+    },
+}
+
+# Scopes of actions by URL name; other requests are 'read' (GET, HEAD,
+# OPTIONS) or 'write'
+THROTTLE_SCOPES = {
+    'token_obtain_pair': 'auth',
+    'token_refresh': 'auth',
+    'order-checkout': 'checkout',
+    'order-process-payment': 'payment',
+    'product-image': 'image',
 }
 
 MIDDLEWARE = [
+    'trego.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,6 +121,9 @@ WSGI_APPLICATION = 'backpack.wsgi.application'
 
 # Database
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds and reused by the
+# next request on the same worker thread, after a liveness check if the
+# last one errored or it was idle (CONN_HEALTH_CHECKS)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -88,9 +132,127 @@ DATABASES = {
         'PASSWORD': env('DB_PASSWORD'),
         'HOST': env('DB_HOST'),
         'PORT': env('DB_PORT'),
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
+        # Behind PgBouncer in transaction mode a cursor can't outlive its
+        # transaction, so exports fetch in chunks client-side instead
+        'DISABLE_SERVER_SIDE_CURSORS': env.bool('DB_PGBOUNCER', default=False),
+        'OPTIONS': {'connect_timeout': env.int('DB_CONNECT_TIMEOUT', default=5)},
+    }
+}
+
+# A process-wide pool instead of one connection per thread (Django 5.1+
+# with psycopg 3 only, which requirements.txt doesn't install); connections
+# are checked before being handed out
+if env.int('DB_POOL_MAX_SIZE', default=0):
+    try:
+        import psycopg
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        psycopg = None
+    if psycopg is None or django.VERSION < (5, 1):
+        raise ImproperlyConfigured(
+            "DB_POOL_MAX_SIZE needs Django 5.1+ with psycopg 3: install psycopg[binary] and "
+            "psycopg-pool in place of psycopg2-binary, or leave DB_POOL_MAX_SIZE unset"
+        )
+
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': env.int('DB_POOL_MIN_SIZE', default=2),
+        'max_size': env.int('DB_POOL_MAX_SIZE'),
+        'timeout': env.int('DB_POOL_TIMEOUT', default=10),
+        'check': ConnectionPool.check_connection,
     }
+
+# Read replicas, as host or host:port; the rest of their settings are the
+# primary's. Pointing one at the primary itself gives a local stand-in.
+# Tests run them as mirrors of the test database.
+for number, replica in enumerate(env.list('DB_REPLICA_HOSTS', default=[]), 1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']), 'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['trego.routers.PrimaryReplicaRouter']
+# Replicas further behind than this (or unreachable) are skipped, checked
+# at most every REPLICA_CHECK_SECONDS per process
+REPLICA_MAX_LAG_SECONDS = env.float('REPLICA_MAX_LAG_SECONDS', default=5)
+REPLICA_CHECK_SECONDS = env.float('REPLICA_CHECK_SECONDS', default=5)
+
+# Local memory by default; point CACHE_URL at redis://host:6379/0 to share
+# the cache between workers.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
 }
 
+# Caches whose entries every worker must see: the user state requests are
+# authorized from (trego/authentication.py) and the rate limit token
+# buckets (trego/throttling.py). SHARED_CACHE_URL points at Redis or
+# Memcached; only DEBUG and test runs may fall back to local memory, one
+# process's view.
+SHARED_CACHES = ('auth', 'throttle')
+TESTING = sys.argv[1:2] == ['test']
+LOCAL_CACHES = ('LocMemCache', 'DummyCache')
+SHARED_CACHE_URL = env.str('SHARED_CACHE_URL', default='locmemcache://' if DEBUG or TESTING else '')
+_shared = env.cache_url_config(SHARED_CACHE_URL) if SHARED_CACHE_URL else None
+if _shared is None or (_shared['BACKEND'].endswith(LOCAL_CACHES) and not (DEBUG or TESTING)):
+    raise ImproperlyConfigured(
+        "Set SHARED_CACHE_URL to a Redis or Memcached URL (e.g. redis://redis:6379/1): "
+        "auth state and rate limits must be shared by every worker"
+    )
+for alias in SHARED_CACHES:
+    # Their own store, apart from the catalog responses in 'default'
+    CACHES[alias] = {**_shared, 'KEY_PREFIX': alias}
+    if _shared['BACKEND'].endswith('LocMemCache'):
+        CACHES[alias].update(LOCATION=alias, OPTIONS={'MAX_ENTRIES': 10000})
+AUTH_CACHE_ALIAS = 'auth'
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+# Serve product, category and order listings from values() rows instead of
+# serializer instances (trego/readers.py); the JSON is identical
+FAST_READS = env.bool('FAST_READS', default=True)
+
+# Rows fetched per server-side cursor round trip, and per streamed chunk,
+# by the /export/ endpoints (trego/exports.py)
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+
+# Rows validated and upserted together by product imports (trego/imports.py),
+# and how many per-row errors an import reports before only counting them
+IMPORT_BATCH_SIZE = env.int('IMPORT_BATCH_SIZE', default=1000)
+IMPORT_MAX_ERRORS = env.int('IMPORT_MAX_ERRORS', default=1000)
+
+# Products bought or rated together (trego/recommendations.py): how many to
+# keep per product, the rating that counts as liking a product, and
+# products recomputed per transaction by `manage.py build_recommendations`
+RECOMMENDATION_K = env.int('RECOMMENDATION_K', default=20)
+RECOMMENDATION_MIN_RATING = env.int('RECOMMENDATION_MIN_RATING', default=4)
+RECOMMENDATION_BATCH_SIZE = env.int('RECOMMENDATION_BATCH_SIZE', default=500)
+
+# Orders are partitioned (trego/partitions.py): `manage.py
+# create_order_partitions` keeps monthly partitions this many months ahead,
+# and `manage.py archive_orders` moves orders completed or cancelled more
+# than ORDER_ARCHIVE_AFTER_MONTHS ago to yearly archive partitions, stored
+# in ORDER_ARCHIVE_TABLESPACE when set
+ORDER_PARTITION_MONTHS_AHEAD = env.int('ORDER_PARTITION_MONTHS_AHEAD', default=3)
+ORDER_ARCHIVE_AFTER_MONTHS = env.int('ORDER_ARCHIVE_AFTER_MONTHS', default=6)
+ORDER_ARCHIVE_BATCH_SIZE = env.int('ORDER_ARCHIVE_BATCH_SIZE', default=1000)
+ORDER_ARCHIVE_TABLESPACE = env.str('ORDER_ARCHIVE_TABLESPACE', default='')
+
+CATALOG_CACHE_ALIAS = 'default'
+
+# Shed SHED_SCOPES requests with 503 + Retry-After while this process's p99
+# latency over the last SHED_WINDOW_SECONDS is above SHED_P99_MS (0: off)
+SHED_P99_MS = env.int('SHED_P99_MS', default=0)
+SHED_WINDOW_SECONDS = env.int('SHED_WINDOW_SECONDS', default=10)
+SHED_RETRY_AFTER = env.int('SHED_RETRY_AFTER', default=5)
+SHED_SCOPES = env.list('SHED_SCOPES', default=['read'])
+# 0 turns the catalog response cache off (e.g. for `manage.py loadtest`)
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', default=300)
+# How long cached user/role state is reused; changes replace it at once,
+# this bounds how long a lost update can go unnoticed
+AUTH_USER_CACHE_TIMEOUT = env.int('AUTH_USER_CACHE_TIMEOUT', default=300)
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -129,6 +291,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Django streams MEDIA_ROOT itself only when this is on (development);
+# otherwise the web server or CDN serves /media/
+SERVE_MEDIA = env.bool('SERVE_MEDIA', default=DEBUG)
+# The only image derivatives built, at upload or on first request (see
+# trego/images.py)
+IMAGE_VARIANTS = {
+    'thumb': {'size': (200, 200), 'format': 'WEBP', 'ext': 'webp'},
+    'medium': {'size': (800, 800), 'format': 'WEBP', 'ext': 'webp'},
+    # For clients without WebP support
+    'thumb_jpeg': {'size': (200, 200), 'format': 'JPEG', 'ext': 'jpg'},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -142,6 +315,50 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Payments run off the request thread. PAYMENT_RUNNER is 'thread' (in-process
+# pool), 'worker' (queued for `manage.py process_payments`) or 'inline'.
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY', default='trego.payments.LocalGateway')
+PAYMENT_GATEWAY_DELAY = env.float('PAYMENT_GATEWAY_DELAY', default=1.0)
+PAYMENT_RUNNER = env('PAYMENT_RUNNER', default='thread')
+PAYMENT_WORKERS = env.int('PAYMENT_WORKERS', default=8)
+# Queued or processing jobs untouched for this long are requeued (by
+# `manage.py process_payments`, or when the order's payment is requested
+# again); keep it above the gateway's own timeout
+PAYMENT_JOB_TIMEOUT = env.int('PAYMENT_JOB_TIMEOUT', default=300)
+
+# Stock of a tracked product is split over this many rows (see
+# trego/inventory.py); cart holds are released after STOCK_HOLD_SECONDS
+STOCK_SHARDS = env.int('STOCK_SHARDS', default=8)
+STOCK_HOLD_SECONDS = env.int('STOCK_HOLD_SECONDS', default=900)
+
+# Per-route request metrics, served in Prometheus format at /metrics (see
+# trego/metrics.py). Set METRICS_DIR to a directory shared by the worker
+# processes so the endpoint reports all of them, and METRICS_TOKEN to the
+# bearer token scrapers send; without one it answers only under DEBUG.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+METRICS_DIR = env('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = env.float('METRICS_FLUSH_SECONDS', default=5.0)
+SLOW_REQUEST_MS = env.int('SLOW_REQUEST_MS', default=1000)
+SLOW_QUERY_MS = env.int('SLOW_QUERY_MS', default=200)
+# A request running the same statement this many times is logged as a likely N+1
+N_PLUS_ONE_THRESHOLD = env.int('N_PLUS_ONE_THRESHOLD', default=10)
+# Share of ordinary requests logged; slow, failed and N+1 ones always are
+REQUEST_LOG_SAMPLE_RATE = env.float('REQUEST_LOG_SAMPLE_RATE', default=0.01)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'trego.logs.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        'trego': {'handlers': ['console'], 'level': env('LOG_LEVEL', default='INFO'), 'propagate': False},
+    },
+}
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',  # Allow React frontend
 ]
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -7,6 +7,8 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from trego.views import CategoryViewSet, ProductViewSet, ProfileViewSet, CartViewSet, OrderViewSet, FeedbackViewSet
+from trego import async_views, media_views, metrics
+from trego.serializers import RoleTokenObtainPairSerializer
 
 router = DefaultRouter()
 router.register(r'profiles', ProfileViewSet)
@@ -20,10 +22,22 @@ urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('api/', include(router.urls)),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/', TokenObtainPairView.as_view(serializer_class=RoleTokenObtainPairSerializer), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
+    # Async read paths, meant to be served through backpack.asgi
+    path('api/async/products/', async_views.product_list, name='async-product-list'),
+    path('api/async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('api/async/categories/', async_views.category_list, name='async-category-list'),
+    path('api/async/orders/order-history/', async_views.order_history, name='async-order-history'),
+
+    # Prometheus scrape target
+    path('metrics', metrics.metrics_view, name='metrics'),
+
+    # Derivatives built on demand; uploads streamed with Range and caching
+    # headers when SERVE_MEDIA is on (the web server's job otherwise)
+    path('media/products/<int:pk>/<str:variant>/', media_views.product_image, name='product-image'),
+    re_path(r'^media/(?P<path>.+)$', media_views.serve_media, name='media'),
 ]
 
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
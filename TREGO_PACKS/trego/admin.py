@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Category, Product
+from .models import Profile, Category, Product, Order, OrderLine
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
@@ -17,3 +17,25 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ('name', 'category__name')
     list_filter = ('category',)
     ordering = ('-created_at',)
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    raw_id_fields = ('product',)
+    extra = 0
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'total', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('user__username',)
+    list_select_related = ('user',)
+    ordering = ('-created_at',)
+    inlines = (OrderLineInline,)
+
+    def get_queryset(self, request):
+        # Totals are summed in the query, one row per order
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(ordering='total')
+    def total(self, obj):
+        return obj.total
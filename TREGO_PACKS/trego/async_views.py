@@ -0,0 +1,133 @@
+from functools import wraps
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import AsyncJWTAuthentication
+from .models import Category, Product, Profile, Order
+from .pagination import KeysetPagination
+from .routers import replica_reads
+from .search import filter_products
+from .serializers import CategorySerializer, ProductSerializer, OrderSerializer
+from .metrics import mark_shed
+from .throttling import Overloaded, shedding
+from .mixins import select_for_serializer
+from .views import CategoryViewSet, ProductViewSet, order_lines, wants_archived
+
+# Read-only mirrors of the catalog and order-history endpoints written
+# against the async ORM. Served under ASGI (uvicorn) they don't hold a
+# thread per connection while waiting on the database or a slow client.
+
+authenticator = AsyncJWTAuthentication()
+renderer = JSONRenderer()
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(
+        renderer.render(data), status=status_code,
+        content_type=renderer.media_type, headers=headers
+    )
+
+
+def async_api_view(func):
+    @wraps(func)
+    async def view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response(
+                {"detail": f'Method "{request.method}" not allowed.'},
+                status.HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'GET, HEAD'}
+            )
+        if 'read' in settings.SHED_SCOPES and shedding():
+            mark_shed()
+            return json_response(
+                {"detail": Overloaded.default_detail}, Overloaded.status_code,
+                headers={'Retry-After': str(settings.SHED_RETRY_AFTER)}
+            )
+        request = Request(request)
+        try:
+            auth = await authenticator.aauthenticate(request)
+            if auth is None:
+                return json_response(
+                    {"detail": "Authentication credentials were not provided."},
+                    status.HTTP_401_UNAUTHORIZED,
+                    headers={'WWW-Authenticate': authenticator.authenticate_header(request)}
+                )
+            request.user, request.auth = auth
+            # All of these are reads a replica can serve
+            with replica_reads():
+                return await func(request, *args, **kwargs)
+        except APIException as e:
+            return json_response({"detail": e.detail}, e.status_code)
+    return view
+
+
+async def paginated(request, queryset, serializer, ordering):
+    # `serializer` was built with the request in its context, so its
+    # fields already follow ?fields= / ?expand=
+    paginator = KeysetPagination()
+    view = SimpleNamespace(cursor_ordering=ordering)
+    rows = await paginator.apaginate_queryset(queryset, request, view=view)
+    data = serializer.__class__(rows, many=True, context=serializer.context).data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+def ordering_keys(ordering):
+    return [name.lstrip('-') for name in ordering]
+
+
+@async_api_view
+async def product_list(request):
+    orderings = ProductViewSet.orderings
+    ordering = orderings.get(request.query_params.get('ordering'), orderings['newest'])
+    serializer = ProductSerializer(context={'request': request})
+    products = select_for_serializer(
+        Product.objects.defer('search_vector'), serializer, ('category',), keep=ordering_keys(ordering)
+    )
+    try:
+        products = filter_products(products, request.query_params)
+    except ValueError as e:
+        return json_response({"error": str(e)}, status.HTTP_400_BAD_REQUEST)
+    return await paginated(request, products, serializer, ordering)
+
+
+@async_api_view
+async def product_detail(request, pk):
+    serializer = ProductSerializer(context={'request': request})
+    products = select_for_serializer(Product.objects.defer('search_vector'), serializer, ('category',))
+    try:
+        product = await products.aget(pk=pk)
+    except Product.DoesNotExist:
+        return json_response({"detail": "No Product matches the given query."}, status.HTTP_404_NOT_FOUND)
+    return json_response(ProductSerializer(product, context={'request': request}).data)
+
+
+@async_api_view
+async def category_list(request):
+    serializer = CategorySerializer(context={'request': request})
+    return await paginated(request, Category.objects.all(), serializer, CategoryViewSet.cursor_ordering)
+
+
+@async_api_view
+async def order_history(request):
+    # Admins see all orders, users see only their own
+    serializer = OrderSerializer(context={'request': request})
+    orders = select_for_serializer(
+        Order.objects.filter(archived=wants_archived(request)), serializer,
+        keep=ordering_keys(KeysetPagination.ordering)
+    )
+    if 'total' in serializer.fields:
+        orders = orders.with_totals()
+    lines = order_lines(serializer)
+    if lines:
+        orders = orders.prefetch_related(lines)
+    user_type = getattr(request.user, 'user_type', None)
+    if user_type is None:
+        user_type = await Profile.objects.filter(user=request.user).values_list('user_type', flat=True).afirst()
+    if user_type != 'admin':
+        orders = orders.filter(user=request.user)
+    return await paginated(request, orders, serializer, KeysetPagination.ordering)
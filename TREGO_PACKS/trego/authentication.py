@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def _state_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _user_rows(user_id):
+    # One query for everything authorization needs: User joined to Profile
+    return User.objects.filter(pk=user_id).values('username', 'is_active', 'profile__user_type')
+
+
+def _state_from_row(row):
+    if row is None:
+        return {'exists': False}
+    return {
+        'exists': True,
+        'username': row['username'],
+        'is_active': row['is_active'],
+        'user_type': row['profile__user_type'] or 'customer',
+    }
+
+
+def load_user_state(user_id):
+    return _state_from_row(_user_rows(user_id).first())
+
+
+def auth_cache():
+    # A cache every process shares (see SHARED_CACHE_URL), so a change
+    # recorded by one worker is seen by all of them
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def remember_user_state(user_id):
+    # Called when a user or profile changes
+    auth_cache().set(_state_key(user_id), load_user_state(user_id), timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def remember_login(user):
+    # At login the user and profile are loaded anyway; caching their state
+    # saves the first requests with the new token a query
+    state = {'exists': True, 'username': user.username, 'is_active': user.is_active,
+             'user_type': user.profile.user_type}
+    auth_cache().set(_state_key(user.pk), state, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def get_user_type(user):
+    user_type = getattr(user, 'user_type', None)
+    if user_type is None:
+        user_type = user.profile.user_type
+    return user_type
+
+
+class RoleJWTAuthentication(JWTAuthentication):
+    """
+    Builds request.user from cached user state instead of loading it.
+
+    The state (username, is_active, user_type) lives in the shared auth
+    cache, written at login and whenever a user or profile changes, so a
+    typical request authenticates and authorizes with no queries. When the
+    entry is missing (expired or evicted) it's loaded again with one
+    query: the `username` and `user_type` claims in tokens are never
+    trusted on their own, so a demotion or deactivation can't be undone by
+    losing a cache entry.
+
+    request.user is an unsaved-looking User with only id, username and
+    is_active set: fine for filtering and FK assignment, never save() it.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        state = auth_cache().get(_state_key(user_id))
+        if state is None:
+            state = load_user_state(user_id)
+            auth_cache().set(_state_key(user_id), state, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+        return self.build_user(user_id, state)
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def build_user(self, user_id, state):
+        if not state['exists']:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not state['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        user = self.user_model(
+            **{api_settings.USER_ID_FIELD: user_id},
+            username=state['username'], is_active=state['is_active']
+        )
+        user._state.adding = False
+        user.user_type = state['user_type']
+        return user
+
+
+class AsyncJWTAuthentication(RoleJWTAuthentication):
+    """
+    RoleJWTAuthentication with an awaitable entry point for the ASGI views.
+
+    Token parsing and validation never touch the database, so only the
+    cache/user lookup needs to be awaited.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await self.aget_model_user(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        state = await auth_cache().aget(_state_key(user_id))
+        if state is None:
+            state = _state_from_row(await _user_rows(user_id).afirst())
+            await auth_cache().aset(_state_key(user_id), state, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+        return self.build_user(user_id, state)
+
+    async def aget_model_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
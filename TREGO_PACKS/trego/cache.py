@@ -0,0 +1,82 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _version_key(name):
+    return f"catalog:version:{name}"
+
+
+def _fresh_version():
+    # Seeded from the clock so an evicted version key never restarts at a
+    # number that old entries were stored under.
+    return time.time_ns()
+
+
+def get_versions(names):
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        cache.set(_version_key(name), _fresh_version(), timeout=None)
+
+
+class CachedResponseMixin:
+    """
+    Caches list/retrieve responses under a key made of the request URL and
+    the current version of every model in `cache_versions`. Writes bump a
+    version (see signals.py), which orphans every entry built from the old
+    data instead of having to find and delete them.
+
+    The key doubles as the ETag, so a client holding the current catalog
+    gets a 304 without the response even being read from the cache.
+    """
+    cache_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.CATALOG_CACHE_TIMEOUT:
+            return handler(request, *args, **kwargs)
+        versions = '.'.join(str(v) for v in get_versions(self.cache_versions))
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f"catalog:{self.basename}:{versions}:{url}"
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        return response
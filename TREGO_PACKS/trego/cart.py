@@ -0,0 +1,82 @@
+from collections import Counter
+
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, Product
+
+MAX_BATCH_ITEMS = 100
+
+# Rows are only inserted for products that exist, and a row that is already
+# there gets its quantity incremented in place. One statement, so two
+# concurrent adds can neither lose an increment nor race on the
+# unique (user, product) constraint.
+UPSERT_SQL = """
+    INSERT INTO {cart} (user_id, product_id, quantity, added_at)
+    SELECT %s, p.id, v.quantity, %s
+    FROM (VALUES {values}) AS v (product_id, quantity)
+    JOIN {product} p ON p.id = v.product_id
+    ON CONFLICT (user_id, product_id)
+    DO UPDATE SET quantity = {cart}.quantity + EXCLUDED.quantity
+    RETURNING id, product_id
+"""
+
+
+def parse_product_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("product_id must be an integer")
+
+
+def parse_quantity(value, allow_negative=False):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Quantity must be an integer")
+    if quantity == 0 or (quantity < 0 and not allow_negative):
+        raise ValueError("Invalid quantity")
+    return quantity
+
+
+def add_to_cart(user, items):
+    """
+    Add `items`, an iterable of (product_id, quantity) pairs, to the user's
+    cart in a single INSERT ... ON CONFLICT DO UPDATE statement. Repeated
+    products are summed first, since Postgres rejects touching the same row
+    twice in one statement.
+
+    Returns {product_id: cart_item_id} for the products that exist; missing
+    products are left out rather than raising.
+    """
+    totals = Counter()
+    for product_id, quantity in items:
+        totals[int(product_id)] += quantity
+    if not totals:
+        return {}
+
+    sql = UPSERT_SQL.format(
+        cart=connection.ops.quote_name(Cart._meta.db_table),
+        product=connection.ops.quote_name(Product._meta.db_table),
+        values=', '.join(['(%s::bigint, %s::integer)'] * len(totals)),
+    )
+    params = [user.pk, timezone.now()]
+    for product_id, quantity in totals.items():
+        params += [product_id, quantity]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {product_id: pk for pk, product_id in cursor.fetchall()}
+
+
+def set_quantity(user, item_id, quantity):
+    # Absolute set; a single UPDATE, no read first
+    return Cart.objects.filter(pk=item_id, user=user).update(quantity=quantity) == 1
+
+
+def change_quantity(user, item_id, delta):
+    # Relative change applied by the database, so concurrent changes add up.
+    # The filter keeps a decrement from taking the quantity below 1.
+    return Cart.objects.filter(pk=item_id, user=user, quantity__gt=-delta).update(
+        quantity=F('quantity') + delta
+    ) == 1
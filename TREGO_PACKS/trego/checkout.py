@@ -0,0 +1,40 @@
+from django.db import transaction
+
+from .inventory import commit_stock
+from .models import Cart, Order, OrderLine
+from .stats import record_orders
+
+
+def checkout_cart(user):
+    """
+    Turn the user's cart into one pending order with a line per item, using
+    a fixed number of statements whatever the cart size: lock the cart
+    rows, insert the order and all of its lines in one batch and delete the
+    locked rows in one go. Each line captures the product's current price.
+
+    Stock holds are settled by commit_stock in the same transaction, so an
+    InsufficientStock error leaves the cart, stock and holds untouched.
+
+    Returns the created order, or None if the cart was empty.
+    """
+    with transaction.atomic():
+        cart_items = list(
+            Cart.objects.select_for_update(of=('self',))
+            .filter(user=user)
+            .select_related('product')
+            .only('id', 'product_id', 'quantity', 'product__price')
+        )
+        if not cart_items:
+            return None
+
+        commit_stock(user, {item.product_id: item.quantity for item in cart_items})
+        order = Order.objects.create(user=user, status='pending')
+        OrderLine.objects.bulk_create([
+            OrderLine(order=order, product_id=item.product_id, quantity=item.quantity,
+                      unit_price=item.product.price)
+            for item in cart_items
+        ])
+        record_orders([order.pk])
+        # Only delete what was locked; an item added concurrently stays in the cart
+        Cart.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+        return order
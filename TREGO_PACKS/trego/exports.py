@@ -0,0 +1,198 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .authentication import get_user_type
+from .models import Feedback, Order, OrderLine, Product
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the json module
+    orjson = None
+
+# (column, values_list lookup) per export. Orders come out one row per
+# order line, with the order's user and the line's product alongside.
+ORDER_COLUMNS = (
+    ('order_id', 'order_id'),
+    ('created_at', 'order__created_at'),
+    ('status', 'order__status'),
+    ('user_id', 'order__user_id'),
+    ('username', 'order__user__username'),
+    ('email', 'order__user__email'),
+    ('product_id', 'product_id'),
+    ('product', 'product__name'),
+    ('category', 'product__category__name'),
+    ('quantity', 'quantity'),
+    ('unit_price', 'unit_price'),
+)
+PRODUCT_COLUMNS = (
+    ('id', 'id'),
+    ('sku', 'sku'),
+    ('name', 'name'),
+    ('category_id', 'category_id'),
+    ('category', 'category__name'),
+    ('price', 'price'),
+    ('rating_avg', 'rating_avg'),
+    ('rating_count', 'rating_count'),
+    ('created_at', 'created_at'),
+)
+FEEDBACK_COLUMNS = (
+    ('id', 'id'),
+    ('product_id', 'product_id'),
+    ('product', 'product__name'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('rating', 'rating'),
+    ('comment', 'comment'),
+    ('created_at', 'created_at'),
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_export_params(params, statuses=False):
+    """
+    Read ?as= (csv or ndjson, default csv), ?from=&to= (ISO dates, both
+    optional and inclusive) and, for orders, ?status=. Raises ValueError on
+    bad input.
+    """
+    file_format = params.get('as', 'csv')
+    if file_format not in CONTENT_TYPES:
+        raise ValueError(f"as must be one of: {', '.join(CONTENT_TYPES)}")
+    try:
+        start = date.fromisoformat(params['from']) if params.get('from') else None
+        end = date.fromisoformat(params['to']) if params.get('to') else None
+    except ValueError:
+        raise ValueError("from and to must be dates (YYYY-MM-DD)")
+    if start and end and start > end:
+        raise ValueError("from must not be after to")
+
+    order_status = params.get('status') or None
+    if order_status and (not statuses or order_status not in dict(Order.ORDER_STATUS_CHOICES)):
+        raise ValueError(f"Unknown status: {order_status}")
+    return {'file_format': file_format, 'start': start, 'end': end, 'status': order_status}
+
+
+def created_between(queryset, lookup, start, end):
+    # Local dates as an aware [start, end + 1 day) range, so the created_at
+    # indexes apply rather than a per-row date cast
+    if start:
+        queryset = queryset.filter(**{f'{lookup}__gte': timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        queryset = queryset.filter(**{f'{lookup}__lt': timezone.make_aware(
+            datetime.combine(end + timedelta(days=1), time.min)
+        )})
+    return queryset
+
+
+def _text(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record, default=_text)
+    return json.dumps(record, default=_text, ensure_ascii=False).encode()
+
+
+def stream_rows(queryset, columns, file_format):
+    """
+    Encoded CSV or NDJSON for `queryset`, yielded EXPORT_CHUNK_SIZE rows at
+    a time. Rows are read through a server-side cursor (iterator()), so
+    memory use doesn't grow with the size of the export.
+    """
+    names = [name for name, _ in columns]
+    rows = queryset.values_list(*[lookup for _, lookup in columns]).iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE
+    )
+    if file_format == 'ndjson':
+        chunk = []
+        for row in rows:
+            chunk.append(_dumps(dict(zip(names, row))))
+            if len(chunk) >= settings.EXPORT_CHUNK_SIZE:
+                yield b'\n'.join(chunk) + b'\n'
+                chunk = []
+        if chunk:
+            yield b'\n'.join(chunk) + b'\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    count = 0
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        count += 1
+        if count % settings.EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def export_response(queryset, columns, file_format, name):
+    response = StreamingHttpResponse(stream_rows(queryset, columns, file_format),
+                                     content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{name}-{timezone.localdate():%Y%m%d}.{file_format}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def order_export_queryset(params):
+    lines = created_between(OrderLine.objects.all(), 'order__created_at', params['start'], params['end'])
+    if params['status']:
+        lines = lines.filter(order__status=params['status'])
+    return lines.order_by('order_id', 'id')
+
+
+def product_export_queryset(params):
+    products = created_between(Product.objects.all(), 'created_at', params['start'], params['end'])
+    return products.order_by('id')
+
+
+def feedback_export_queryset(params):
+    feedback = created_between(Feedback.objects.all(), 'created_at', params['start'], params['end'])
+    return feedback.order_by('id')
+
+
+EXPORTS = {
+    'orders': (ORDER_COLUMNS, order_export_queryset),
+    'products': (PRODUCT_COLUMNS, product_export_queryset),
+    'feedback': (FEEDBACK_COLUMNS, feedback_export_queryset),
+}
+
+
+class ExportMixin:
+    """
+    GET <prefix>/export/ streams every row of EXPORTS[export_name] matching
+    the date (and for orders, status) filters as CSV or NDJSON. Admins only.
+    """
+    export_name = None
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        if get_user_type(request.user) != 'admin':
+            return Response({"error": "Only admins can export data"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            params = parse_export_params(request.query_params, statuses=self.export_name == 'orders')
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        columns, build_queryset = EXPORTS[self.export_name]
+        return export_response(build_queryset(params), columns, params['file_format'], self.export_name)
@@ -0,0 +1,70 @@
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .cache import bump_version
+from .models import Product
+
+# Derivatives generated for every product image (IMAGE_VARIANTS). Names
+# are content addressed (hash of the original + variant), so a file never
+# changes once written and identical uploads share their derivatives.
+VARIANTS = settings.IMAGE_VARIANTS
+QUALITY = 82
+
+
+def source_digest(field_file):
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_name(digest, variant):
+    return f"derived/{digest[:2]}/{digest}-{variant}.{VARIANTS[variant]['ext']}"
+
+
+def render_variant(field_file, variant):
+    spec = VARIANTS[variant]
+    with field_file.open('rb') as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.thumbnail(spec['size'], Image.LANCZOS)
+        if spec['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, spec['format'], quality=QUALITY)
+    return output.getvalue()
+
+
+def generate_derivatives(product, variants=None):
+    """
+    Write any missing derivatives for the product's current image and record
+    their storage names in Product.image_variants. Returns the mapping.
+    """
+    if not product.image:
+        if product.image_variants:
+            Product.objects.filter(pk=product.pk).update(image_variants={})
+            product.image_variants = {}
+        return {}
+
+    stored = dict(product.image_variants or {})
+    if stored.get('source') != product.image.name:
+        stored = {'source': product.image.name, 'digest': source_digest(product.image)}
+
+    for variant in variants or VARIANTS:
+        if variant in stored:
+            continue
+        name = derivative_name(stored['digest'], variant)
+        if not default_storage.exists(name):
+            name = default_storage.save(name, ContentFile(render_variant(product.image, variant)))
+        stored[variant] = name
+
+    if stored != product.image_variants:
+        Product.objects.filter(pk=product.pk).update(image_variants=stored)
+        product.image_variants = stored
+        bump_version('product')
+    return stored
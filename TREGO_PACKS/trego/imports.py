@@ -0,0 +1,135 @@
+import csv
+import json
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .cache import bump_version
+from .models import Category, Product
+from .serializers import ProductImportSerializer
+
+FORMATS = ('csv', 'ndjson')
+# Columns an import overwrites on products whose sku already exists
+UPDATE_FIELDS = ('name', 'description', 'price', 'category')
+COMPARED_FIELDS = ('name', 'description', 'price', 'category_id')
+
+
+def read_rows(lines, file_format):
+    """
+    (line number, record) for each row of an iterable of text lines, CSV
+    with a header row or NDJSON. Lines that aren't valid JSON give a None
+    record.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+class ProductImport:
+    """
+    Upserts products by sku from a stream of rows, IMPORT_BATCH_SIZE at a
+    time: each batch is validated row by row, its category ids are checked
+    with one query (ids already seen aren't asked for again), and its new or
+    changed rows are written with a single INSERT ... ON CONFLICT (sku) DO
+    UPDATE.
+    Batches commit on their own, so a bad row only costs itself.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.serializer = ProductImportSerializer()
+        self.categories = set()
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        if self.created or self.updated:
+            transaction.on_commit(lambda: bump_version('product'))
+        return self.report()
+
+    def fail(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def import_batch(self, batch):
+        valid = []
+        for number, record in batch:
+            if record is None:
+                self.fail(number, {'non_field_errors': ["Invalid JSON"]})
+                continue
+            try:
+                valid.append((number, self.serializer.run_validation(record)))
+            except ValidationError as e:
+                self.fail(number, {field: [str(message) for message in messages]
+                                   for field, messages in e.detail.items()})
+
+        wanted = {data['category_id'] for _, data in valid} - self.categories
+        if wanted:
+            self.categories.update(Category.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+
+        rows = {}
+        for number, data in valid:
+            if data['category_id'] not in self.categories:
+                self.fail(number, {'category_id': [f"Category {data['category_id']} does not exist"]})
+                continue
+            # A sku repeated within the batch: the later row wins, as it
+            # would have one batch later
+            rows[data['sku']] = data
+        if not rows:
+            return
+
+        # Re-imports of a catalog mostly repeat what's stored; only new and
+        # changed rows are written
+        current = {
+            sku: values for sku, *values in
+            Product.objects.filter(sku__in=rows).values_list('sku', *COMPARED_FIELDS)
+        }
+        products = []
+        for sku, data in rows.items():
+            stored = current.get(sku)
+            if stored is None:
+                self.created += 1
+            elif stored == [data[name] for name in COMPARED_FIELDS]:
+                self.unchanged += 1
+                continue
+            else:
+                self.updated += 1
+            products.append(Product(**data))
+        if products:
+            with transaction.atomic():
+                Product.objects.bulk_create(
+                    products, update_conflicts=True, unique_fields=['sku'], update_fields=UPDATE_FIELDS,
+                )
+
+    def report(self):
+        return {
+            'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+            'failed': self.failed, 'errors': self.errors,
+        }
+
+
+def import_products(lines, file_format='csv', batch_size=None):
+    """Import products from text lines; returns counts per outcome and the row errors."""
+    return ProductImport(batch_size).run(read_rows(lines, file_format))
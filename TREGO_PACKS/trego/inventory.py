@@ -0,0 +1,228 @@
+import random
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import StockHold, StockShard
+
+# Stock of a tracked product lives in STOCK_SHARDS rows. Taking stock first
+# tries one conditional decrement on a random shard per product, all in one
+# statement; no row is read or locked beforehand, and two buyers only
+# contend when they pick the same shard. Only when a picked shard is short
+# is the attempt undone and redone by locking each product's shards in order
+# and spreading the take over them.
+
+TAKE_SQL = """
+    WITH v (product_id, pick, quantity) AS (VALUES {values}),
+    taken AS (
+        UPDATE {shard} AS s SET quantity = s.quantity - v.quantity
+        FROM v
+        WHERE s.product_id = v.product_id
+          AND s.shard = v.pick %% NULLIF((SELECT COUNT(*) FROM {shard} c WHERE c.product_id = v.product_id), 0)
+          AND s.quantity >= v.quantity
+        RETURNING s.product_id
+    )
+    SELECT v.product_id,
+           v.product_id IN (SELECT product_id FROM taken),
+           EXISTS (SELECT 1 FROM {shard} c WHERE c.product_id = v.product_id)
+    FROM v
+"""
+
+RETURN_SQL = """
+    UPDATE {shard} AS s SET quantity = s.quantity + v.quantity
+    FROM (VALUES {values}) AS v (product_id, pick, quantity)
+    WHERE s.product_id = v.product_id
+      AND s.shard = v.pick %% NULLIF((SELECT COUNT(*) FROM {shard} c WHERE c.product_id = v.product_id), 0)
+"""
+
+HOLD_SQL = """
+    INSERT INTO {hold} (user_id, product_id, quantity, expires_at)
+    VALUES {values}
+    ON CONFLICT (user_id, product_id)
+    DO UPDATE SET quantity = {hold}.quantity + EXCLUDED.quantity, expires_at = EXCLUDED.expires_at
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Insufficient stock for products {self.product_ids}")
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _picks(amounts):
+    # (product_id, random shard, quantity) rows in product order, so
+    # concurrent statements touch shards in the same order
+    rows = []
+    for product_id in sorted(amounts):
+        rows += [product_id, random.randrange(settings.STOCK_SHARDS), amounts[product_id]]
+    values = ', '.join(['(%s::bigint, %s::integer, %s::integer)'] * len(amounts))
+    return values, rows
+
+
+def set_stock(product_id, quantity):
+    """Replace a product's stock, spread evenly over STOCK_SHARDS rows."""
+    shards = settings.STOCK_SHARDS
+    with transaction.atomic():
+        StockShard.objects.filter(product_id=product_id).delete()
+        StockShard.objects.bulk_create([
+            StockShard(product_id=product_id, shard=i, quantity=quantity // shards + (i < quantity % shards))
+            for i in range(shards)
+        ])
+
+
+def stock_levels(product_ids):
+    """Available stock per tracked product; untracked products are left out."""
+    rows = (
+        StockShard.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(total=Sum('quantity'))
+    )
+    return {row['product_id']: row['total'] for row in rows}
+
+
+def return_stock(amounts):
+    amounts = {product_id: quantity for product_id, quantity in amounts.items() if quantity > 0}
+    if not amounts:
+        return
+    values, params = _picks(amounts)
+    with connection.cursor() as cursor:
+        cursor.execute(RETURN_SQL.format(shard=_table(StockShard), values=values), params)
+
+
+def _take(amounts):
+    """
+    Take what's available of `amounts` ({product_id: quantity}). Returns
+    (taken, short): the tracked products that were decremented and those
+    that didn't have enough. Short and untracked products are untouched.
+    Must run inside a transaction.
+    """
+    amounts = {product_id: quantity for product_id, quantity in amounts.items() if quantity > 0}
+    if not amounts:
+        return set(), set()
+
+    # A shard the fast path waited on stays locked even when it turned out
+    # short, so undo the whole attempt before locking shards in order
+    sid = transaction.savepoint()
+    values, params = _picks(amounts)
+    with connection.cursor() as cursor:
+        cursor.execute(TAKE_SQL.format(shard=_table(StockShard), values=values), params)
+        rows = cursor.fetchall()
+    if all(taken or not tracked for _, taken, tracked in rows):
+        transaction.savepoint_commit(sid)
+        return {product_id for product_id, taken, _ in rows if taken}, set()
+    transaction.savepoint_rollback(sid)
+    remaining = {product_id for product_id, _, tracked in rows if tracked}
+    taken = set()
+
+    # Slow path: some picked shard was short
+    shards = defaultdict(list)
+    for shard in (
+        StockShard.objects.select_for_update()
+        .filter(product_id__in=remaining).order_by('product_id', 'shard')
+    ):
+        shards[shard.product_id].append(shard)
+
+    short, changed = set(), []
+    for product_id, product_shards in shards.items():
+        needed = amounts[product_id]
+        if sum(row.quantity for row in product_shards) < needed:
+            short.add(product_id)
+            continue
+        for row in sorted(product_shards, key=lambda row: -row.quantity):
+            used = min(row.quantity, needed)
+            row.quantity -= used
+            needed -= used
+            changed.append(row)
+            if not needed:
+                break
+        taken.add(product_id)
+    if changed:
+        StockShard.objects.bulk_update(changed, ['quantity'])
+    return taken, short
+
+
+def take_stock(amounts):
+    """Take all of `amounts` or nothing; raises InsufficientStock."""
+    with transaction.atomic():
+        _, short = _take(amounts)
+        if short:
+            raise InsufficientStock(short)
+
+
+def _pop_holds(where, params):
+    # Delete and return (product_id, quantity) in one statement, so a hold
+    # released by the sweeper can't also be consumed by a checkout
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {_table(StockHold)} WHERE {where} RETURNING product_id, quantity', params
+        )
+        return cursor.fetchall()
+
+
+def release_expired_holds(product_ids=None):
+    """Return expired holds to the shards. Returns the number released."""
+    where, params = 'expires_at <= %s', [timezone.now()]
+    if product_ids is not None:
+        where += ' AND product_id = ANY(%s)'
+        params.append(list(product_ids))
+    with transaction.atomic():
+        rows = _pop_holds(where, params)
+        released = Counter()
+        for product_id, quantity in rows:
+            released[product_id] += quantity
+        return_stock(released)
+    return len(rows)
+
+
+def hold_stock(user, amounts):
+    """
+    Move `amounts` ({product_id: quantity}) from the shards into the user's
+    holds, extending their expiry. Returns the products that didn't have
+    enough stock; nothing is held for those.
+
+    Holds are best effort: later quantity changes don't adjust them, and
+    checkout settles any difference between the hold and the cart.
+    """
+    with transaction.atomic():
+        taken, short = _take(amounts)
+        if short and release_expired_holds(short):
+            retaken, short = _take({product_id: amounts[product_id] for product_id in short})
+            taken |= retaken
+        if taken:
+            expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_SECONDS)
+            params = []
+            for product_id in sorted(taken):
+                params += [user.pk, product_id, amounts[product_id], expires_at]
+            values = ', '.join(['(%s, %s, %s, %s)'] * len(taken))
+            with connection.cursor() as cursor:
+                cursor.execute(HOLD_SQL.format(hold=_table(StockHold), values=values), params)
+    return short
+
+
+def release_holds(user, product_ids):
+    with transaction.atomic():
+        return_stock(dict(_pop_holds('user_id = %s AND product_id = ANY(%s)', [user.pk, list(product_ids)])))
+
+
+def commit_stock(user, amounts):
+    """
+    Settle checkout: consume the user's holds on `amounts`, give back what
+    was held beyond it and take any shortfall from the shards. Raises
+    InsufficientStock, leaving everything as it was, if the shortfall can't
+    be covered. Runs a fixed number of statements whatever the cart size.
+    """
+    with transaction.atomic():
+        held = dict(_pop_holds('user_id = %s AND product_id = ANY(%s)', [user.pk, list(amounts)]))
+        return_stock({
+            product_id: quantity - amounts[product_id] for product_id, quantity in held.items()
+        })
+        take_stock({
+            product_id: quantity - held.get(product_id, 0) for product_id, quantity in amounts.items()
+        })
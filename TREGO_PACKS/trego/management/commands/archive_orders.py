@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trego.partitions import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move orders completed or cancelled more than ORDER_ARCHIVE_AFTER_MONTHS months ago to the archive partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, help="Archive orders older than this (default: ORDER_ARCHIVE_AFTER_MONTHS)")
+        parser.add_argument('--batch-size', type=int, help="Orders per transaction (default: ORDER_ARCHIVE_BATCH_SIZE)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        archived = archive_orders(months=options['months'], batch_size=options['batch_size'])
+        self.stdout.write(f"Archived {archived} orders in {time.perf_counter() - start:.1f}s")
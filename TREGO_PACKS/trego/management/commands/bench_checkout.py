@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from trego.checkout import checkout_cart
+from trego.models import Cart, Category, Product
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time checkout for growing cart sizes; all data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 200])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        try:
+            with transaction.atomic():
+                self.run(sizes, options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        user = User.objects.create_user('bench-checkout')
+        category = Category.objects.create(name='bench-checkout')
+        products = Product.objects.bulk_create([
+            Product(name=f"bench {i}", description='', price='1.00', category=category)
+            for i in range(max(sizes))
+        ])
+
+        self.stdout.write(f"{'items':>6} {'median ms':>10} {'max ms':>8} {'queries':>8}")
+        for size in sizes:
+            timings = []
+            for _ in range(repeat):
+                Cart.objects.bulk_create([
+                    Cart(user=user, product=product, quantity=2) for product in products[:size]
+                ])
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    order = checkout_cart(user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                assert order.lines.count() == size
+            self.stdout.write(
+                f"{size:>6} {statistics.median(timings):>10.2f} {max(timings):>8.2f} {len(ctx.captured_queries):>8}"
+            )
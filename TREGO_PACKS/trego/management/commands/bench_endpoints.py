@@ -0,0 +1,182 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from backpack.urls import router
+from trego.serializers import RoleTokenObtainPairSerializer
+
+# Query strings for GET actions that need one to do real work
+ACTION_PARAMS = {
+    'product-search': 'q=daypack',
+    'order-stats': 'group_by=month,category',
+}
+# Streamed dumps of whole tables, not request/response endpoints
+SKIPPED = {'product-export', 'order-export', 'feedback-export'}
+
+
+def endpoints(sample_ids):
+    """
+    (name, url) for every GET route the router in backpack/urls.py exposes:
+    list, retrieve and GET actions. Detail routes use sample_ids[basename]
+    and are skipped without one; routes with other URL arguments are skipped.
+    """
+    for prefix, viewset, basename in router.registry:
+        pk = sample_ids.get(basename)
+        if hasattr(viewset, 'list'):
+            yield f'{basename}-list', f'/api/{prefix}/'
+        if hasattr(viewset, 'retrieve') and pk:
+            yield f'{basename}-detail', f'/api/{prefix}/{pk}/'
+        for extra in viewset.get_extra_actions():
+            if 'get' not in extra.mapping or '(?P' in extra.url_path or (extra.detail and not pk):
+                continue
+            name = f'{basename}-{extra.url_name}'
+            if name in SKIPPED:
+                continue
+            url = f'/api/{prefix}/{pk}/{extra.url_path}/' if extra.detail else f'/api/{prefix}/{extra.url_path}/'
+            if name in ACTION_PARAMS:
+                url += f'?{ACTION_PARAMS[name]}'
+            yield name, url
+
+
+def client_for(user):
+    client = APIClient()
+    token = RoleTokenObtainPairSerializer.get_token(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    return client
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every GET endpoint of the API router in-process: throughput, "
+        "p50/p99 latency and queries per request, optionally against a saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help="Customer to call the API as (default: the one with most orders)")
+        parser.add_argument('--admin', help="Admin for endpoints customers can't read (default: any admin)")
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--with-cache', action='store_true',
+                            help="Keep the configured cache; by default responses aren't cached so views really run")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="Compare against results written earlier with --output")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Relative p99 growth over the baseline counted as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError("--requests must be at least 2")
+        customer, admin = self.users(options['username'], options['admin'])
+        clients = {'customer': client_for(customer)}
+        if admin:
+            clients['admin'] = client_for(admin)
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        cache = {} if options['with_cache'] else {
+            'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        }
+        with override_settings(**cache):
+            results = self.run(clients, options['requests'], options['warmup'])
+
+        regressions = self.report(results, baseline, options['tolerance'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{regressions} endpoint(s) regressed against {options['baseline']}")
+
+    def users(self, username, admin_username):
+        if username:
+            customer = User.objects.filter(username=username).first()
+            if customer is None:
+                raise CommandError(f"User {username} does not exist")
+        else:
+            customer = (
+                User.objects.exclude(profile__user_type='admin')
+                .annotate(order_count=Count('order')).order_by('-order_count', 'id').first()
+            )
+            if customer is None:
+                raise CommandError("No users to benchmark with; run `manage.py seed_data` first")
+        admins = User.objects.filter(profile__user_type='admin')
+        admin = admins.filter(username=admin_username).first() if admin_username else admins.first()
+        if admin_username and admin is None:
+            raise CommandError(f"Admin {admin_username} does not exist")
+        return customer, admin
+
+    def sample_ids(self, client):
+        # Detail routes use the first row the customer can see in each list
+        ids = {}
+        for prefix, _, basename in router.registry:
+            response = client.get(f'/api/{prefix}/')
+            rows = response.data.get('results', []) if response.status_code == 200 else []
+            if rows:
+                ids[basename] = rows[0]['id']
+        return ids
+
+    def run(self, clients, count, warmup):
+        results = {}
+        for name, url in endpoints(self.sample_ids(clients['customer'])):
+            role, client = 'customer', clients['customer']
+            status = client.get(url).status_code
+            if status == 403 and 'admin' in clients:
+                role, client = 'admin', clients['admin']
+                status = client.get(url).status_code
+            if status != 200:
+                results[name] = {'url': url, 'role': role, 'status': status}
+                continue
+
+            for _ in range(warmup):
+                client.get(url)
+            timings, queries = [], 0
+            start = time.perf_counter()
+            for _ in range(count):
+                with CaptureQueriesContext(connection) as ctx:
+                    began = time.perf_counter()
+                    client.get(url)
+                    timings.append((time.perf_counter() - began) * 1000)
+                queries += len(ctx.captured_queries)
+            elapsed = time.perf_counter() - start
+            cuts = statistics.quantiles(timings, n=100)
+            results[name] = {
+                'url': url, 'role': role, 'status': status,
+                'rps': round(count / elapsed, 1), 'p50': round(cuts[49], 2), 'p99': round(cuts[98], 2),
+                'queries': round(queries / count, 2),
+            }
+        return results
+
+    def report(self, results, baseline, tolerance):
+        regressions = 0
+        self.stdout.write(
+            f"{'endpoint':<26} {'role':<8} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'queries':>7}"
+            + ("  vs baseline" if baseline else "")
+        )
+        for name, row in results.items():
+            if row['status'] != 200:
+                self.stdout.write(self.style.WARNING(f"{name:<26} {row['role']:<8} HTTP {row['status']} {row['url']}"))
+                continue
+            line = (
+                f"{name:<26} {row['role']:<8} {row['rps']:>7.1f} {row['p50']:>8.2f} "
+                f"{row['p99']:>8.2f} {row['queries']:>7.2f}"
+            )
+            before = baseline.get(name)
+            if before and before.get('status') == 200:
+                change = (row['p99'] - before['p99']) / before['p99'] if before['p99'] else 0
+                regressed = change > tolerance or row['queries'] > before['queries']
+                line += f"  p99 {change:+.0%}, queries {row['queries'] - before['queries']:+.2f}"
+                if regressed:
+                    regressions += 1
+                    line = self.style.ERROR(line)
+            self.stdout.write(line)
+        return regressions
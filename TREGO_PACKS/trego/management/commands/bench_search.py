@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from trego.models import Category, Product
+from trego.search import search_products
+
+SYLLABLES = 'ba ko ri tes lun mar vo zen qui dra pel sto nix fa gor lem'.split()
+TYPOS = ['backpak', 'levther', 'duffle', 'mesenger', 'waterprof']
+
+
+def vocabulary(rng, size=5000):
+    # Pseudo-words so each term matches a realistic slice of the catalog
+    # rather than half of it
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words) + ['backpack', 'leather', 'duffel', 'messenger', 'waterproof']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic catalog (rolled back afterwards) and time /api/products/search/ queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--keep', action='store_true', help="Commit the seeded products instead of rolling back")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Full-text search benchmarks need PostgreSQL")
+        try:
+            with transaction.atomic():
+                self.seed(options['products'], options['batch_size'])
+                self.run(options['queries'])
+                if not options['keep']:
+                    raise _Rollback
+        except _Rollback:
+            pass
+
+    def seed(self, total, batch_size):
+        rng = random.Random(0)
+        self.words = vocabulary(rng)
+        categories = Category.objects.bulk_create([Category(name=f"bench {i}") for i in range(20)])
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=' '.join(rng.choices(self.words, k=3)),
+                    description=' '.join(rng.choices(self.words, k=12)),
+                    price=rng.randint(5, 500),
+                    category=rng.choice(categories),
+                )
+                for _ in range(min(batch_size, total - offset))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE trego_product')
+        self.stdout.write(f"Seeded {total} products in {time.perf_counter() - start:.1f}s")
+        self.stdout.flush()
+        self.categories = categories
+
+    def run(self, count):
+        rng = random.Random(1)
+        products = Product.objects.select_related('category').defer('search_vector')
+        cases = {
+            'term': lambda: (products, rng.choice(self.words)),
+            'filtered': lambda: (
+                products.filter(category=rng.choice(self.categories), price__lte=rng.randint(50, 400)),
+                rng.choice(self.words),
+            ),
+            'typo': lambda: (products, rng.choice(TYPOS)),
+        }
+        self.stdout.write(f"{'case':<9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, make in cases.items():
+            timings = []
+            for _ in range(count):
+                queryset, term = make()
+                start = time.perf_counter()
+                search_products(queryset, term, 20)
+                timings.append((time.perf_counter() - start) * 1000)
+            cuts = statistics.quantiles(timings, n=100)
+            self.stdout.write(f"{name:<9} {cuts[49]:>8.2f} {cuts[98]:>8.2f} {max(timings):>8.2f}")
@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from trego.models import Category, Order, Product
+from trego.readers import compile_reader
+from trego.renderers import FastJSONRenderer
+from trego.seed import seed
+from trego.serializers import CategorySerializer, OrderSerializer, ProductSerializer
+from trego.views import order_lines
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a dataset (rolled back afterwards) and compare rows/sec of DRF serializers + JSONRenderer "
+        "against trego.readers + FastJSONRenderer for one big response per endpoint"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help="Rows per response")
+        parser.add_argument('--repeat', type=int, default=3, help="Best of this many runs")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                seed(users=20, categories=options['rows'] // 10, products=options['rows'],
+                     orders=options['rows'], feedback=0)
+                self.run(options['rows'], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def cases(self, request, rows):
+        products = ProductSerializer(context={'request': request})
+        orders = OrderSerializer(context={'request': request})
+        categories = CategorySerializer(context={'request': request})
+        return [
+            ('products', products,
+             Product.objects.select_related('category').defer('search_vector').order_by('-id')[:rows]),
+            ('orders', orders,
+             Order.objects.with_totals().prefetch_related(order_lines(orders)).order_by('-id')[:rows]),
+            ('categories', categories, Category.objects.order_by('-id')[:rows]),
+        ]
+
+    def run(self, rows, repeat):
+        request = Request(APIRequestFactory().get('/api/'))
+        self.stdout.write(
+            f"{'endpoint':<11} {'rows':>6} {'DRF rows/s':>11} {'fast rows/s':>12} {'speedup':>8}  same bytes"
+        )
+        for name, serializer, queryset in self.cases(request, rows):
+            def drf():
+                data = serializer.__class__(list(queryset), many=True, context=serializer.context).data
+                return JSONRenderer().render(data)
+
+            def fast():
+                reader = compile_reader(serializer, queryset.model)
+                return FastJSONRenderer().render(reader.read(list(queryset.values(*reader.columns))))
+
+            results = {}
+            for label, build in (('drf', drf), ('fast', fast)):
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    body = build()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                results[label] = (best, body)
+
+            count = queryset.count()
+            (slow, expected), (quick, body) = results['drf'], results['fast']
+            self.stdout.write(
+                f"{name:<11} {count:>6} {count / slow:>11.0f} {count / quick:>12.0f} {slow / quick:>7.1f}x  "
+                f"{'yes' if body == expected else 'NO'}"
+            )
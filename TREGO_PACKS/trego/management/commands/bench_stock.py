@@ -0,0 +1,75 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from trego.inventory import InsufficientStock, set_stock, stock_levels, take_stock
+from trego.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Race many buyers for one SKU and compare shard counts. Uses committed "
+        "rows (each buyer has its own connection) and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=32)
+        parser.add_argument('--stock', type=int, default=2000)
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 4, 16])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The stock benchmark needs PostgreSQL")
+        category = Category.objects.create(name='bench-stock')
+        try:
+            self.stdout.write(
+                f"{'shards':>6} {'buys/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'sold':>6} {'left':>5}"
+            )
+            for shards in options['shards']:
+                product = Product.objects.create(name='bench-stock', description='', price='1.00', category=category)
+                with override_settings(STOCK_SHARDS=shards):
+                    self.run(product, options['buyers'], options['stock'], shards)
+        finally:
+            category.delete()
+
+    def run(self, product, buyers, stock, shards):
+        set_stock(product.id, stock)
+        barrier = threading.Barrier(buyers)
+        timings, errors = [], []
+
+        def buyer():
+            try:
+                barrier.wait()
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        take_stock({product.id: 1})
+                    except InsufficientStock:
+                        return
+                    timings.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buyer) for _ in range(buyers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if errors:
+            raise CommandError(f"{len(errors)} buyer(s) failed: {errors[0]!r}")
+        left = stock_levels([product.id])[product.id]
+        # Every unit sold exactly once: nothing oversold, nothing lost
+        assert len(timings) + left == stock and left == 0, (len(timings), left)
+        cuts = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f"{shards:>6} {len(timings) / elapsed:>8.0f} {cuts[49]:>8.2f} {cuts[98]:>8.2f} {len(timings):>6} {left:>5}"
+        )
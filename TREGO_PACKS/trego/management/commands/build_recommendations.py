@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trego.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute 'frequently bought together' recommendations for products in orders and feedback "
+        "since the last build, or for every product with --full"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every product")
+        parser.add_argument('--batch-size', type=int, help="Products per transaction (default: RECOMMENDATION_BATCH_SIZE)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        build = build_recommendations(full=options['full'], batch_size=options['batch_size'])
+        kind = 'full' if build.full else 'incremental'
+        self.stdout.write(f"Recomputed {build.products} products ({kind}) in {time.perf_counter() - start:.1f}s")
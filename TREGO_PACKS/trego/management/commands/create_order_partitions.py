@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from trego.partitions import ensure_order_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly order partitions through ORDER_PARTITION_MONTHS_AHEAD months from now; "
+        "run it at least monthly"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, help="Months to create ahead (default: ORDER_PARTITION_MONTHS_AHEAD)")
+
+    def handle(self, *args, **options):
+        created = ensure_order_partitions(months_ahead=options['months_ahead'])
+        self.stdout.write(f"Created {len(created)} partitions" + (f": {', '.join(created)}" if created else ''))
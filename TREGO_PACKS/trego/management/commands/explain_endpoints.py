@@ -0,0 +1,122 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from trego.models import Profile
+from trego.seed import seed
+
+
+class _Rollback(Exception):
+    pass
+
+
+def seq_scans(plan):
+    # Every Seq Scan node in an EXPLAIN (FORMAT JSON) plan tree
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a dataset (rolled back afterwards), call each API endpoint and "
+        "EXPLAIN ANALYZE the queries it runs, flagging sequential scans of big tables"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=50000)
+        parser.add_argument('--feedback', type=int, default=20000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help="Ignore sequential scans of tables smaller than this")
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help="Exit with an error if any sequential scan is flagged")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("EXPLAIN ANALYZE output is only understood for PostgreSQL")
+        self.flagged = 0
+        try:
+            with transaction.atomic():
+                data = seed(
+                    users=options['users'], products=options['products'],
+                    orders=options['orders'], feedback=options['feedback'],
+                    log=lambda message: self.stdout.write(f"seeded {message}"),
+                )
+                # Cached responses would hide the queries
+                with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                    self.explain_all(data, options['min_rows'])
+                raise _Rollback
+        except _Rollback:
+            pass
+        if self.flagged and options['fail_on_seq_scan']:
+            raise CommandError(f"{self.flagged} sequential scan(s) flagged")
+
+    def endpoints(self, data):
+        Profile.objects.filter(user=data['users'][1]).update(user_type='admin')
+        # Fresh instances: the bulk-created ones cache their original profile
+        customer = User.objects.get(pk=data['users'][0].pk)
+        admin = User.objects.get(pk=data['users'][1].pk)
+        product_id = data['product_ids'][len(data['product_ids']) // 2]
+        category_id = data['categories'][0].pk
+        return [
+            (customer, '/api/products/'),
+            (customer, '/api/products/?ordering=rating'),
+            (customer, f'/api/products/?category={category_id}'),
+            (customer, f'/api/products/{product_id}/'),
+            (customer, '/api/products/search/?q=leather+daypack'),
+            (customer, '/api/categories/'),
+            (customer, '/api/cart/'),
+            (customer, '/api/orders/'),
+            (customer, '/api/orders/order-history/'),
+            (customer, '/api/orders/order-history/?status=pending'),
+            (customer, f'/api/feedback/?product={product_id}'),
+            (customer, '/api/profiles/'),
+            (admin, '/api/orders/'),
+            (admin, '/api/orders/?status=pending'),
+            (admin, '/api/orders/?status=cancelled'),
+            (admin, '/api/orders/stats/?group_by=month,category'),
+        ]
+
+    def table_sizes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            return dict(cursor.fetchall())
+
+    def explain_all(self, data, min_rows):
+        endpoints = self.endpoints(data)
+        sizes = self.table_sizes()
+        self.stdout.write(f"\n{'endpoint':<58} {'queries':>7} {'db ms':>8}  seq scans")
+        for user, url in endpoints:
+            client = APIClient()
+            client.force_authenticate(user)
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(url)
+            if response.status_code != 200:
+                self.stdout.write(self.style.WARNING(f"{url:<58} HTTP {response.status_code}"))
+                continue
+
+            total_ms, flags = 0.0, []
+            selects = [q['sql'] for q in ctx.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+            for sql in selects:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+                    explained = cursor.fetchone()[0]
+                if isinstance(explained, str):
+                    explained = json.loads(explained)
+                total_ms += explained[0]['Execution Time']
+                for node in seq_scans(explained[0]['Plan']):
+                    table = node['Relation Name']
+                    if sizes.get(table, 0) >= min_rows:
+                        flags.append(f"{table} ({sizes[table]:.0f} rows)")
+
+            label = f"{url} [{user.profile.user_type}]"
+            line = f"{label:<58} {len(selects):>7} {total_ms:>8.2f}  {', '.join(flags) or '-'}"
+            self.flagged += len(flags)
+            self.stdout.write(self.style.ERROR(line) if flags else line)
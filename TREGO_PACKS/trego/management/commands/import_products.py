@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trego.imports import FORMATS, import_products
+
+
+class Command(BaseCommand):
+    help = "Upsert products by sku from a CSV or NDJSON file (- for stdin), the same way POST /api/products/import/ does"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--as', dest='file_format', choices=FORMATS,
+                            help="File format (default: from the extension, else csv)")
+        parser.add_argument('--batch-size', type=int, help="Rows per batch (default: IMPORT_BATCH_SIZE)")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        start = time.perf_counter()
+        try:
+            if path == '-':
+                report = import_products(sys.stdin, file_format, options['batch_size'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as f:
+                    report = import_products(f, file_format, options['batch_size'])
+        except OSError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - start
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['errors']}")
+        rows = report['created'] + report['updated'] + report['unchanged'] + report['failed']
+        self.stdout.write(
+            f"{rows} rows: {report['created']} created, {report['updated']} updated, "
+            f"{report['unchanged']} unchanged, {report['failed']} failed "
+            f"in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)"
+        )
@@ -0,0 +1,121 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# The WSGI paths have to run without the catalog response cache, which the
+# async ones don't have; handle() refuses a WSGI server that answers with
+# cache ETags. Start it with CATALOG_CACHE_TIMEOUT=0 (and FAST_READS=false
+# to compare the same serializers too).
+DEFAULT_PATHS = {
+    'wsgi': ['/api/products/', '/api/orders/order-history/'],
+    'asgi': ['/api/async/products/', '/api/async/orders/order-history/'],
+}
+
+
+async def fetch(url, token, timeout):
+    # Bare HTTP/1.1 over asyncio streams so the client itself can hold
+    # thousands of open connections without a thread each.
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, parts.port or 80), timeout
+    )
+    try:
+        writer.write((
+            f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+            f"Authorization: Bearer {token}\r\nConnection: close\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    return response, (time.perf_counter() - start) * 1000
+
+
+def status_of(response):
+    return int(response.split(b' ', 2)[1]) if response else 0
+
+
+def header_names(response):
+    head = response.split(b'\r\n\r\n', 1)[0].split(b'\r\n')[1:]
+    return {line.split(b':', 1)[0].strip().lower().decode('latin-1') for line in head}
+
+
+async def run_load(urls, token, total, concurrency, timeout):
+    # Latencies of 200 responses only; failed connections and timeouts, and
+    # other statuses, are counted apart
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, non_200 = [], 0, 0
+
+    async def one(i):
+        nonlocal errors, non_200
+        async with semaphore:
+            try:
+                response, elapsed = await fetch(urls[i % len(urls)], token, timeout)
+            except (OSError, asyncio.TimeoutError):
+                errors += 1
+                return
+            if status_of(response) != 200:
+                non_200 += 1
+                return
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies, errors, non_200, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = "Compare throughput and latency of the WSGI and ASGI read paths against running servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', default='http://127.0.0.1:8000', help="Base URL of the WSGI server")
+        parser.add_argument('--asgi', default='http://127.0.0.1:8001', help="Base URL of the ASGI server")
+        parser.add_argument('--username', required=True, help="User whose token the requests carry")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+        token = str(RefreshToken.for_user(user).access_token)
+
+        urls = {
+            name: [options[name].rstrip('/') + path for path in DEFAULT_PATHS[name]]
+            for name in ('wsgi', 'asgi')
+        }
+        for url in urls['wsgi']:
+            try:
+                response, _ = asyncio.run(fetch(url, token, options['timeout']))
+            except (OSError, asyncio.TimeoutError) as e:
+                raise CommandError(f"{url}: {e}")
+            if 'etag' in header_names(response):
+                raise CommandError(
+                    f"{url} is served from the catalog response cache; start the WSGI server "
+                    "with CATALOG_CACHE_TIMEOUT=0 so both servers do the same work"
+                )
+
+        self.stdout.write(
+            f"{'server':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'non-200':>8}"
+        )
+        for name in ('wsgi', 'asgi'):
+            latencies, errors, non_200, elapsed = asyncio.run(run_load(
+                urls[name], token, options['requests'], options['concurrency'], options['timeout']
+            ))
+            if len(latencies) < 2:
+                self.stdout.write(f"{name:<6} no successful requests ({errors} errors, {non_200} non-200)")
+                continue
+            cuts = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                f"{name:<6} {len(latencies) / elapsed:>9.1f} {cuts[49]:>9.1f} {cuts[98]:>9.1f} "
+                f"{errors:>7} {non_200:>8}"
+            )
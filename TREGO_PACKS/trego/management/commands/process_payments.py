@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trego.models import PaymentJob
+from trego.payments import reclaim_stale_jobs, run_payment_job
+
+
+class Command(BaseCommand):
+    help = "Run queued payment jobs, and requeue stale ones (use with PAYMENT_RUNNER=worker)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            reclaimed = reclaim_stale_jobs()
+            if reclaimed:
+                self.stdout.write(f"Requeued {reclaimed} stale payment job(s)")
+            job_ids = list(
+                PaymentJob.objects.filter(status='queued')
+                .order_by('created_at')
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            for job_id in job_ids:
+                # run_payment_job claims each job atomically, so several
+                # workers can poll the same queue
+                run_payment_job(job_id)
+            if job_ids:
+                self.stdout.write(f"Processed {len(job_ids)} payment job(s)")
+            if options['once'] and not job_ids:
+                return
+            if not job_ids:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trego.cache import bump_version
+from trego.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every product's rating aggregates from the feedback table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            updated = rebuild_ratings(batch_size=options['batch_size'])
+        bump_version('product')
+        self.stdout.write(f"Rebuilt ratings for {updated} products in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,21 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from trego.stats import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales rollups behind /api/orders/stats/ from the orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                            help="First day to rebuild (YYYY-MM-DD); default: all")
+        parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                            help="Last day to rebuild (YYYY-MM-DD); default: all")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rows = rebuild_rollups(options['start'], options['end'])
+        self.stdout.write(f"Wrote {rows} rollup rows in {time.perf_counter() - start:.1f}s")
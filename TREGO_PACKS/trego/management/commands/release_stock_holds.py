@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trego.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Return expired cart stock holds to the shards (run from cron, or with --interval)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, sweeping every N seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds()
+            if released:
+                self.stdout.write(f"Released {released} expired hold(s)")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trego.seed import seed
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate users, categories, products, orders, feedback and carts for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--products', type=int, default=50_000)
+        parser.add_argument('--orders', type=int, default=100_000)
+        parser.add_argument('--feedback', type=int, default=50_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=365, help="Spread created_at over this many past days")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable datasets")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def log(message):
+            self.stdout.write(f"[{time.perf_counter() - start:7.1f}s] {message}")
+            self.stdout.flush()
+
+        data = seed(
+            users=options['users'], categories=options['categories'], products=options['products'],
+            orders=options['orders'], feedback=options['feedback'], batch_size=options['batch_size'],
+            days=options['days'], seed_value=options['seed'], log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded in {time.perf_counter() - start:.1f}s; users are named "
+            f"{data['users'][0].username.rsplit('-', 1)[0]}-N"
+        ))
@@ -0,0 +1,123 @@
+import mimetypes
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.http import http_date
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import AllowAny
+
+from .images import VARIANTS, generate_derivatives
+from .models import Product
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Derivatives are content addressed, so clients may keep them forever
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+ORIGINAL_CACHE = 'public, max-age=86400'
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _parse_range(header, size):
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # Suffix range: the last N bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError
+    return start, end
+
+
+def stream_file(request, name, cache_control):
+    """
+    Stream a stored file in chunks, never reading it whole. Answers
+    If-None-Match with 304 and a single `Range: bytes=` request with 206.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        if not default_storage.exists(name):
+            raise Http404("File not found")
+        size = default_storage.size(name)
+        modified = default_storage.get_modified_time(name)
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+
+    etag = f'"{size:x}-{int(modified.timestamp()):x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(modified.timestamp()),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponse(status=304, headers=headers)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read_range(default_storage.open(name, 'rb'), start, length),
+                status=206, content_type=content_type, headers=headers
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(length)
+            return response
+
+    response = FileResponse(default_storage.open(name, 'rb'), content_type=content_type, headers=headers)
+    response.block_size = CHUNK_SIZE
+    return response
+
+
+def serve_media(request, path):
+    # Development only: in production the web server serves MEDIA_ROOT
+    if not settings.SERVE_MEDIA:
+        raise Http404("Media is served by the web server")
+    cache_control = IMMUTABLE_CACHE if path.startswith('derived/') else ORIGINAL_CACHE
+    return stream_file(request, path, cache_control)
+
+
+@api_view(['GET', 'HEAD'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def product_image(request, pk, variant):
+    # Generates the derivative on first request if upload-time processing
+    # hasn't produced it yet, then sends the client to its permanent URL.
+    # Open to <img> tags, so only IMAGE_VARIANTS are built and callers are
+    # rate limited (the 'image' throttle scope).
+    if variant not in VARIANTS:
+        raise Http404("Unknown image variant")
+    product = get_object_or_404(Product.objects.only('id', 'image', 'image_variants'), pk=pk)
+    if not product.image:
+        raise Http404("Product has no image")
+    name = product.image_variants.get(variant)
+    if name is None or product.image_variants.get('source') != product.image.name:
+        name = generate_derivatives(product, variants=[variant])[variant]
+    return redirect(settings.MEDIA_URL + name)
@@ -0,0 +1,349 @@
+import contextvars
+import glob
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger('trego.requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+HELP = {
+    'trego_request_duration_seconds': ('histogram', "Time from the first middleware to the response"),
+    'trego_request_queries': ('histogram', "Database queries run per request"),
+    'trego_response_size_bytes': ('histogram', "Size of non-streamed response bodies"),
+    'trego_request_query_seconds_total': ('counter', "Time spent in database queries"),
+    'trego_request_serializer_seconds_total': ('counter', "Time spent turning objects into response data"),
+    'trego_slow_queries_total': ('counter', "Queries slower than SLOW_QUERY_MS"),
+    'trego_repeated_queries_total': ('counter', "Requests running one statement N_PLUS_ONE_THRESHOLD+ times"),
+    'trego_throttled_requests_total': ('counter', "Requests refused with 429 by a rate limit"),
+    'trego_shed_requests_total': ('counter', "Requests refused with 503 while shedding load"),
+}
+
+# The request being measured on this thread or task. Query wrappers and
+# serializers add to it; outside a request it's None and they do nothing.
+_current = contextvars.ContextVar('trego_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self, path):
+        self.path = path
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+        self.slow_queries = 0
+        self.statements = Counter()
+        self.shed = False
+
+
+class Registry:
+    """
+    Counters and histograms for this process, keyed by (name, labels).
+    Histograms keep per-bucket counts plus the sum and count, so snapshots
+    from several processes add up bucket by bucket.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self.lock:
+            counts = self.histograms.get(key)
+            if counts is None:
+                counts = self.histograms[key] = [0] * (len(buckets) + 3)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(counts)] for (name, labels), counts in self.histograms.items()],
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+BUCKETS = {
+    'trego_request_duration_seconds': LATENCY_BUCKETS,
+    'trego_request_queries': QUERY_BUCKETS,
+    'trego_response_size_bytes': SIZE_BUCKETS,
+}
+
+
+class LatencyWindow:
+    """The last `size` request durations in this process, for load shedding."""
+
+    def __init__(self, size=10000):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=size)
+
+    def add(self, duration):
+        with self.lock:
+            self.samples.append((time.monotonic(), duration))
+
+    def p99(self, seconds, minimum=20):
+        # None until there are `minimum` samples from the last `seconds`
+        since = time.monotonic() - seconds
+        with self.lock:
+            durations = sorted(duration for at, duration in self.samples if at >= since)
+        if len(durations) < minimum:
+            return None
+        return durations[int(len(durations) * 0.99)]
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+
+latencies = LatencyWindow()
+
+
+def recent_p99(seconds):
+    return latencies.p99(seconds)
+
+
+def mark_shed():
+    # Shed requests are quick and don't say how fast served ones are, so
+    # they're left out of the latency window
+    stats = _current.get()
+    if stats is not None:
+        stats.shed = True
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection (see install_query_recorder)
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.query_seconds += elapsed
+        stats.statements[sql] += 1
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            stats.slow_queries += 1
+            logger.warning("slow query", extra={
+                'path': stats.path, 'duration_ms': round(elapsed * 1000, 1), 'sql': sql[:1000],
+            })
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver: the same hook connection.execute_wrapper()
+    installs, but kept for the connection's lifetime. Async views run their
+    queries on another thread than the middleware, so a wrapper entered
+    around the request wouldn't see them; this one finds the request
+    through the context variable, which sync_to_async carries over.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing():
+    # Adds the time spent inside to the request's serializer time; nested
+    # uses aren't counted twice
+    stats = _current.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializing = False
+        stats.serializer_seconds += time.perf_counter() - start
+
+
+class SerializerTimingMixin:
+    # Lazy queries made while serializing count as serializer time too
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+def start_request(request):
+    stats = RequestStats(request.path)
+    return stats, _current.set(stats), time.perf_counter()
+
+
+def finish_request(request, response, stats, token, started):
+    _current.reset(token)
+    duration = time.perf_counter() - started
+    match = getattr(request, 'resolver_match', None)
+    route = match.view_name if match else 'unmatched'
+    labels = (route, request.method)
+    size = None if response.streaming else len(response.content)
+
+    registry.observe('trego_request_duration_seconds', labels + (f'{response.status_code // 100}xx',),
+                     duration, LATENCY_BUCKETS)
+    registry.observe('trego_request_queries', labels, stats.queries, QUERY_BUCKETS)
+    registry.inc('trego_request_query_seconds_total', labels, stats.query_seconds)
+    registry.inc('trego_request_serializer_seconds_total', labels, stats.serializer_seconds)
+    if size is not None:
+        registry.observe('trego_response_size_bytes', labels, size, SIZE_BUCKETS)
+    if stats.slow_queries:
+        registry.inc('trego_slow_queries_total', labels, stats.slow_queries)
+    if stats.shed:
+        registry.inc('trego_shed_requests_total', labels)
+    else:
+        latencies.add(duration)
+    if response.status_code == 429:
+        registry.inc('trego_throttled_requests_total', labels)
+
+    record = {
+        'route': route, 'method': request.method, 'path': request.path, 'status': response.status_code,
+        'duration_ms': round(duration * 1000, 1), 'queries': stats.queries,
+        'query_ms': round(stats.query_seconds * 1000, 1),
+        'serializer_ms': round(stats.serializer_seconds * 1000, 1), 'bytes': size,
+    }
+    sql, repeats = stats.statements.most_common(1)[0] if stats.statements else (None, 0)
+    if repeats >= settings.N_PLUS_ONE_THRESHOLD:
+        registry.inc('trego_repeated_queries_total', labels)
+        logger.warning("repeated query, possible N+1", extra={**record, 'repeats': repeats, 'sql': sql[:1000]})
+
+    # Shed requests are counted, not logged one by one
+    failed = response.status_code >= 500 and not stats.shed
+    if failed or duration * 1000 >= settings.SLOW_REQUEST_MS:
+        logger.warning("slow or failed request", extra=record)
+    elif random.random() < settings.REQUEST_LOG_SAMPLE_RATE:
+        logger.info("request", extra=record)
+    flush()
+
+
+# With several worker processes, each writes its snapshot to METRICS_DIR at
+# most every METRICS_FLUSH_SECONDS and /metrics adds all of them up. Files
+# are named by PID; those of workers that have exited are removed rather
+# than summed, so the directory must only be shared by processes on one host.
+_last_flush = 0.0
+
+
+def flush(force=False):
+    global _last_flush
+    if not settings.METRICS_DIR or (not force and time.monotonic() - _last_flush < settings.METRICS_FLUSH_SECONDS):
+        return
+    _last_flush = time.monotonic()
+    path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+
+def collect():
+    if not settings.METRICS_DIR:
+        return [registry.snapshot()]
+    flush(force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        if not _running(os.path.basename(path)[:-len('.json')]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _running(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        # Not a snapshot this module wrote
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(values, le=None):
+    pairs = [f'{key}="{value}"' for key, value in zip(('route', 'method', 'status'), values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render(snapshots):
+    """Prometheus text exposition of the given registry snapshots, summed."""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts in snapshot['histograms']:
+            key = (name, tuple(labels))
+            total = histograms.setdefault(key, [0] * len(counts))
+            histograms[key] = [a + b for a, b in zip(total, counts)]
+
+    lines = []
+    for name, (kind, text) in HELP.items():
+        lines += [f'# HELP {name} {text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            continue
+        for (metric, labels), counts in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS[name] + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {counts[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {counts[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    # Routes and latencies aren't for everyone: without METRICS_TOKEN the
+    # endpoint is only open under DEBUG
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+    else:
+        allowed = settings.DEBUG
+    if not allowed:
+        return HttpResponse("Forbidden", status=403, content_type='text/plain')
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
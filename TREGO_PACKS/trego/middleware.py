@@ -0,0 +1,34 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import finish_request, start_request
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count and time, serializer time and response
+    size per route and method (see trego/metrics.py), and logs a sample of
+    requests plus every slow, failed or N+1-looking one. Goes first in
+    MIDDLEWARE so the timings cover the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = start_request(request)
+        response = self.get_response(request)
+        finish_request(request, response, stats, token, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = start_request(request)
+        response = await self.get_response(request)
+        finish_request(request, response, stats, token, started)
+        return response
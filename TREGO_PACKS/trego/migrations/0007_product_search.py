@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The trigger keeps search_vector current for every write path, including
+# bulk_create() and queryset.update(), which bypass model signals. It only
+# fires when name or description are written, not on the hot rating, stock
+# and image updates.
+SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE FUNCTION trego_product_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trego_product_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, description ON trego_product
+    FOR EACH ROW EXECUTE FUNCTION trego_product_search_vector();
+
+UPDATE trego_product SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS trego_product_search_vector_update ON trego_product;
+DROP FUNCTION IF EXISTS trego_product_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0006_paymentjob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('name', name='gin_trgm_ops'), name='product_name_trgm_idx'),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+BACKFILL_RATINGS = """
+UPDATE trego_product p SET
+    rating_count = f.count,
+    rating_sum = f.total,
+    rating_avg = round(f.total::numeric / f.count, 2),
+    rating_1 = f.stars_1, rating_2 = f.stars_2, rating_3 = f.stars_3,
+    rating_4 = f.stars_4, rating_5 = f.stars_5
+FROM (
+    SELECT product_id, count(*) AS count, sum(rating) AS total,
+           count(*) FILTER (WHERE rating = 1) AS stars_1,
+           count(*) FILTER (WHERE rating = 2) AS stars_2,
+           count(*) FILTER (WHERE rating = 3) AS stars_3,
+           count(*) FILTER (WHERE rating = 4) AS stars_4,
+           count(*) FILTER (WHERE rating = 5) AS stars_5
+    FROM trego_feedback GROUP BY product_id
+) f
+WHERE p.id = f.product_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0007_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-rating_avg', '-rating_count', '-id'], name='product_rating_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_RATINGS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 10000
+
+# Each single-product order becomes an order with one line. The price at
+# purchase time was never stored, so the current product price is the best
+# available stand-in.
+COPY_LINES = """
+INSERT INTO trego_orderline (order_id, product_id, quantity, unit_price)
+SELECT o.id, o.product_id, o.quantity, p.price
+FROM trego_order o JOIN trego_product p ON p.id = o.product_id
+WHERE o.id > %s AND o.id <= %s
+  AND NOT EXISTS (SELECT 1 FROM trego_orderline l WHERE l.order_id = o.id)
+"""
+
+# Reverse: an order keeps its first line only
+RESTORE_ORDERS = """
+UPDATE trego_order o SET product_id = l.product_id, quantity = l.quantity
+FROM (
+    SELECT DISTINCT ON (order_id) order_id, product_id, quantity
+    FROM trego_orderline ORDER BY order_id, id
+) l
+WHERE o.id = l.order_id AND o.id > %s AND o.id <= %s
+"""
+
+
+def run_in_batches(sql):
+    # Walk the order ids in fixed ranges, committing each, so no transaction
+    # touches (and locks) the whole table. A run cut short can be resumed:
+    # orders that already have lines are skipped.
+    def run(apps, schema_editor):
+        Order = apps.get_model('trego', 'Order')
+        last = Order.objects.aggregate(last=models.Max('id'))['last'] or 0
+        for start in range(0, last, BATCH_SIZE):
+            with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+                cursor.execute(sql, [start, start + BATCH_SIZE])
+    return run
+
+
+class Migration(migrations.Migration):
+    # Batches commit one by one (see run_in_batches)
+    atomic = False
+
+    dependencies = [
+        ('trego', '0010_stock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='trego.product'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='trego.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='trego.product')),
+            ],
+        ),
+        migrations.RunPython(run_in_batches(COPY_LINES), run_in_batches(RESTORE_ORDERS)),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0011_orderline'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='order',
+            name='product',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='quantity',
+        ),
+    ]
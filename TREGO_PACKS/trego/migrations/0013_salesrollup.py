@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+# Same grouping as trego.stats, over every existing order (dates in UTC,
+# the project's TIME_ZONE)
+BACKFILL_ROLLUPS = """
+INSERT INTO trego_salesrollup (day, category_id, status, orders, units, revenue)
+SELECT day, COALESCE(category_id, 0), status, orders, units, revenue
+FROM (
+    SELECT (o.created_at AT TIME ZONE 'UTC')::date AS day, o.status, p.category_id,
+           COUNT(DISTINCT o.id) AS orders, SUM(l.quantity) AS units,
+           SUM(l.quantity * l.unit_price) AS revenue
+    FROM trego_order o
+    JOIN trego_orderline l ON l.order_id = o.id
+    JOIN trego_product p ON p.id = l.product_id
+    GROUP BY GROUPING SETS ((day, o.status, p.category_id), (day, o.status))
+) s;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0012_remove_order_product_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category_id', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('shipped', 'Shipped'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'unique_together': {('day', 'category_id', 'status')},
+            },
+        ),
+        migrations.RunSQL(BACKFILL_ROLLUPS, migrations.RunSQL.noop),
+    ]
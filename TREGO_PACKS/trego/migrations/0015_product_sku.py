@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Products is a large, hot table: add the column (nullable, so no
+    # rewrite), build its unique index without blocking writes, then attach
+    # the index as the constraint Django expects for unique=True
+    atomic = False
+
+    dependencies = [
+        ('trego', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='product',
+                    name='sku',
+                    field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+                ),
+            ],
+            database_operations=[
+                migrations.AddField(
+                    model_name='product',
+                    name='sku',
+                    field=models.CharField(blank=True, max_length=64, null=True),
+                ),
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS trego_product_sku_key ON trego_product (sku)',
+                    'DROP INDEX CONCURRENTLY IF EXISTS trego_product_sku_key',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE trego_product ADD CONSTRAINT trego_product_sku_key UNIQUE USING INDEX trego_product_sku_key',
+                    'ALTER TABLE trego_product DROP CONSTRAINT trego_product_sku_key',
+                ),
+            ],
+        ),
+    ]
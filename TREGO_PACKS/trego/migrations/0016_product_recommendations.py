@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0015_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendation', serialize=False, to='trego.product')),
+                ('neighbours', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('scores', django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), size=None)),
+                ('computed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecommendationBuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('last_order_id', models.BigIntegerField(default=0)),
+                ('last_feedback_id', models.BigIntegerField(default=0)),
+                ('products', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
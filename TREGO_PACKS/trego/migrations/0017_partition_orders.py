@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Rebuild trego_order as a partitioned table (see trego.partitions):
+#   trego_order            LIST (archived)
+#     trego_order_hot      archived = false, RANGE (created_at) by month
+#       trego_order_yYYYYmMM, one per month from the oldest order to 3 ahead
+#       trego_order_hot_default
+#     trego_order_archive  archived = true, RANGE (created_at) by year,
+#                          partitions created by `manage.py archive_orders`
+# The primary key has to include the partition keys, so nothing can hold a
+# foreign key to orders any more; lines and payment jobs keep theirs in
+# Django only. Ids keep coming from a sequence, as identity columns aren't
+# allowed on partitioned tables before Postgres 17.
+# The copy holds an exclusive lock on orders for its duration.
+PARTITION_ORDERS = """
+ALTER TABLE trego_order RENAME TO trego_order_unpartitioned;
+ALTER TABLE trego_order_unpartitioned ALTER COLUMN id DROP IDENTITY IF EXISTS;
+ALTER TABLE trego_order_unpartitioned ALTER COLUMN id DROP DEFAULT;
+DROP SEQUENCE IF EXISTS trego_order_id_seq;
+
+CREATE SEQUENCE trego_order_id_seq;
+CREATE TABLE trego_order (
+    id bigint NOT NULL DEFAULT nextval('trego_order_id_seq'),
+    status varchar(20) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    user_id integer NOT NULL REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED,
+    archived boolean NOT NULL DEFAULT false,
+    PRIMARY KEY (id, archived, created_at)
+) PARTITION BY LIST (archived);
+ALTER SEQUENCE trego_order_id_seq OWNED BY trego_order.id;
+
+CREATE TABLE trego_order_hot PARTITION OF trego_order FOR VALUES IN (false) PARTITION BY RANGE (created_at);
+CREATE TABLE trego_order_hot_default PARTITION OF trego_order_hot DEFAULT;
+CREATE TABLE trego_order_archive PARTITION OF trego_order FOR VALUES IN (true) PARTITION BY RANGE (created_at);
+
+DO $$
+DECLARE month timestamptz;
+BEGIN
+    FOR month IN
+        SELECT generate_series(first, date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                                      + interval '3 months', interval '1 month')
+        FROM (
+            SELECT date_trunc('month', LEAST(min(created_at), now()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS first
+            FROM trego_order_unpartitioned
+        ) s
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF trego_order_hot FOR VALUES FROM (%L) TO (%L)',
+            'trego_order_' || to_char(month AT TIME ZONE 'UTC', '"y"YYYY"m"MM'), month, month + interval '1 month'
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO trego_order (id, status, created_at, user_id)
+SELECT id, status, created_at, user_id FROM trego_order_unpartitioned;
+SELECT setval('trego_order_id_seq', COALESCE(max(id), 0) + 1, false) FROM trego_order;
+DROP TABLE trego_order_unpartitioned;
+"""
+
+UNPARTITION_ORDERS = """
+CREATE TABLE trego_order_unpartitioned (
+    id bigint NOT NULL GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    status varchar(20) NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    user_id integer NOT NULL REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED
+);
+INSERT INTO trego_order_unpartitioned (id, status, created_at, user_id)
+SELECT id, status, created_at, user_id FROM trego_order;
+SELECT setval(pg_get_serial_sequence('trego_order_unpartitioned', 'id'), COALESCE(max(id), 0) + 1, false)
+FROM trego_order_unpartitioned;
+DROP TABLE trego_order;
+ALTER TABLE trego_order_unpartitioned RENAME TO trego_order;
+ALTER SEQUENCE trego_order_unpartitioned_id_seq RENAME TO trego_order_id_seq;
+"""
+
+# Created on the parent, so every partition gets its own copy, once the
+# rows are in and their (deferred) user foreign keys are checked
+INDEXES = """
+SET CONSTRAINTS ALL IMMEDIATE;
+CREATE INDEX order_created_id_idx ON trego_order (created_at DESC, id DESC);
+CREATE INDEX order_user_created_idx ON trego_order (user_id, created_at DESC, id DESC);
+CREATE INDEX order_pending_idx ON trego_order (created_at DESC, id DESC) WHERE status = 'pending';
+CREATE INDEX order_status_created_idx ON trego_order (status, created_at DESC);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0016_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderline',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='trego.order'),
+        ),
+        migrations.AlterField(
+            model_name='paymentjob',
+            name='order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='payment_jobs', to='trego.order'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='order',
+                    name='archived',
+                    field=models.BooleanField(default=False),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(PARTITION_ORDERS + INDEXES, UNPARTITION_ORDERS + INDEXES),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+# 0007 now creates the trigger for name and description updates only;
+# databases migrated before that still rebuild search_vector on every
+# product UPDATE (ratings, stock, image variants)
+NARROW_TRIGGER = """
+DROP TRIGGER IF EXISTS trego_product_search_vector_update ON trego_product;
+CREATE TRIGGER trego_product_search_vector_update
+    BEFORE INSERT OR UPDATE OF name, description ON trego_product
+    FOR EACH ROW EXECUTE FUNCTION trego_product_search_vector();
+"""
+
+WIDEN_TRIGGER = """
+DROP TRIGGER IF EXISTS trego_product_search_vector_update ON trego_product;
+CREATE TRIGGER trego_product_search_vector_update
+    BEFORE INSERT OR UPDATE ON trego_product
+    FOR EACH ROW EXECUTE FUNCTION trego_product_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trego', '0017_partition_orders'),
+    ]
+
+    operations = [
+        migrations.RunSQL(NARROW_TRIGGER, WIDEN_TRIGGER),
+    ]
@@ -0,0 +1,125 @@
+from django.conf import settings
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+from .metrics import serializing
+from .pagination import KeysetPagination
+from .readers import compile_reader
+
+
+def unrendered_columns(serializer, model, keep=(), prefix=''):
+    """
+    defer() lookups for the model columns `serializer` won't render,
+    following nested serializers over forward relations. `keep` names
+    columns needed anyway, such as the pagination key.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    sources = getattr(serializer, 'method_field_sources', {})
+    used, nested = set(keep), {}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*':
+            used.update(sources.get(name, ()))
+            continue
+        source = field.source.split('.')[0]
+        used.add(source)
+        if isinstance(field, BaseSerializer):
+            nested[source] = field
+
+    columns = [
+        prefix + model_field.name for model_field in model._meta.concrete_fields
+        if not model_field.primary_key and model_field.name not in used
+    ]
+    for source, field in nested.items():
+        relation = model._meta.get_field(source)
+        if relation.concrete and relation.is_relation:
+            columns += unrendered_columns(field, relation.related_model, prefix=f'{prefix}{source}__')
+    return columns
+
+
+def select_for_serializer(queryset, serializer, select_related=(), keep=()):
+    # Defer what the serializer won't render, and cut select_related paths
+    # short where they'd join a relation nobody reads
+    deferred = set(unrendered_columns(serializer, queryset.model, keep))
+    joins = []
+    for path in select_related:
+        kept = []
+        for part in path.split('__'):
+            if '__'.join(kept + [part]) in deferred:
+                break
+            kept.append(part)
+        if kept:
+            joins.append('__'.join(kept))
+    if joins:
+        queryset = queryset.select_related(*joins)
+    return queryset.defer(*deferred) if deferred else queryset
+
+
+class OptimizedQuerySetMixin:
+    # Each viewset declares how its rows should be loaded so nested
+    # serializers (product -> category, order -> product) don't fire a
+    # query per row.
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    only_fields = ()
+    defer_fields = ()
+    # Also defer whatever ?fields= / ?expand= leave out of the response
+    # (see FieldSelectionMixin), and skip joins nobody reads
+    defer_unrendered = False
+
+    def get_queryset(self):
+        return self.optimize_queryset(super().get_queryset())
+
+    def rendered_serializer(self):
+        # The serializer this request renders with, built once
+        if not hasattr(self, '_rendered_serializer'):
+            self._rendered_serializer = self.get_serializer()
+        return self._rendered_serializer
+
+    def optimize_queryset(self, queryset):
+        if self.defer_unrendered:
+            ordering = getattr(self, 'cursor_ordering', KeysetPagination.ordering)
+            queryset = select_for_serializer(
+                queryset, self.rendered_serializer(), self.select_related_fields,
+                keep=[name.lstrip('-') for name in ordering]
+            )
+        elif self.select_related_fields:
+            queryset = queryset.select_related(*self.select_related_fields)
+        if self.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*self.prefetch_related_fields)
+        if self.only_fields:
+            queryset = queryset.only(*self.only_fields)
+        if self.defer_fields:
+            queryset = queryset.defer(*self.defer_fields)
+        return queryset
+
+
+class FastReadMixin:
+    """
+    Serves list() from values() rows turned into the serializer's output by
+    a compiled trego.readers.Reader, skipping model instances and DRF's
+    per-field machinery; the JSON is the same. Serializers with fields the
+    reader can't reproduce, and FAST_READS = False, use the normal path.
+    """
+
+    def list(self, request, *args, **kwargs):
+        response = self.fast_list(self.get_queryset())
+        if response is None:
+            return super().list(request, *args, **kwargs)
+        return response
+
+    def fast_list(self, queryset):
+        # A paginated Response for the queryset, or None to go through DRF
+        if not settings.FAST_READS:
+            return None
+        reader = compile_reader(self.get_serializer(), queryset.model)
+        if reader is None:
+            return None
+        ordering = getattr(self, 'cursor_ordering', KeysetPagination.ordering)
+        columns = dict.fromkeys(reader.columns + [name.lstrip('-') for name in ordering])
+        rows = self.filter_queryset(queryset).prefetch_related(None).values(*columns)
+        page = self.paginate_queryset(rows)
+        with serializing():
+            data = reader.read(list(rows) if page is None else page)
+        return Response(data) if page is None else self.get_paginated_response(data)
@@ -1,4 +1,12 @@
+import uuid
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
 
 class Profile(models.Model):
@@ -19,29 +27,124 @@ class Category(models.Model):
     def __str__(self):
         return self.name
     
+# Product columns written only by ratings.py's UPDATEs
+RATING_FIELDS = ('rating_count', 'rating_sum', 'rating_avg', *(f'rating_{star}' for star in range(1, 6)))
+
 class Product(models.Model):
+    # Supplier's stock keeping unit; bulk imports upsert on it (see imports.py)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
+    # Indexed by product_category_created_idx, which leads with category
+    category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE, db_index=False)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Storage names of the resized/WebP derivatives of `image` (see images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Weighted name/description tsvector, kept current by a database
+    # trigger (see migration 0007)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Feedback aggregates, maintained incrementally by signals.py and rebuilt
+    # from scratch by `manage.py rebuild_ratings`. rating_N counts N-star rows.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            models.Index(fields=['-rating_avg', '-rating_count', '-id'], name='product_rating_idx'),
+            # ?category= listings, newest first
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='product_name_trgm_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        # Saving an existing product (API, admin) leaves the rating columns
+        # alone: writing back the values loaded with it would undo feedback
+        # applied since
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
     
-class Cart(models.Model):
+class StockShard(models.Model):
+    # A product's stock is split over STOCK_SHARDS rows (shard 0..n-1) so
+    # concurrent buyers decrement different rows instead of queueing on one
+    # row lock. Products without shards are not stock tracked.
+    product = models.ForeignKey(Product, related_name='stock_shards', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('product', 'shard')
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.quantity}"
+
+class StockHold(models.Model):
+    # Stock taken out of the shards when an item goes into a cart. Checkout
+    # turns it into a sale; past expires_at it is returned to the shards by
+    # `manage.py release_stock_holds` (or on demand when stock runs short).
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='stock_holds', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'product')
+        indexes = [
+            models.Index(fields=['expires_at'], name='stockhold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} holds {self.quantity} of {self.product_id}"
+
+class Cart(models.Model):
+    # Lookups by user go through the indexes below, which lead with it
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [
+            models.Index(fields=['user', '-added_at', '-id'], name='cart_user_added_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name}"
     
+ORDER_TOTAL_FIELD = models.DecimalField(max_digits=12, decimal_places=2)
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        # The order total is summed by the database from the captured line
+        # prices, one row per order, without joining the lines into the
+        # outer query (which would multiply its rows and break pagination)
+        totals = (
+            OrderLine.objects.filter(order=OuterRef('pk')).order_by().values('order')
+            .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=ORDER_TOTAL_FIELD))
+            .values('total')
+        )
+        return self.annotate(
+            total=Coalesce(Subquery(totals, output_field=ORDER_TOTAL_FIELD), Value(Decimal('0.00')))
+        )
+
 class Order(models.Model):
 
     ORDER_STATUS_CHOICES = (
@@ -51,21 +154,144 @@ class Order(models.Model):
         ('cancelled', 'Cancelled'),
     )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField(default=1)
+    # Indexed by order_user_created_idx, which leads with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     status = models.CharField(max_length=20,choices=ORDER_STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    # The table is partitioned on (archived, created_at): live orders by
+    # month, archived ones by year (trego/partitions.py). Filtering on
+    # archived=False keeps queries off the archive.
+    archived = models.BooleanField(default=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+            # A customer's order history, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            # Orders still awaiting payment are a small, hot slice of the table
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(status='pending'),
+                         name='order_pending_idx'),
+            # Admin listing filtered by any other status
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The status the sales rollups currently count this order under
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
 
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+class OrderLine(models.Model):
+    # unit_price is the product's price at checkout, so totals and revenue
+    # don't move when the catalog price changes
+    # No constraint in the database: orders are partitioned, and their
+    # primary key is (id, archived, created_at). Deletes still cascade.
+    order = models.ForeignKey(Order, related_name='lines', on_delete=models.CASCADE, db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in order {self.order_id}"
+
+class SalesRollup(models.Model):
+    # Orders, units and revenue per day, category and status, maintained
+    # incrementally by trego/stats.py and rebuilt by `manage.py
+    # rebuild_sales_stats`. category_id 0 holds the all-categories totals:
+    # an order spanning categories counts once there, once per category
+    # otherwise. Not a foreign key, so deleting a category keeps its history.
+    day = models.DateField()
+    category_id = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=Order.ORDER_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('day', 'category_id', 'status')
+
+    def __str__(self):
+        return f"{self.day} {self.category_id} {self.status}: {self.revenue}"
+
+class ProductRecommendation(models.Model):
+    # Products most often bought (or rated highly) together with `product`,
+    # best first, with their cosine similarity; one row per product so a
+    # lookup reads K ids. Built offline by recommendations.py.
+    product = models.OneToOneField(Product, primary_key=True, related_name='recommendation',
+                                   on_delete=models.CASCADE)
+    neighbours = ArrayField(models.IntegerField())
+    scores = ArrayField(models.FloatField())
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{len(self.neighbours)} recommendations for {self.product_id}"
+
+class RecommendationBuild(models.Model):
+    # One run of `manage.py build_recommendations`. The next incremental run
+    # only recomputes products in orders and feedback after these ids.
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    last_order_id = models.BigIntegerField(default=0)
+    last_feedback_id = models.BigIntegerField(default=0)
+    products = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{'Full' if self.full else 'Incremental'} build {self.pk}: {self.products} products"
+
 class Feedback(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Indexed by feedback_product_created_idx, which leads with product
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     rating = models.PositiveSmallIntegerField(choices=[(i,i) for i in range(1,6)])
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='feedback_created_id_idx'),
+            # A product's reviews, newest first
+            models.Index(fields=['product', '-created_at', '-id'], name='feedback_product_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the product aggregates currently count for this row
+        instance._loaded_rating = instance.__dict__.get('rating')
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
+
+    def __str__(self):
+        return f"Feedback by {self.user.username} - {self.rating} stars"
+
+class PaymentJob(models.Model):
+
+    JOB_STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(Order, related_name='payment_jobs', on_delete=models.CASCADE, db_constraint=False)
+    status = models.CharField(max_length=20, choices=JOB_STATUS_CHOICES, default='queued')
+    reference = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='paymentjob_status_idx'),
+        ]
+
     def __str__(self):
-        return f"Feedback by {self.user.username} - {self.rating} stars"
\ No newline at end of file
+        return f"Payment {self.id} - Order {self.order_id} ({self.status})"
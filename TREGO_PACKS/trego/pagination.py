@@ -0,0 +1,146 @@
+import base64
+import json
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite key, `(created_at, id)` by default.
+
+    Each page is fetched with `WHERE (created_at, id) < (last seen)` instead
+    of an OFFSET, so page 10,000 costs the same as page 1 as long as an
+    index matches the ordering. Views can override the key with a
+    `cursor_ordering` attribute; the last field must be unique.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # Same page, fetched with the async ORM for the ASGI views
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        self.fields = [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor['r'])
+        ordering = [self.flip(name) for name in self.ordering] if self.reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if self.cursor:
+            queryset = queryset.filter(self.after(ordering, self.cursor['v']))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        # Moving backwards, "more" means there is a previous page; the page
+        # we came from always exists in the other direction.
+        self.has_next = has_more if not self.reverse else True
+        self.has_previous = bool(self.cursor) if not self.reverse else has_more
+        self.first, self.last = (rows[0], rows[-1]) if rows else (None, None)
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, reverse=True)
+
+    def after(self, ordering, values):
+        # Lexicographic "comes after" for the ordering, written so the
+        # leading column also gets a plain range bound the index can use.
+        lookups = ['lt' if name.startswith('-') else 'gt' for name in ordering]
+        names = [name.lstrip('-') for name in ordering]
+
+        condition = Q()
+        for i in range(len(names)):
+            step = Q(**{f"{names[i]}__{lookups[i]}": values[i]})
+            for j in range(i):
+                step &= Q(**{names[j]: values[j]})
+            condition |= step
+        bound = 'lte' if lookups[0] == 'lt' else 'gte'
+        return Q(**{f"{names[0]}__{bound}": values[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(cursor['v']) != len(self.fields):
+                raise ValueError
+            values = [field.to_python(value) for field, value in zip(self.fields, cursor['v'])]
+            return {'v': values, 'r': bool(cursor.get('r'))}
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        if isinstance(row, dict):
+            # A values() row (see FastReadMixin)
+            row = SimpleNamespace(**row)
+        cursor = {'v': [field.value_to_string(row) for field in self.fields]}
+        if reverse:
+            cursor['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def flip(name):
+        return name[1:] if name.startswith('-') else f"-{name}"
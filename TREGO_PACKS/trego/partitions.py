@@ -0,0 +1,121 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order
+
+# trego_order is partitioned by LIST (archived): trego_order_hot holds live
+# orders in monthly RANGE (created_at) partitions, plus a default partition
+# for months nobody created; trego_order_archive holds archived orders in
+# yearly partitions (see migration 0017). Bounds are UTC.
+HOT = 'trego_order_hot'
+HOT_DEFAULT = 'trego_order_hot_default'
+ARCHIVE = 'trego_order_archive'
+ARCHIVE_STATUSES = ('completed', 'cancelled')
+
+
+def month_start(moment, months=0):
+    """The UTC month `months` after the one `moment` falls in."""
+    moment = moment.astimezone(dt_timezone.utc)
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def year_start(moment, years=0):
+    return datetime(moment.astimezone(dt_timezone.utc).year + years, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def existing_partitions(parent):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", [parent]
+        )
+        return {name for name, in cursor.fetchall()}
+
+
+def create_partition(parent, name, start, end, tablespace=''):
+    """
+    Attach partition `name` of `parent` for [start, end). Rows for that
+    range in the hot default partition are moved into it first, in the
+    same transaction, since Postgres won't attach over them.
+    """
+    qn = connection.ops.quote_name
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {qn(name)} (LIKE {qn(parent)} INCLUDING DEFAULTS)"
+            + (f" TABLESPACE {qn(tablespace)}" if tablespace else '')
+        )
+        if parent == HOT:
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {qn(HOT_DEFAULT)} WHERE created_at >= %s AND created_at < %s "
+                f"RETURNING *) INSERT INTO {qn(name)} SELECT * FROM moved",
+                [start, end]
+            )
+        cursor.execute(f"ALTER TABLE {qn(parent)} ATTACH PARTITION {qn(name)} FOR VALUES {bounds}")
+
+
+def ensure_order_partitions(since=None, months_ahead=None):
+    """
+    Create the monthly hot partitions from `since` (default: this month)
+    through ORDER_PARTITION_MONTHS_AHEAD months from now. Returns the
+    names created.
+    """
+    months_ahead = settings.ORDER_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    now = timezone.now()
+    month = month_start(min(since or now, now))
+    last = month_start(now, months_ahead)
+    existing = existing_partitions(HOT)
+    created = []
+    while month <= last:
+        name = f'trego_order_y{month:%Y}m{month:%m}'
+        if name not in existing:
+            create_partition(HOT, name, month, month_start(month, 1))
+            created.append(name)
+        month = month_start(month, 1)
+    return created
+
+
+def ensure_archive_partitions(first, last):
+    """Create the yearly archive partitions for the years `first` through `last`."""
+    existing = existing_partitions(ARCHIVE)
+    created = []
+    year = year_start(first)
+    while year <= last:
+        name = f'trego_order_archive_y{year:%Y}'
+        if name not in existing:
+            create_partition(ARCHIVE, name, year, year_start(year, 1), settings.ORDER_ARCHIVE_TABLESPACE)
+            created.append(name)
+        year = year_start(year, 1)
+    return created
+
+
+def archive_orders(months=None, batch_size=None):
+    """
+    Move orders completed or cancelled more than `months` months ago
+    (ORDER_ARCHIVE_AFTER_MONTHS, counted in whole months) from the hot
+    partitions to the archive, batch_size orders per transaction. Setting
+    archived moves each row to the archive partition of its year. Returns
+    the number of orders archived.
+    """
+    months = settings.ORDER_ARCHIVE_AFTER_MONTHS if months is None else months
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = month_start(timezone.now(), -months)
+    candidates = Order.objects.filter(archived=False, status__in=ARCHIVE_STATUSES, created_at__lt=cutoff)
+
+    span = candidates.order_by('created_at').values_list('created_at', flat=True)
+    first = span.first()
+    if first is None:
+        return 0
+    ensure_archive_partitions(first, span.last())
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            batch = list(candidates.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return archived
+            archived += Order.objects.filter(pk__in=batch, archived=False).update(archived=True)
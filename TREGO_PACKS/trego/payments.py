@@ -0,0 +1,144 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, PaymentJob
+from .stats import move_orders
+
+
+@dataclass
+class PaymentResult:
+    success: bool
+    reference: str = ''
+    error: str = ''
+
+
+class PaymentGateway:
+    """Interface every payment provider adapter implements."""
+
+    def charge(self, order):
+        raise NotImplementedError
+
+
+class LocalGateway(PaymentGateway):
+    # Stand-in for a real provider: waits PAYMENT_GATEWAY_DELAY seconds to
+    # mimic the network round-trip, then approves the charge.
+
+    def charge(self, order):
+        time.sleep(getattr(settings, 'PAYMENT_GATEWAY_DELAY', 0))
+        return PaymentResult(success=True, reference=f"local-{uuid.uuid4().hex[:12]}")
+
+
+def get_gateway():
+    return import_string(settings.PAYMENT_GATEWAY)()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PAYMENT_WORKERS, thread_name_prefix='payment'
+            )
+        return _executor
+
+
+def stale_jobs():
+    # Queued or processing jobs nobody has touched for PAYMENT_JOB_TIMEOUT
+    # seconds: their thread runner restarted, or their worker died mid-charge
+    cutoff = timezone.now() - timedelta(seconds=settings.PAYMENT_JOB_TIMEOUT)
+    return PaymentJob.objects.filter(status__in=('queued', 'processing'), updated_at__lt=cutoff)
+
+
+def reclaim_stale_jobs():
+    """
+    Put stale jobs back in the queue, returning how many. A job that died
+    mid-charge is charged again under the same job id, which gateways
+    should use as their idempotency key.
+    """
+    return stale_jobs().update(status='queued', updated_at=timezone.now())
+
+
+def enqueue_payment(order):
+    """
+    Queue a payment for a pending order and return its job.
+
+    Asking twice for the same order hands back the job already in flight
+    (or the one that succeeded) instead of charging again; a stale one is
+    requeued and dispatched again.
+    """
+    with transaction.atomic():
+        # Serialize concurrent requests for the same order on its row lock
+        Order.objects.select_for_update().filter(pk=order.pk).values_list('pk', flat=True).first()
+        job = (
+            PaymentJob.objects.filter(order=order)
+            .exclude(status='failed')
+            .order_by('-created_at')
+            .first()
+        )
+        if job is None:
+            job = PaymentJob.objects.create(order=order)
+            transaction.on_commit(lambda: dispatch(job.pk))
+        elif stale_jobs().filter(pk=job.pk).update(status='queued', updated_at=timezone.now()):
+            job.refresh_from_db()
+            transaction.on_commit(lambda: dispatch(job.pk))
+    return job
+
+
+def dispatch(job_id):
+    runner = settings.PAYMENT_RUNNER
+    if runner == 'thread':
+        _get_executor().submit(_run_in_thread, job_id)
+    elif runner == 'inline':
+        run_payment_job(job_id)
+    # 'worker': left queued for `manage.py process_payments`
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_payment_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_payment_job(job_id, gateway=None):
+    # Claiming the job is a conditional UPDATE, so a thread and a worker
+    # process can never both charge the same job.
+    claimed = PaymentJob.objects.filter(pk=job_id, status='queued').update(
+        status='processing', updated_at=timezone.now()
+    )
+    if not claimed:
+        return
+
+    job = PaymentJob.objects.select_related('order').get(pk=job_id)
+    gateway = gateway or get_gateway()
+    try:
+        result = gateway.charge(job.order)
+    except Exception as e:
+        result = PaymentResult(success=False, error=str(e))
+
+    with transaction.atomic():
+        if result.success:
+            # Idempotent: only a pending order moves to shipped
+            if Order.objects.filter(pk=job.order_id, status='pending').update(status='shipped'):
+                move_orders([job.order_id], 'pending', 'shipped')
+            PaymentJob.objects.filter(pk=job_id).update(
+                status='succeeded', reference=result.reference, updated_at=timezone.now()
+            )
+        else:
+            PaymentJob.objects.filter(pk=job_id).update(
+                status='failed', error=result.error, updated_at=timezone.now()
+            )
@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import RATING_FIELDS, Product, Feedback
+
+STARS = range(1, 6)
+
+
+def apply_rating(product_id, rating, delta):
+    """
+    Add (delta=1) or remove (delta=-1) one rating from a product's
+    aggregates in a single UPDATE. Every right-hand side sees the row as it
+    was before the update, so concurrent feedback can't lose counts.
+    """
+    count = F('rating_count') + delta
+    total = F('rating_sum') + delta * rating
+    Product.objects.filter(pk=product_id).update(
+        rating_count=count,
+        rating_sum=total,
+        rating_avg=Case(
+            When(rating_count__gt=-delta, then=Cast(total, DecimalField(max_digits=12, decimal_places=4)) / count),
+            default=Value(0),
+            output_field=DecimalField(max_digits=3, decimal_places=2),
+        ),
+        **{f'rating_{rating}': F(f'rating_{rating}') + delta},
+    )
+
+
+def rebuild_ratings(batch_size=5000):
+    """Recompute every product's aggregates from the feedback table."""
+    Product.objects.exclude(rating_count=0).update(
+        rating_count=0, rating_sum=0, rating_avg=0, **{f'rating_{star}': 0 for star in STARS}
+    )
+    rows = (
+        Feedback.objects.order_by().values('product_id')
+        .annotate(
+            count=Count('id'), total=Sum('rating'),
+            **{f'stars_{star}': Count('id', filter=Q(rating=star)) for star in STARS}
+        )
+    )
+    batch, updated = [], 0
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(Product(
+            pk=row['product_id'],
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            rating_avg=(Decimal(row['total']) / row['count']).quantize(Decimal('0.01')),
+            **{f'rating_{star}': row[f'stars_{star}'] for star in STARS}
+        ))
+        if len(batch) >= batch_size:
+            updated += _flush(batch)
+    return updated + _flush(batch)
+
+
+def _flush(batch):
+    Product.objects.bulk_update(batch, RATING_FIELDS)
+    flushed = len(batch)
+    batch.clear()
+    return flushed
@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Feedback, Order, OrderLine, Product, ProductRecommendation, RecommendationBuild
+
+# Item-item similarity over "baskets": each (not cancelled) order, and each
+# user's set of products rated RECOMMENDATION_MIN_RATING or more. Baskets
+# are numbered order_id * 2 and user_id * 2 + 1 so the two kinds share one
+# key. For a batch of products this counts the baskets each shares with
+# every other product, divides by sqrt(baskets(a) * baskets(b)) (cosine
+# similarity of their basket vectors) and keeps the best K per product.
+# Postgres does the sparse matrix work; only the top-K arrays are written.
+NEIGHBOURS_SQL = """
+    WITH target_baskets AS (
+        SELECT DISTINCT l.product_id, l.order_id::bigint * 2 AS basket
+        FROM {line} l JOIN {order} o ON o.id = l.order_id
+        WHERE l.product_id = ANY(%(ids)s) AND o.status <> 'cancelled'
+        UNION
+        SELECT product_id, user_id::bigint * 2 + 1 FROM {feedback}
+        WHERE product_id = ANY(%(ids)s) AND rating >= %(min_rating)s
+    ),
+    together AS (
+        SELECT t.product_id, b.product_id AS neighbour, COUNT(DISTINCT t.basket) AS baskets
+        FROM target_baskets t
+        JOIN (
+            SELECT l.order_id::bigint * 2 AS basket, l.product_id FROM {line} l
+            WHERE l.order_id IN (SELECT basket / 2 FROM target_baskets WHERE basket %% 2 = 0)
+            UNION ALL
+            SELECT user_id::bigint * 2 + 1, product_id FROM {feedback}
+            WHERE rating >= %(min_rating)s
+              AND user_id IN (SELECT basket / 2 FROM target_baskets WHERE basket %% 2 = 1)
+        ) b ON b.basket = t.basket AND b.product_id <> t.product_id
+        GROUP BY t.product_id, b.product_id
+    ),
+    sizes AS (
+        SELECT product_id, COUNT(*) AS baskets FROM (
+            SELECT DISTINCT l.product_id, l.order_id::bigint * 2 AS basket
+            FROM {line} l JOIN {order} o ON o.id = l.order_id
+            WHERE o.status <> 'cancelled'
+              AND l.product_id IN (SELECT neighbour FROM together UNION SELECT product_id FROM together)
+            UNION ALL
+            -- Several reviews of one product by one user are one basket
+            SELECT DISTINCT product_id, user_id::bigint * 2 + 1 FROM {feedback}
+            WHERE rating >= %(min_rating)s
+              AND product_id IN (SELECT neighbour FROM together UNION SELECT product_id FROM together)
+        ) s
+        GROUP BY product_id
+    ),
+    ranked AS (
+        SELECT product_id, neighbour, score,
+               ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY score DESC, neighbour) AS rank
+        FROM (
+            SELECT t.product_id, t.neighbour, t.baskets / sqrt(a.baskets * b.baskets) AS score
+            FROM together t
+            JOIN sizes a ON a.product_id = t.product_id
+            JOIN sizes b ON b.product_id = t.neighbour
+        ) scored
+    )
+    INSERT INTO {recommendation} (product_id, neighbours, scores, computed_at)
+    SELECT product_id, array_agg(neighbour ORDER BY rank), array_agg(score ORDER BY rank), %(now)s
+    FROM ranked WHERE rank <= %(k)s
+    GROUP BY product_id
+"""
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def recompute(product_ids):
+    """Replace the recommendations of `product_ids` in one transaction."""
+    sql = NEIGHBOURS_SQL.format(
+        line=_table(OrderLine), order=_table(Order), feedback=_table(Feedback),
+        recommendation=_table(ProductRecommendation),
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+        cursor.execute(sql, {
+            'ids': list(product_ids), 'k': settings.RECOMMENDATION_K,
+            'min_rating': settings.RECOMMENDATION_MIN_RATING, 'now': timezone.now(),
+        })
+
+
+def changed_products(since, build):
+    """
+    Products whose baskets changed between two builds: those in newer
+    orders and feedback, plus the other products the new feedback's
+    authors rated highly.
+    """
+    ordered = OrderLine.objects.filter(
+        order_id__gt=since.last_order_id, order_id__lte=build.last_order_id
+    ).values_list('product_id', flat=True)
+    reviewed = Feedback.objects.filter(id__gt=since.last_feedback_id, id__lte=build.last_feedback_id)
+    liked = Feedback.objects.filter(
+        user_id__in=reviewed.values('user_id'), rating__gte=settings.RECOMMENDATION_MIN_RATING
+    ).values_list('product_id', flat=True)
+    return sorted(set(ordered) | set(reviewed.values_list('product_id', flat=True)) | set(liked))
+
+
+def _all_products(batch_size):
+    last = 0
+    while True:
+        batch = list(Product.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def build_recommendations(full=False, batch_size=None):
+    """
+    Recompute recommendations for every product (full, or when nothing
+    was built yet) or only for those changed_products() since the last
+    finished build, batch_size products per transaction. Returns the
+    RecommendationBuild.
+    """
+    batch_size = batch_size or settings.RECOMMENDATION_BATCH_SIZE
+    since = RecommendationBuild.objects.exclude(finished_at=None).order_by('-id').first()
+    build = RecommendationBuild.objects.create(
+        full=full or since is None,
+        last_order_id=Order.objects.aggregate(last=Max('id'))['last'] or 0,
+        last_feedback_id=Feedback.objects.aggregate(last=Max('id'))['last'] or 0,
+    )
+    if build.full:
+        batches = _all_products(batch_size)
+    else:
+        changed = changed_products(since, build)
+        batches = (changed[i:i + batch_size] for i in range(0, len(changed), batch_size))
+    for batch in batches:
+        recompute(batch)
+        build.products += len(batch)
+
+    build.finished_at = timezone.now()
+    build.save(update_fields=['products', 'finished_at'])
+    return build
@@ -0,0 +1,143 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Seconds the replica is behind the primary; 0 on a server that isn't a
+# standby (a local stand-in), or when everything received is replayed, so
+# an idle primary doesn't read as lag
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+# Routing for the code running now. Views opt in to replica reads (see
+# ReplicaReadMixin); everything else, and anything after a write, reads
+# from the primary.
+_current = contextvars.ContextVar('trego_db_routing', default=None)
+
+
+class Routing:
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+# alias -> (time.monotonic() of the check, whether it's usable)
+_health = {}
+
+
+def replica_usable(alias):
+    """
+    Whether `alias` answers and is at most REPLICA_MAX_LAG_SECONDS behind,
+    checked at most every REPLICA_CHECK_SECONDS per process.
+    """
+    checked = _health.get(alias)
+    now = time.monotonic()
+    if checked and now - checked[0] < settings.REPLICA_CHECK_SECONDS:
+        return checked[1]
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+        usable = lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+        if not usable:
+            logger.warning("replica lagging, reading from primary", extra={'alias': alias, 'lag': lag})
+    except DatabaseError:
+        logger.warning("replica unreachable, reading from primary", extra={'alias': alias}, exc_info=True)
+        usable = False
+    _health[alias] = (now, usable)
+    return usable
+
+
+def start_replica_reads():
+    return _current.set(Routing())
+
+
+def stop_replica_reads(token):
+    _current.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    """Reads inside may go to a replica, until something writes."""
+    token = start_replica_reads()
+    try:
+        yield
+    finally:
+        stop_replica_reads(token)
+
+
+def pin_after_writes(execute, sql, params, many, context):
+    # Installed on the primary's connections (see install_write_tracker):
+    # raw SQL writes and transactions pin later reads too, not only ORM
+    # writes the router sees
+    routing = _current.get()
+    if routing is not None and sql.lstrip()[:6].upper() != 'SELECT':
+        routing.wrote = True
+    return execute(sql, params, many, context)
+
+
+def install_write_tracker(sender, connection, **kwargs):
+    """connection_created receiver, see pin_after_writes."""
+    if connection.alias == DEFAULT_DB_ALIAS and pin_after_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(pin_after_writes)
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary. Reads go to one of DATABASE_REPLICAS only
+    inside replica_reads() (the catalog and order-history views), and there
+    only until the first write or transaction on the primary, and only to
+    replicas passing replica_usable(). One replica serves a whole request.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or routing.wrote or not settings.DATABASE_REPLICAS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if routing.replica is None:
+            usable = [alias for alias in settings.DATABASE_REPLICAS if replica_usable(alias)]
+            routing.replica = random.choice(usable) if usable else DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    # Safe-method actions whose reads may be served by a replica
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and self.action in self.replica_actions:
+            self._replica_token = start_replica_reads()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            stop_replica_reads(token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,59 @@
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F
+
+SEARCH_CONFIG = 'english'
+# Minimum name similarity for the typo-tolerant fallback; matches the
+# pg_trgm default threshold used by the % operator and its GIN index
+TRIGRAM_THRESHOLD = 0.3
+
+
+def filter_products(queryset, params):
+    """
+    Apply the optional category, min_price / max_price and min_rating /
+    min_reviews filters.
+    """
+    if params.get('category'):
+        try:
+            queryset = queryset.filter(category_id=int(params['category']))
+        except ValueError:
+            raise ValueError("category must be an integer id")
+    for param, lookup in (
+        ('min_price', 'price__gte'), ('max_price', 'price__lte'), ('min_rating', 'rating_avg__gte')
+    ):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: Decimal(params[param])})
+            except InvalidOperation:
+                raise ValueError(f"{param} must be a number")
+    if params.get('min_reviews'):
+        try:
+            queryset = queryset.filter(rating_count__gte=int(params['min_reviews']))
+        except ValueError:
+            raise ValueError("min_reviews must be an integer")
+    return queryset
+
+
+def search_products(queryset, term, limit):
+    """
+    Ranked full-text search over the stored search_vector (GIN indexed).
+
+    Falls back to trigram similarity on the name when the full-text query
+    matches nothing, which is what a misspelt term usually looks like.
+    """
+    query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+    results = list(
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-id')[:limit]
+    )
+    if results:
+        return results
+
+    return list(
+        queryset.filter(name__trigram_similar=term)
+        .annotate(similarity=TrigramSimilarity('name', term))
+        .filter(similarity__gte=TRIGRAM_THRESHOLD)
+        .order_by('-similarity', '-id')[:limit]
+    )
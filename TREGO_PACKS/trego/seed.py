@@ -0,0 +1,121 @@
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Cart, Category, Feedback, Order, OrderLine, Product, Profile
+from .partitions import ensure_order_partitions
+from .ratings import rebuild_ratings
+from .stats import rebuild_rollups
+
+WORDS = (
+    'alpine trail urban canvas leather nylon rolltop daypack duffel tote sling '
+    'messenger hydration travel laptop hiking camera waterproof ultralight compact'
+).split()
+STATUSES = ['pending', 'shipped', 'completed', 'completed', 'completed', 'cancelled']
+
+
+def _spread_created_at(model, batch, days, column='created_at'):
+    # auto_now_add stamps every bulk-created row with now(); spread them over
+    # the past `days` days so date filters and orderings see realistic data
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET {column} = now() - random() * %s * interval '1 day' WHERE id BETWEEN %s AND %s",
+            [days, batch[0].pk, batch[-1].pk]
+        )
+
+
+def seed(users=200, categories=20, products=20000, orders=50000, feedback=20000,
+         batch_size=5000, days=365, seed_value=0, log=None):
+    """
+    Bulk-insert a synthetic shop: users with profiles, a catalog, orders
+    with lines, feedback and some carts. Signals don't fire for
+    bulk_create, so profiles are created alongside their users and the
+    rating and sales aggregates are rebuilt at the end. Each batch commits
+    on its own unless the caller wraps the whole run in a transaction.
+
+    Returns a dict with the created users, categories and product ids.
+    """
+    rng = random.Random(seed_value)
+    log = log or (lambda message: None)
+    tag = uuid.uuid4().hex[:6]
+
+    password = make_password(None)
+    user_objs = User.objects.bulk_create([
+        User(username=f"seed-{tag}-{i}", password=password) for i in range(users)
+    ], batch_size=batch_size)
+    Profile.objects.bulk_create([Profile(user=user) for user in user_objs], batch_size=batch_size)
+    user_ids = [user.pk for user in user_objs]
+    log(f"{users} users with profiles")
+
+    category_objs = Category.objects.bulk_create([
+        Category(name=f"{rng.choice(WORDS).title()} {tag} {i}") for i in range(categories)
+    ])
+
+    product_ids, prices = [], {}
+    for offset in range(0, products, batch_size):
+        with transaction.atomic():
+            batch = Product.objects.bulk_create([
+                Product(
+                    name=' '.join(rng.choices(WORDS, k=3)).title(),
+                    description=' '.join(rng.choices(WORDS, k=15)),
+                    price=Decimal(rng.randint(500, 50000)) / 100,
+                    category=rng.choice(category_objs),
+                )
+                for _ in range(min(batch_size, products - offset))
+            ])
+            _spread_created_at(Product, batch, days)
+        for product in batch:
+            product_ids.append(product.pk)
+            prices[product.pk] = product.price
+    log(f"{products} products in {categories} categories")
+
+    # Monthly partitions for the dates orders are spread over, rather than
+    # the hot default partition
+    ensure_order_partitions(since=timezone.now() - timedelta(days=days))
+    for offset in range(0, orders, batch_size):
+        # An order and its lines commit together, one batch per transaction
+        with transaction.atomic():
+            batch = Order.objects.bulk_create([
+                Order(user_id=rng.choice(user_ids), status=rng.choice(STATUSES))
+                for _ in range(min(batch_size, orders - offset))
+            ])
+            OrderLine.objects.bulk_create([
+                OrderLine(order=order, product_id=product_id, quantity=rng.randint(1, 3), unit_price=prices[product_id])
+                for order in batch
+                for product_id in rng.sample(product_ids, rng.randint(1, 3))
+            ], batch_size=batch_size)
+            _spread_created_at(Order, batch, days)
+        if (offset // batch_size) % 20 == 19:
+            log(f"{offset + len(batch)} / {orders} orders")
+    log(f"{orders} orders")
+
+    for offset in range(0, feedback, batch_size):
+        with transaction.atomic():
+            batch = Feedback.objects.bulk_create([
+                Feedback(user_id=rng.choice(user_ids), product_id=rng.choice(product_ids),
+                         rating=rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 5, 6])[0])
+                for _ in range(min(batch_size, feedback - offset))
+            ])
+            _spread_created_at(Feedback, batch, days)
+    log(f"{feedback} reviews")
+
+    Cart.objects.bulk_create([
+        Cart(user_id=user_id, product_id=product_id, quantity=rng.randint(1, 2))
+        for user_id in user_ids
+        for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(0, 4)))
+    ], batch_size=batch_size)
+
+    rebuild_ratings(batch_size=batch_size)
+    rebuild_rollups()
+    with connection.cursor() as cursor:
+        for model in (User, Product, Order, OrderLine, Feedback, Cart):
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+    log("rebuilt ratings and sales rollups")
+    return {'users': user_objs, 'categories': category_objs, 'product_ids': product_ids}
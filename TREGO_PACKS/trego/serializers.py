@@ -1,39 +1,167 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.urls import reverse
 
-from .models import Profile, Category, Product, Cart, Order,Feedback
+from .authentication import remember_login
+from .images import VARIANTS
+from .inventory import InsufficientStock, take_stock
+from .metrics import SerializerTimingMixin
+from .models import Profile, Category, Product, Cart, Order, OrderLine, Feedback, PaymentJob
+from .stats import record_orders
 
-class UserSerializer(serializers.ModelSerializer):
+def _field_paths(request, param):
+    return [path.strip() for path in request.query_params.get(param, '').split(',') if path.strip()]
+
+
+class FieldSelectionMixin:
+    """
+    Sparse fieldsets for GET requests. ?fields=id,name,category.name limits
+    the output to those fields; ?expand=description adds fields outside
+    `default_fields`, and naming a nested serializer (?expand=product)
+    renders all of its fields. Dotted paths reach nested serializers, and
+    unknown names are ignored. Fields that aren't rendered are dropped
+    before serialization, so they cost nothing.
+    """
+    # Fields rendered when the request doesn't pick; None means all
+    default_fields = None
+    # Model fields each SerializerMethodField reads (see unrendered_columns)
+    method_field_sources = {}
+
+    def __init__(self, *args, default_fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if default_fields is not None:
+            self.default_fields = default_fields
+        # Dotted path of this serializer from the root, e.g. 'lines.product.'
+        self.field_path = ''
+
+    def selected_fields(self, request, names):
+        path = self.field_path
+        chosen = {p[len(path):].split('.')[0] for p in _field_paths(request, 'fields') if p.startswith(path) and p != path}
+        if chosen:
+            return chosen
+        expand = _field_paths(request, 'expand')
+        if path and path[:-1] in expand:
+            return set(names)
+        defaults = set(names if self.default_fields is None else self.default_fields)
+        return defaults | {p[len(path):].split('.')[0] for p in expand if p.startswith(path)}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+        wanted = self.selected_fields(request, fields)
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if name not in wanted:
+                del fields[name]
+                continue
+            nested = getattr(field, 'child', field)
+            if isinstance(nested, FieldSelectionMixin):
+                nested.field_path = f'{self.field_path}{name}.'
+        return fields
+
+
+class ModelSerializer(FieldSelectionMixin, SerializerTimingMixin, serializers.ModelSerializer):
+    # Base for the API serializers: sparse fieldsets, and their time is
+    # reported to the request metrics
+    pass
+
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
 
-class ProfileSerializer(serializers.ModelSerializer):
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # The role travels in the token for clients; the server authorizes from
+    # the state cached here and kept current on changes (see
+    # RoleJWTAuthentication)
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['user_type'] = user.profile.user_type
+        remember_login(user)
+        return token
+
+class ProfileSerializer(ModelSerializer):
     user = UserSerializer(read_only=True)
     class Meta:
         model = Profile
         fields = ['id', 'user', 'user_type', 'bio']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         source='category',
         queryset=Category.objects.all(),
         write_only=True
     )
+    rating_histogram = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
+
+    # What a product looks like inside cart items and order lines
+    summary_fields = ('id', 'name', 'price', 'image')
+    # Model fields each method field reads, in the order its represent_*
+    # method takes them (also used by trego.readers)
+    method_field_sources = {
+        'rating_histogram': ('rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'),
+        'image_variants': ('id', 'image', 'image_variants'),
+    }
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'category', 'category_id', 'image', 'created_at']
+        fields = ['id', 'sku', 'name', 'description', 'price', 'category', 'category_id', 'image', 'image_variants',
+                  'created_at', 'rating_avg', 'rating_count', 'rating_histogram']
+
+    def get_image_variants(self, obj):
+        return self.represent_image_variants(obj.pk, obj.image.name, obj.image_variants)
+
+    def represent_image_variants(self, pk, image, image_variants):
+        if not image:
+            return None
+        request = self.context.get('request')
+        current = image_variants.get('source') == image
+        urls = {}
+        for variant in VARIANTS:
+            if current and variant in image_variants:
+                url = settings.MEDIA_URL + image_variants[variant]
+            else:
+                # Not generated yet: this URL builds it on first request
+                url = reverse('product-image', kwargs={'pk': pk, 'variant': variant})
+            urls[variant] = request.build_absolute_uri(url) if request else url
+        return urls
+
+    def get_rating_histogram(self, obj):
+        return self.represent_rating_histogram(*(getattr(obj, f'rating_{star}') for star in range(1, 6)))
 
-class CartSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    def represent_rating_histogram(self, *counts):
+        return {str(star): count for star, count in enumerate(counts, 1)}
+
+class ProductImportSerializer(serializers.Serializer):
+    # One row of a bulk import (see imports.py). category_id is checked by
+    # the importer against the whole batch at once instead of one query per
+    # row through a PrimaryKeyRelatedField.
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=100)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    category_id = serializers.IntegerField()
+
+
+class CartSerializer(ModelSerializer):
+    product = ProductSerializer(read_only=True, default_fields=ProductSerializer.summary_fields)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product', write_only=True)
 
     class Meta:
@@ -44,15 +172,69 @@ class CartSerializer(serializers.ModelSerializer):
             'added_at': {'read_only': True}
         }
 
-class OrderSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class OrderLineSerializer(ModelSerializer):
+    product = ProductSerializer(read_only=True, default_fields=ProductSerializer.summary_fields)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product', write_only=True)
 
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'product', 'product_id', 'quantity', 'unit_price']
+        read_only_fields = ['unit_price']
+
+class OrderSerializer(ModelSerializer):
+    lines = OrderLineSerializer(many=True)
+    # Annotated by Order.objects.with_totals()
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
     class Meta:
         model = Order
-        fields = ['id', 'user', 'product', 'product_id', 'quantity', 'status', 'created_at']
+        fields = ['id', 'user', 'status', 'total', 'lines', 'created_at']
+        read_only_fields = ['user']
 
-class FeedbackSerializer(serializers.ModelSerializer):
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # Updates change an order's status, not its lines (see update())
+            fields['lines'].required = False
+        return fields
+
+    def validate_lines(self, lines):
+        if not lines:
+            raise serializers.ValidationError("An order needs at least one line")
+        return lines
+
+    def create(self, validated_data):
+        lines = validated_data.pop('lines')
+        amounts = {}
+        for line in lines:
+            amounts[line['product'].pk] = amounts.get(line['product'].pk, 0) + line['quantity']
+        with transaction.atomic():
+            try:
+                take_stock(amounts)
+            except InsufficientStock as e:
+                raise serializers.ValidationError({"error": "Insufficient stock", "product_ids": e.product_ids})
+            order = Order.objects.create(**validated_data)
+            order_lines = OrderLine.objects.bulk_create([
+                OrderLine(order=order, product=line['product'], quantity=line['quantity'],
+                          unit_price=line['product'].price)
+                for line in lines
+            ])
+            record_orders([order.pk], order.status)
+        order.total = sum(line.quantity * line.unit_price for line in order_lines)
+        return order
+
+    def update(self, instance, validated_data):
+        # Lines were priced and their stock taken when the order was placed
+        if 'lines' in validated_data:
+            raise serializers.ValidationError({"lines": "Order lines can't be changed once the order is placed"})
+        return super().update(instance, validated_data)
+
+class FeedbackSerializer(ModelSerializer):
     class Meta:
         model = Feedback
-        fields = ['id', 'rating', 'comment', 'created_at']
\ No newline at end of file
+        fields = ['id', 'product', 'rating', 'comment', 'created_at']
+
+class PaymentJobSerializer(ModelSerializer):
+    class Meta:
+        model = PaymentJob
+        fields = ['id', 'order', 'status', 'reference', 'error', 'created_at', 'updated_at']
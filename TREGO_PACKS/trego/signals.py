@@ -1,9 +1,88 @@
-from django.db.models.signals import post_save
+import logging
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from django.db import transaction
 from django.contrib.auth.models import User
 from .models import *
+from .cache import bump_version
+from .authentication import remember_user_state
+from .ratings import apply_rating
+from .images import generate_derivatives
+from .stats import forget_orders, move_orders
+from .metrics import install_query_recorder
+from .routers import install_write_tracker
+
+logger = logging.getLogger(__name__)
+
+connection_created.connect(install_query_recorder)
+connection_created.connect(install_write_tracker)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+@receiver([post_save, post_delete], sender=User)
+def refresh_user_auth_state(sender, instance, **kwargs):
+    transaction.on_commit(lambda: remember_user_state(instance.pk))
+
+@receiver([post_save, post_delete], sender=Profile)
+def refresh_profile_auth_state(sender, instance, **kwargs):
+    # Replaces the cached state requests authorize from
+    transaction.on_commit(lambda: remember_user_state(instance.user_id))
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('product'))
+
+@receiver(post_save, sender=Product)
+def process_product_image(sender, instance, **kwargs):
+    # Build thumbnails at upload time; the image view covers any that fail
+    if (instance.image.name or None) != instance.image_variants.get('source'):
+        transaction.on_commit(lambda: build_derivatives(instance))
+
+def build_derivatives(product):
+    # Runs after the product is saved (inside the request when there's no
+    # transaction), so a bad image mustn't turn the save into an error
+    try:
+        generate_derivatives(product)
+    except Exception:
+        logger.exception("Couldn't build image derivatives for product %s", product.pk)
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    # Products embed their category, so both listings go stale
+    transaction.on_commit(lambda: bump_version('category'))
+
+@receiver(post_save, sender=Feedback)
+def count_feedback_rating(sender, instance, created, **kwargs):
+    loaded = (getattr(instance, '_loaded_product_id', None), getattr(instance, '_loaded_rating', None))
+    current = (instance.product_id, instance.rating)
+    if not created and loaded == current:
+        return
+    if not created and None not in loaded:
+        apply_rating(*loaded, delta=-1)
+    apply_rating(*current, delta=1)
+    instance._loaded_product_id, instance._loaded_rating = current
+    transaction.on_commit(lambda: bump_version('product'))
+
+@receiver(post_delete, sender=Feedback)
+def uncount_feedback_rating(sender, instance, **kwargs):
+    product_id = getattr(instance, '_loaded_product_id', None) or instance.product_id
+    rating = getattr(instance, '_loaded_rating', None) or instance.rating
+    apply_rating(product_id, rating, delta=-1)
+    transaction.on_commit(lambda: bump_version('product'))
+
+@receiver(post_save, sender=Order)
+def move_order_stats(sender, instance, created, **kwargs):
+    # New orders are counted once their lines exist (see stats.record_orders)
+    loaded = getattr(instance, '_loaded_status', None)
+    if not created and loaded and loaded != instance.status:
+        move_orders([instance.pk], loaded, instance.status)
+    instance._loaded_status = instance.status
+
+@receiver(pre_delete, sender=Order)
+def forget_order_stats(sender, instance, **kwargs):
+    forget_orders([instance.pk], getattr(instance, '_loaded_status', None) or instance.status)
@@ -0,0 +1,170 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Category, Order, OrderLine, Product, SalesRollup
+
+# Sums a set of orders per (day, category, status) plus the all-categories
+# row (category_id 0) in one pass, and adds the result to the rollups with
+# the given sign. `status` overrides the orders' own status so a status
+# change can take the amounts out of the old bucket and into the new one.
+APPLY_SQL = """
+    INSERT INTO {rollup} AS r (day, category_id, status, orders, units, revenue)
+    SELECT day, COALESCE(category_id, 0), {status}, %(sign)s * orders, %(sign)s * units, %(sign)s * revenue
+    FROM (
+        SELECT (o.created_at AT TIME ZONE %(tz)s)::date AS day, o.status, p.category_id,
+               COUNT(DISTINCT o.id) AS orders, SUM(l.quantity) AS units,
+               SUM(l.quantity * l.unit_price) AS revenue
+        FROM {order} o
+        JOIN {line} l ON l.order_id = o.id
+        JOIN {product} p ON p.id = l.product_id
+        WHERE {where}
+        GROUP BY GROUPING SETS ((day, o.status, p.category_id), (day, o.status))
+    ) s
+    ON CONFLICT (day, category_id, status) DO UPDATE SET
+        orders = r.orders + EXCLUDED.orders,
+        units = r.units + EXCLUDED.units,
+        revenue = r.revenue + EXCLUDED.revenue
+"""
+
+# Creation and status changes are applied as they happen: checkout and
+# order creation call record_orders, the payment runner calls move_orders,
+# and Order save/delete signals cover everything else. Line edits made in
+# the admin aren't tracked; `manage.py rebuild_sales_stats` corrects them.
+
+GROUPINGS = {
+    'day': None,
+    'week': TruncWeek('day'),
+    'month': TruncMonth('day'),
+    'category': F('category_id'),
+    'status': None,
+}
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _apply(where, params, sign, status=None):
+    sql = APPLY_SQL.format(
+        rollup=_table(SalesRollup), order=_table(Order), line=_table(OrderLine), product=_table(Product),
+        where=where, status='%(status)s' if status else 's.status',
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {**params, 'sign': sign, 'status': status, 'tz': settings.TIME_ZONE})
+
+
+def record_orders(order_ids, status='pending'):
+    """
+    Count newly created orders (and their lines) under `status`. Runs once
+    the surrounding transaction commits, so concurrent checkouts don't hold
+    today's rollup rows locked for their whole transaction.
+    """
+    order_ids = list(order_ids)
+    transaction.on_commit(lambda: _apply('o.id = ANY(%(ids)s)', {'ids': order_ids}, 1, status))
+
+
+def move_orders(order_ids, old_status, new_status):
+    # Only for orders whose status really changed from old_status
+    order_ids = list(order_ids)
+
+    def move():
+        with transaction.atomic():
+            _apply('o.id = ANY(%(ids)s)', {'ids': order_ids}, -1, old_status)
+            _apply('o.id = ANY(%(ids)s)', {'ids': order_ids}, 1, new_status)
+    transaction.on_commit(move)
+
+
+def forget_orders(order_ids, status):
+    # Before the orders are deleted, while their lines can still be summed
+    _apply('o.id = ANY(%(ids)s)', {'ids': list(order_ids)}, -1, status)
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    Recompute the rollups for days in [start, end] (all days if omitted)
+    straight from the orders. Returns the number of rollup rows written.
+    """
+    with transaction.atomic():
+        rollups = SalesRollup.objects.all()
+        where, params = ['TRUE'], {}
+        if start:
+            rollups = rollups.filter(day__gte=start)
+            where.append('(o.created_at AT TIME ZONE %(tz)s)::date >= %(start)s')
+            params['start'] = start
+        if end:
+            rollups = rollups.filter(day__lte=end)
+            where.append('(o.created_at AT TIME ZONE %(tz)s)::date <= %(end)s')
+            params['end'] = end
+        rollups.delete()
+        _apply(' AND '.join(where), params, 1)
+        return rollups.count()
+
+
+def sales_stats(start, end, group_by, status=None, category_id=None):
+    """
+    Orders, units and revenue between two dates (inclusive), grouped by any
+    of GROUPINGS. Reads only rollup rows: at most days x categories x
+    statuses of them, however many orders there are.
+    """
+    rollups = SalesRollup.objects.filter(day__gte=start, day__lte=end)
+    if status:
+        rollups = rollups.filter(status=status)
+    if 'category' in group_by or category_id:
+        rollups = rollups.exclude(category_id=0)
+        if category_id:
+            rollups = rollups.filter(category_id=category_id)
+    else:
+        rollups = rollups.filter(category_id=0)
+
+    totals = {'orders': Sum('orders'), 'units': Sum('units'), 'revenue': Sum('revenue')}
+    if not group_by:
+        return [rollups.aggregate(**totals)]
+    # day and status are rollup columns; the rest are expressions over them
+    rows = list(
+        rollups.values(
+            *[name for name in group_by if GROUPINGS[name] is None],
+            **{name: GROUPINGS[name] for name in group_by if GROUPINGS[name] is not None}
+        ).annotate(**totals).order_by(*group_by)
+    )
+
+    if 'category' in group_by:
+        names = dict(Category.objects.filter(pk__in={row['category'] for row in rows}).values_list('id', 'name'))
+        for row in rows:
+            row['category_name'] = names.get(row['category'])
+    return rows
+
+
+def parse_stats_params(params):
+    """
+    Read ?from=&to= (ISO dates, default the last 30 days), ?group_by= (comma
+    separated GROUPINGS, default day), ?status= and ?category= into
+    sales_stats arguments. Raises ValueError on bad input.
+    """
+    try:
+        end = date.fromisoformat(params['to']) if params.get('to') else timezone.localdate()
+        start = date.fromisoformat(params['from']) if params.get('from') else end - timedelta(days=29)
+    except ValueError:
+        raise ValueError("from and to must be dates (YYYY-MM-DD)")
+    if start > end:
+        raise ValueError("from must not be after to")
+
+    group_by = [name for name in params.get('group_by', 'day').split(',') if name]
+    unknown = set(group_by) - GROUPINGS.keys()
+    if unknown:
+        raise ValueError(f"Unknown group_by: {', '.join(sorted(unknown))}")
+
+    status = params.get('status') or None
+    if status and status not in dict(Order.ORDER_STATUS_CHOICES):
+        raise ValueError(f"Unknown status: {status}")
+    category_id = params.get('category') or None
+    if category_id is not None:
+        try:
+            category_id = int(category_id)
+        except ValueError:
+            raise ValueError("category must be an integer")
+    return {'start': start, 'end': end, 'group_by': group_by, 'status': status, 'category_id': category_id}
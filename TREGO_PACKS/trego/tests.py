@@ -1,3 +1,1464 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from backpack.urls import router
+
+from . import routers, throttling
+from .cache import get_cache
+from .cart import add_to_cart
+from .checkout import checkout_cart
+from .images import VARIANTS
+from .inventory import InsufficientStock, hold_stock, set_stock, stock_levels, take_stock
+from .management.commands.bench_endpoints import endpoints
+from .metrics import latencies, registry
+from .partitions import HOT_DEFAULT, archive_orders, ensure_order_partitions
+from .models import (Profile, Category, Product, Cart, Order, OrderLine, Feedback, PaymentJob, SalesRollup,
+                     StockHold, StockShard, ProductRecommendation)
+from .payments import PaymentResult, reclaim_stale_jobs, run_payment_job
+from .ratings import rebuild_ratings
+from .recommendations import build_recommendations
+from .routers import PrimaryReplicaRouter, replica_reads
+from .seed import seed
+from .serializers import ProductSerializer
+from .stats import rebuild_rollups
+
+
+def make_order(user, product, quantity=1):
+    order = Order.objects.create(user=user)
+    OrderLine.objects.create(order=order, product=product, quantity=quantity, unit_price=product.price)
+    return order
+
+
+class QueryCountAssertionsMixin:
+    # Fails when a list endpoint's query count depends on the number of
+    # rows it returns, i.e. when a serializer walks a relation lazily.
+
+    def count_queries(self, url, user):
+        client = APIClient()
+        # Fetch a fresh user so relation caches (profile) don't leak between runs
+        client.force_authenticate(User.objects.get(pk=user.pk))
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def assertQueryCountStable(self, url, user, add_rows, sizes=(1, 25)):
+        counts = []
+        created = 0
+        for size in sizes:
+            add_rows(size - created)
+            created = size
+            counts.append(self.count_queries(url, user))
+        self.assertEqual(
+            len(set(counts)), 1,
+            f"{url} issued {counts} queries for {list(sizes)} rows"
+        )
+        return counts[0]
+
+
+# The catalog response cache would hide the queries being counted
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ListQueryCountTests(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.category_seq = 0
+
+    def make_products(self, n):
+        products = []
+        for _ in range(n):
+            self.category_seq += 1
+            category = Category.objects.create(name=f"Category {self.category_seq}")
+            products.append(Product.objects.create(
+                name=f"Product {self.category_seq}", description='', price='9.99', category=category
+            ))
+        return products
+
+    def test_product_list(self):
+        self.assertQueryCountStable('/api/products/', self.user, self.make_products)
+
+    def test_cart_list(self):
+        def add_rows(n):
+            for product in self.make_products(n):
+                Cart.objects.create(user=self.user, product=product)
+        self.assertQueryCountStable('/api/cart/', self.user, add_rows)
+
+    def add_orders(self, n):
+        for product in self.make_products(n):
+            make_order(self.user, product)
+
+    def test_order_list(self):
+        count = self.assertQueryCountStable('/api/orders/', self.user, self.add_orders)
+        self.assertLessEqual(count, 3)
+
+    def test_order_history(self):
+        count = self.assertQueryCountStable('/api/orders/order-history/', self.user, self.add_orders)
+        self.assertLessEqual(count, 3)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('pager', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        product = Product.objects.create(name='Tote', description='', price='5.00', category=category)
+        self.orders = [make_order(self.user, product) for _ in range(7)]
+        # Force ties on created_at so the id tiebreaker is exercised
+        Order.objects.filter(pk__in=[o.pk for o in self.orders[2:5]]).update(created_at=self.orders[2].created_at)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            data = self.client.get(url).data
+            ids.extend(row['id'] for row in data['results'])
+            url, pages = data['next'], pages + 1
+        return ids, pages
+
+    def expected_ids(self):
+        return list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_walks_every_order_once_in_order(self):
+        ids, pages = self.walk('/api/orders/order-history/?page_size=3')
+        self.assertEqual(ids, self.expected_ids())
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/orders/?page_size=3').data
+        second = self.client.get(first['next']).data
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/orders/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Packs')
+        self.products = Product.objects.bulk_create([
+            Product(name=f"Pack {i}", description='', price='20.00', category=category) for i in range(40)
+        ])
+
+    def fill_cart(self, n):
+        Cart.objects.bulk_create([Cart(user=self.user, product=p, quantity=2) for p in self.products[:n]])
+
+    def test_checkout_moves_cart_into_orders(self):
+        self.fill_cart(3)
+        response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(response.data['id'], order.id)
+        self.assertEqual(len(response.data['lines']), 3)
+        self.assertEqual({line.quantity for line in order.lines.all()}, {2})
+        self.assertEqual(response.data['total'], '120.00')
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_line_prices_are_captured_at_checkout(self):
+        self.fill_cart(2)
+        order = checkout_cart(self.user)
+        Product.objects.filter(pk=self.products[0].pk).update(price='99.00')
+        self.assertEqual(Order.objects.with_totals().get(pk=order.pk).total, Decimal('80.00'))
+        response = self.client.get('/api/orders/order-history/')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['total'], '80.00')
+
+    def test_create_order_with_lines(self):
+        response = self.client.post('/api/orders/', {'lines': [
+            {'product_id': self.products[0].id, 'quantity': 3},
+            {'product_id': self.products[1].id, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total'], '80.00')
+        self.assertEqual(Order.objects.get().user, self.user)
+        response = self.client.post('/api/orders/', {'lines': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_changes_status_not_lines(self):
+        self.fill_cart(1)
+        order = checkout_cart(self.user)
+        url = f'/api/orders/{order.pk}/'
+        line = {'product_id': self.products[1].id, 'quantity': 5}
+        self.assertEqual(self.client.put(url, {'status': 'shipped', 'lines': [line]}, format='json').status_code, 400)
+        self.assertEqual(self.client.patch(url, {'lines': [line]}, format='json').status_code, 400)
+        response = self.client.put(url, {'status': 'shipped'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual((response.data['status'], response.data['total']), ('shipped', '40.00'))
+        self.assertEqual([(line.product_id, line.quantity) for line in order.lines.all()], [(self.products[0].id, 2)])
+
+    def test_empty_cart_is_rejected(self):
+        response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 40):
+            self.fill_cart(size)
+            with CaptureQueriesContext(connection) as ctx:
+                checkout_cart(self.user)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+
+class CartUpsertTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Packs')
+        self.products = Product.objects.bulk_create([
+            Product(name=f"Pack {i}", description='', price='20.00', category=category) for i in range(3)
+        ])
+
+    def test_adding_twice_increments_one_row(self):
+        for _ in range(2):
+            response = self.client.post('/api/cart/', {'product_id': self.products[0].id, 'quantity': 2})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 4)
+        self.assertEqual(Cart.objects.get(user=self.user).quantity, 4)
+
+    def test_missing_product_and_bad_quantity(self):
+        response = self.client.post('/api/cart/', {'product_id': 999999, 'quantity': 1})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/cart/', {'product_id': self.products[0].id, 'quantity': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_malformed_input_gets_a_plain_message(self):
+        for data, error in (({}, "product_id must be an integer"),
+                            ({'product_id': 'abc'}, "product_id must be an integer"),
+                            ({'product_id': self.products[0].id, 'quantity': 'lots'}, "Quantity must be an integer")):
+            response = self.client.post('/api/cart/', data, format='json')
+            self.assertEqual((response.status_code, response.data), (400, {"error": error}))
+
+    def test_batch_add_sums_duplicates_and_reports_missing(self):
+        items = [
+            {'product_id': self.products[0].id, 'quantity': 1},
+            {'product_id': self.products[1].id, 'quantity': 3},
+            {'product_id': self.products[0].id, 'quantity': 2},
+            {'product_id': 999999},
+        ]
+        with CaptureQueriesContext(connection) as single:
+            self.client.post('/api/cart/batch/', {'items': items[2:3]}, format='json')
+        Cart.objects.all().delete()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/cart/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(ctx.captured_queries), len(single.captured_queries))
+        self.assertEqual(response.data['not_found'], [999999])
+        quantities = dict(Cart.objects.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.products[0].id: 3, self.products[1].id: 3})
+
+    def test_update_quantity_absolute_and_delta(self):
+        item = Cart.objects.create(user=self.user, product=self.products[0], quantity=2)
+        url = f'/api/cart/{item.id}/update-quantity/'
+        response = self.client.patch(url, {'quantity': 5}, format='json')
+        self.assertEqual(response.data['quantity'], 5)
+        response = self.client.patch(url, {'delta': -2}, format='json')
+        self.assertEqual(response.data['quantity'], 3)
+        # Never below 1
+        response = self.client.patch(url, {'delta': -3}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Cart.objects.get(pk=item.id).quantity, 3)
+
+    def test_update_quantity_of_another_users_item(self):
+        other = User.objects.create_user('other', password='secret')
+        item = Cart.objects.create(user=other, product=self.products[0], quantity=2)
+        response = self.client.patch(f'/api/cart/{item.id}/update-quantity/', {'delta': 1}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Cart.objects.get(pk=item.id).quantity, 2)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ADDS_PER_THREAD = 25
+
+    def test_concurrent_adds_lose_no_increments(self):
+        user = User.objects.create_user('racer', password='secret')
+        category = Category.objects.create(name='Packs')
+        products = Product.objects.bulk_create([
+            Product(name=f"Pack {i}", description='', price='20.00', category=category) for i in range(2)
+        ])
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    add_to_cart(user, [(products[0].id, 1), (products[1].id, 2)])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        adds = self.THREADS * self.ADDS_PER_THREAD
+        quantities = dict(Cart.objects.filter(user=user).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {products[0].id: adds, products[1].id: 2 * adds})
+
+
+
+@override_settings(STOCK_SHARDS=4, STOCK_HOLD_SECONDS=900)
+class InventoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('stocker', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Packs')
+        self.product = Product.objects.create(name='Flash', description='', price='20.00', category=category)
+        set_stock(self.product.id, 10)
+
+    def available(self):
+        return stock_levels([self.product.id])[self.product.id]
+
+    def add(self, quantity):
+        return self.client.post('/api/cart/', {'product_id': self.product.id, 'quantity': quantity})
+
+    def test_set_stock_spreads_over_shards(self):
+        shards = StockShard.objects.filter(product=self.product).order_by('shard')
+        quantities = list(shards.values_list('quantity', flat=True))
+        self.assertEqual(quantities, [3, 3, 2, 2])
+
+    def test_take_spanning_shards_and_all_or_nothing(self):
+        take_stock({self.product.id: 7})
+        self.assertEqual(self.available(), 3)
+        with self.assertRaises(InsufficientStock):
+            take_stock({self.product.id: 4})
+        self.assertEqual(self.available(), 3)
+
+    def test_cart_add_holds_and_checkout_consumes(self):
+        self.assertEqual(self.add(4).status_code, 201)
+        self.assertEqual(self.available(), 6)
+        self.assertEqual(self.add(7).status_code, 409)
+        self.assertEqual(Cart.objects.get(user=self.user).quantity, 4)
+
+        response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.available(), 6)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_checkout_takes_shortfall_or_fails_cleanly(self):
+        self.add(2)
+        item = Cart.objects.get(user=self.user)
+        self.client.patch(f'/api/cart/{item.id}/update-quantity/', {'quantity': 11}, format='json')
+        response = self.client.post('/api/orders/checkout/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['product_ids'], [self.product.id])
+        self.assertEqual(self.available(), 8)
+        self.assertEqual(StockHold.objects.get().quantity, 2)
+        self.assertFalse(Order.objects.exists())
+
+        self.client.patch(f'/api/cart/{item.id}/update-quantity/', {'quantity': 5}, format='json')
+        self.assertEqual(self.client.post('/api/orders/checkout/').status_code, 201)
+        self.assertEqual(self.available(), 5)
+
+    def test_expired_holds_are_released(self):
+        self.add(10)
+        other = User.objects.create_user('late', password='secret')
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        # A short hold sweeps the expired ones for that product and retries
+        self.assertEqual(hold_stock(other, {self.product.id: 3}), set())
+        self.assertEqual(self.available(), 7)
+        self.assertEqual(StockHold.objects.get().user, other)
+
+    def test_removing_cart_item_releases_hold(self):
+        self.add(3)
+        item = Cart.objects.get(user=self.user)
+        self.client.delete(f'/api/cart/{item.id}/delete/')
+        self.assertEqual(self.available(), 10)
+
+        self.add(3)
+        item = Cart.objects.get(user=self.user)
+        self.assertEqual(self.client.delete(f'/api/cart/{item.id}/').status_code, 204)
+        self.assertEqual(self.available(), 10)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_stock_endpoint(self):
+        response = self.client.get(f'/api/products/{self.product.id}/stock/')
+        self.assertEqual(response.data, {'product': self.product.id, 'tracked': True, 'available': 10})
+        response = self.client.put(f'/api/products/{self.product.id}/stock/', {'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        Profile.objects.filter(user=self.user).update(user_type='admin')
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        response = self.client.put(f'/api/products/{self.product.id}/stock/', {'quantity': 3}, format='json')
+        self.assertEqual(response.data['available'], 3)
+
+
+class StockContentionTests(TransactionTestCase):
+
+    def test_racing_buyers_never_oversell(self):
+        category = Category.objects.create(name='Packs')
+        product = Product.objects.create(name='Hot', description='', price='20.00', category=category)
+        set_stock(product.id, 50)
+        barrier = threading.Barrier(8)
+        sold, errors = [], []
+
+        def buyer():
+            try:
+                barrier.wait()
+                for _ in range(10):
+                    try:
+                        take_stock({product.id: 1})
+                        sold.append(1)
+                    except InsufficientStock:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buyer) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(sold), 50)
+        self.assertEqual(stock_levels([product.id])[product.id], 0)
+
+
+@override_settings(PAYMENT_RUNNER='inline', PAYMENT_GATEWAY_DELAY=0)
+class PaymentPipelineTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('payer', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Packs')
+        product = Product.objects.create(name='Daypack', description='', price='30.00', category=category)
+        self.order = make_order(self.user, product)
+
+    def pay(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/orders/{self.order.pk}/process-payment/')
+
+    def test_payment_is_accepted_and_ships_order(self):
+        response = self.pay()
+        self.assertEqual(response.status_code, 202)
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.data['status'], 'succeeded')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'shipped')
+
+    def test_repeat_request_reuses_job(self):
+        with override_settings(PAYMENT_RUNNER='worker'):
+            first = self.pay()
+            second = self.pay()
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(PaymentJob.objects.count(), 1)
+
+    def test_paid_order_is_not_charged_again(self):
+        self.pay()
+        self.assertEqual(self.pay().status_code, 409)
+
+    def test_failed_charge_leaves_order_pending(self):
+        class DecliningGateway:
+            def charge(self, order):
+                return PaymentResult(success=False, error='declined')
+
+        with override_settings(PAYMENT_RUNNER='worker'):
+            job_id = self.pay().data['id']
+        run_payment_job(job_id, gateway=DecliningGateway())
+        self.assertEqual(PaymentJob.objects.get(pk=job_id).status, 'failed')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+    def test_other_users_cannot_see_job(self):
+        job_id = self.pay().data['id']
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('nosy', password='secret'))
+        self.assertEqual(other.get(f'/api/orders/payments/{job_id}/').status_code, 404)
+
+    def crashed_job(self, job_status):
+        with override_settings(PAYMENT_RUNNER='worker'):
+            job_id = self.pay().data['id']
+        # Not stale yet: left alone
+        self.assertEqual(reclaim_stale_jobs(), 0)
+        long_ago = timezone.now() - timedelta(seconds=settings.PAYMENT_JOB_TIMEOUT + 1)
+        PaymentJob.objects.filter(pk=job_id).update(status=job_status, updated_at=long_ago)
+        return job_id
+
+    @override_settings(PAYMENT_RUNNER='worker', PAYMENT_GATEWAY_DELAY=0)
+    def test_worker_reclaims_job_that_died_mid_charge(self):
+        job_id = self.crashed_job('processing')
+        call_command('process_payments', '--once', stdout=StringIO())
+        self.assertEqual(PaymentJob.objects.get(pk=job_id).status, 'succeeded')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'shipped')
+
+    @override_settings(PAYMENT_GATEWAY_DELAY=0)
+    def test_retry_requeues_stale_job(self):
+        job_id = self.crashed_job('queued')
+        with override_settings(PAYMENT_RUNNER='inline'):
+            response = self.pay()
+        self.assertEqual(response.data['id'], job_id)
+        self.assertEqual(PaymentJob.objects.get(pk=job_id).status, 'succeeded')
+
+
+class AsyncCatalogTests(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('reader', password='secret')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        category = Category.objects.create(name='Bags')
+        self.products = [
+            Product.objects.create(name=f'Bag {i}', description='', price='12.50', category=category)
+            for i in range(3)
+        ]
+        make_order(self.user, self.products[0])
+
+    def sync_get(self, url):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.get(url)
+
+    def test_matches_sync_endpoints(self):
+        for sync_url, async_url in (
+            ('/api/products/', '/api/async/products/'),
+            ('/api/categories/', '/api/async/categories/'),
+            ('/api/orders/order-history/', '/api/async/orders/order-history/'),
+            (f'/api/products/{self.products[0].pk}/', f'/api/async/products/{self.products[0].pk}/'),
+        ):
+            response = self.client.get(async_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), self.sync_get(sync_url).json())
+
+    def test_requires_token(self):
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.assertEqual(self.client.get('/api/async/products/').status_code, 401)
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer garbage'
+        self.assertEqual(self.client.get('/api/async/products/').status_code, 401)
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('browser', password='secret'))
+        self.category = Category.objects.create(name='Bags')
+        self.product = Product.objects.create(name='Tote', description='', price='5.00', category=self.category)
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_matching_etag_returns_304(self):
+        etag = self.client.get('/api/categories/')['ETag']
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_writes_invalidate(self):
+        etag = self.client.get('/api/products/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(pk=self.category.pk).first().save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        self.assertEqual(self.client.get('/api/products/').json()['results'][0]['name'], 'Renamed')
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=0)
+    def test_zero_timeout_turns_cache_off(self):
+        first = self.client.get('/api/products/')
+        self.assertNotIn('ETag', first)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+        self.assertEqual(self.client.get('/api/products/').json()['results'][0]['name'], 'Renamed')
+
+
+class RoleTokenTests(TestCase):
+
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user('role', password='secret')
+        other = User.objects.create_user('other', password='secret')
+        category = Category.objects.create(name='Bags')
+        product = Product.objects.create(name='Tote', description='', price='5.00', category=category)
+        make_order(self.user, product)
+        make_order(other, product)
+
+    def login(self):
+        response = self.client.post('/api/token/', {'username': 'role', 'password': 'secret'})
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {response.data['access']}"
+        return AccessToken(response.data['access'])
+
+    def test_token_carries_role(self):
+        token = self.login()
+        self.assertEqual(token['user_type'], 'customer')
+        self.assertEqual(token['username'], 'role')
+
+    def test_authorization_needs_no_queries(self):
+        self.login()
+        # Only the orders page and its lines
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/orders/')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_profile_change_overrides_claim(self):
+        self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.get(user=self.user)
+            profile.user_type = 'admin'
+            profile.save()
+        self.assertEqual(len(self.client.get('/api/orders/').json()['results']), 2)
+
+    def test_deactivated_user_is_rejected(self):
+        self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+
+    def test_lost_state_never_restores_claims(self):
+        Profile.objects.filter(user=self.user).update(user_type='admin')
+        token = self.login()
+        self.assertEqual(token['user_type'], 'admin')
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.get(user=self.user)
+            profile.user_type = 'customer'
+            profile.save()
+        # Evicted, expired or never seen by this worker: loaded again
+        caches['auth'].clear()
+        self.assertEqual(len(self.client.get('/api/orders/').json()['results']), 1)
+        self.assertEqual(self.client.get('/api/orders/stats/').status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        caches['auth'].clear()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('searcher', password='secret'))
+        bags = Category.objects.create(name='Bags')
+        self.shoes = Category.objects.create(name='Shoes')
+        Product.objects.create(name='Leather backpack', description='Waterproof hiking pack', price='80.00', category=bags)
+        Product.objects.create(name='Canvas tote', description='Light backpack alternative', price='20.00', category=bags)
+        Product.objects.create(name='Hiking boots', description='Waterproof leather boots', price='120.00', category=self.shoes)
+
+    def search(self, **params):
+        response = self.client.get('/api/products/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['name'] for row in response.data['results']]
+
+    def test_ranks_name_matches_above_description_matches(self):
+        self.assertEqual(self.search(q='backpack'), ['Leather backpack', 'Canvas tote'])
+
+    def test_category_and_price_filters(self):
+        self.assertEqual(self.search(q='waterproof', category=self.shoes.pk), ['Hiking boots'])
+        self.assertEqual(self.search(q='waterproof', max_price='100'), ['Leather backpack'])
+
+    def test_vector_follows_text_edits_only(self):
+        Product.objects.filter(name='Hiking boots').update(description='Insulated winter boots')
+        self.assertEqual(self.search(q='insulated'), ['Hiking boots'])
+        vector = Product.objects.values_list('search_vector', flat=True).get(name='Hiking boots')
+        Product.objects.filter(name='Hiking boots').update(price='99.00', search_vector=None)
+        self.assertIsNone(Product.objects.values_list('search_vector', flat=True).get(name='Hiking boots'))
+        Product.objects.filter(name='Hiking boots').update(name='Hiking boots')
+        self.assertEqual(Product.objects.values_list('search_vector', flat=True).get(name='Hiking boots'), vector)
+
+    def test_typo_falls_back_to_trigram_match(self):
+        self.assertEqual(self.search(q='backpak'), ['Leather backpack'])
+
+    def test_missing_or_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/products/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/products/search/', {'q': 'bag', 'min_price': 'cheap'}).status_code, 400)
+        response = self.client.get('/api/products/search/', {'q': 'bag', 'limit': 'ten'})
+        self.assertEqual((response.status_code, response.data), (400, {"error": "limit must be an integer"}))
+
+
+class RatingAggregateTests(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('rater', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        self.product = Product.objects.create(name='Tote', description='', price='5.00', category=category)
+        self.other = Product.objects.create(name='Duffel', description='', price='9.00', category=category)
+
+    def rate(self, product, rating):
+        response = self.client.post('/api/feedback/', {'product': product.pk, 'rating': rating, 'comment': ''})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_create_update_delete_keep_aggregates_in_step(self):
+        for rating in (5, 4, 4):
+            self.rate(self.product, rating)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, str(self.product.rating_avg)), (3, '4.33'))
+
+        feedback = Feedback.objects.filter(rating=5).get()
+        self.client.patch(f'/api/feedback/{feedback.pk}/', {'rating': 1})
+        self.client.delete(f'/api/feedback/{Feedback.objects.filter(rating=4).first().pk}/')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, str(self.product.rating_avg)), (2, '2.50'))
+        self.assertEqual((self.product.rating_1, self.product.rating_4, self.product.rating_5), (1, 1, 0))
+
+    def test_only_author_changes_review(self):
+        self.rate(self.product, 5)
+        feedback = Feedback.objects.get()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('vandal', password='secret'))
+        self.assertEqual(other.patch(f'/api/feedback/{feedback.pk}/', {'rating': 1}).status_code, 404)
+        self.assertEqual(other.delete(f'/api/feedback/{feedback.pk}/').status_code, 404)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_5), (1, 1))
+
+    def test_product_edit_keeps_feedback_applied_since_read(self):
+        # As if the feedback committed between an edit's read and its save
+        stale = Product.objects.get(pk=self.product.pk)
+        self.rate(self.product, 4)
+        serializer = ProductSerializer(stale, data={'price': '6.00'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.rating_count, self.product.rating_4),
+                         (Decimal('6.00'), 1, 1))
+
+    def test_exposed_sorted_and_filtered(self):
+        self.rate(self.product, 2)
+        self.rate(self.other, 5)
+        data = self.client.get('/api/products/?ordering=rating').json()['results']
+        self.assertEqual([row['name'] for row in data], ['Duffel', 'Tote'])
+        self.assertEqual(data[0]['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1})
+        data = self.client.get('/api/products/?min_rating=3').json()['results']
+        self.assertEqual([row['name'] for row in data], ['Duffel'])
+
+    def test_rebuild_matches_incremental(self):
+        for rating in (3, 5, 5):
+            self.rate(self.product, rating)
+        expected = Product.objects.values().get(pk=self.product.pk)
+        Product.objects.update(rating_count=0, rating_sum=0, rating_avg=0, rating_3=0, rating_5=0)
+        rebuild_ratings()
+        self.assertEqual(Product.objects.values().get(pk=self.product.pk), expected)
+
+
+class ProductImageTests(TestCase):
+
+    def setUp(self):
+        caches['throttle'].clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_cache().clear()
+
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 900), 'orange').save(buffer, 'JPEG')
+        category = Category.objects.create(name='Bags')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                name='Tote', description='', price='5.00', category=category,
+                image=SimpleUploadedFile('tote.jpg', buffer.getvalue(), content_type='image/jpeg')
+            )
+        self.product.refresh_from_db()
+
+    def test_derivatives_generated_on_upload(self):
+        self.assertEqual(set(self.product.image_variants) - {'source', 'digest'}, set(VARIANTS))
+        thumb = Image.open(default_storage.open(self.product.image_variants['thumb']))
+        self.assertEqual((thumb.format, thumb.size), ('WEBP', (200, 150)))
+
+    def test_corrupt_upload_still_saves(self):
+        admin = User.objects.create_user('curator', password='secret')
+        Profile.objects.filter(user=admin).update(user_type='admin')
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=admin.pk))
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 900), 'navy').save(buffer, 'JPEG')
+        # Passes upload validation, fails once decoded
+        truncated = SimpleUploadedFile('torn.jpg', buffer.getvalue()[:len(buffer.getvalue()) // 2], content_type='image/jpeg')
+        with self.assertLogs('trego.signals', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/products/{self.product.pk}/', {'image': truncated}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.image.name.startswith('products/torn'))
+
+    def test_serializer_links_derivatives(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('viewer', password='secret'))
+        variants = client.get(f'/api/products/{self.product.pk}/').data['image_variants']
+        self.assertTrue(variants['medium'].endswith(self.product.image_variants['medium']))
+
+    def test_lazy_variant_is_generated_on_request(self):
+        Product.objects.filter(pk=self.product.pk).update(image_variants={})
+        response = self.client.get(f'/media/products/{self.product.pk}/thumb/')
+        self.assertEqual(response.status_code, 302)
+        self.product.refresh_from_db()
+        self.assertTrue(response['Location'].endswith(self.product.image_variants['thumb']))
+
+    @override_settings(SERVE_MEDIA=True)
+    def test_streams_ranges_and_revalidates(self):
+        url = '/media/' + self.product.image.name
+        size = self.product.image.size
+        full = self.client.get(url)
+        self.assertEqual(full.status_code, 200)
+        body = b''.join(full.streaming_content)
+        self.assertEqual(len(body), size)
+
+        partial = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(b''.join(partial.streaming_content), body[10:20])
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=full['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    def test_media_left_to_web_server(self):
+        self.assertEqual(self.client.get('/media/' + self.product.image.name).status_code, 404)
+
+    def test_image_view_is_throttled(self):
+        rates = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'image': '2/min'}}
+        url = f'/media/products/{self.product.pk}/thumb/'
+        with override_settings(REST_FRAMEWORK=rates):
+            self.assertEqual(self.client.get(f'/media/products/{self.product.pk}/huge/').status_code, 404)
+            self.assertEqual(self.client.get(url).status_code, 302)
+            self.assertEqual(self.client.get(url).status_code, 429)
+
+
+class ListFilterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('filter', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        self.products = [
+            Product.objects.create(name=f'Bag {i}', description='', price='5.00', category=category)
+            for i in range(2)
+        ]
+
+    def test_orders_by_status(self):
+        make_order(self.user, self.products[0])
+        shipped = make_order(self.user, self.products[1])
+        Order.objects.filter(pk=shipped.pk).update(status='shipped')
+        for url in ('/api/orders/?status=shipped', '/api/orders/order-history/?status=shipped'):
+            response = self.client.get(url)
+            self.assertEqual([row['id'] for row in response.data['results']], [shipped.id])
+        self.assertEqual(self.client.get('/api/orders/?status=lost').status_code, 400)
+
+    def test_feedback_by_product(self):
+        Feedback.objects.create(user=self.user, product=self.products[0], rating=4)
+        Feedback.objects.create(user=self.user, product=self.products[1], rating=2)
+        response = self.client.get(f'/api/feedback/?product={self.products[1].id}')
+        self.assertEqual([row['rating'] for row in response.data['results']], [2])
+        self.assertEqual(self.client.get('/api/feedback/?product=x').status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class SparseFieldsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('sparse', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        self.product = Product.objects.create(name='Tote', description='Roomy', price='12.00', category=category)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, ' '.join(q['sql'] for q in ctx.captured_queries)
+
+    def test_fields_limit_output_and_columns(self):
+        data, sql = self.get('/api/products/?fields=id,name')
+        self.assertEqual(data['results'], [{'id': self.product.id, 'name': 'Tote'}])
+        self.assertNotIn('description', sql)
+        self.assertNotIn('trego_category', sql)
+
+        data, _ = self.get(f'/api/products/{self.product.id}/?fields=price,category.name')
+        self.assertEqual(data, {'price': '12.00', 'category': {'name': 'Bags'}})
+
+    def test_nested_products_are_compact_unless_expanded(self):
+        Cart.objects.create(user=self.user, product=self.product, quantity=1)
+        data, sql = self.get('/api/cart/')
+        self.assertEqual(set(data['results'][0]['product']), set(ProductSerializer.summary_fields))
+        self.assertNotIn('description', sql)
+
+        data, _ = self.get('/api/cart/?expand=product.description')
+        self.assertEqual(data['results'][0]['product']['description'], 'Roomy')
+        data, _ = self.get('/api/cart/?expand=product')
+        self.assertEqual(data['results'][0]['product']['category'], {'id': self.product.category_id, 'name': 'Bags'})
+
+    def test_orders_skip_unrendered_totals_and_lines(self):
+        order = make_order(self.user, self.product, quantity=2)
+        data, sql = self.get('/api/orders/?fields=id,status')
+        self.assertEqual(data['results'], [{'id': order.id, 'status': 'pending'}])
+        self.assertNotIn('trego_orderline', sql)
+
+        data, _ = self.get('/api/orders/order-history/?fields=total,lines.quantity')
+        self.assertEqual(data['results'], [{'total': '24.00', 'lines': [{'quantity': 2}]}])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class FastReadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Sacs \u00e0 dos')
+        self.product = Product.objects.create(name='Daypack \u2028', description='L\u00e9ger', price='49.50',
+                                              category=category)
+        Product.objects.create(name='Tote', description='', price='12.5', category=category)
+        make_order(self.user, self.product, quantity=3)
+
+    def both(self, url):
+        # Response bodies with and without the fast path
+        bodies = []
+        for enabled in (True, False):
+            with self.settings(FAST_READS=enabled):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.content)
+        return bodies
+
+    def test_same_json_as_serializers(self):
+        for url in ('/api/products/', '/api/products/?fields=id,category.name', '/api/categories/',
+                    '/api/orders/', '/api/orders/order-history/?fields=total,lines.product'):
+            fast, slow = self.both(url)
+            self.assertEqual(fast, slow, url)
+
+    def test_reads_values_not_instances(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/orders/')
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                   METRICS_TOKEN='s3cret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('shopper', password='secret'))
+        category = Category.objects.create(name='Bags')
+        Product.objects.create(name='Tote', description='', price='10.00', category=category)
+
+    def scrape(self, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Bearer s3cret')
+        response = self.client.get('/metrics', **headers)
+        return response.status_code, response.content.decode()
+
+    def sample(self, body, line_start):
+        return float(next(line for line in body.splitlines() if line.startswith(line_start)).split()[-1])
+
+    def test_records_per_route_metrics(self):
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        code, body = self.scrape()
+        self.assertEqual(code, 200)
+        labels = '{route="product-list",method="GET"'
+        self.assertEqual(self.sample(body, f'trego_request_duration_seconds_count{labels},status="2xx"}}'), 2)
+        self.assertEqual(self.sample(body, f'trego_request_queries_sum{labels}}}'), 2)
+        self.assertGreater(self.sample(body, f'trego_request_serializer_seconds_total{labels}}}'), 0)
+        self.assertGreater(self.sample(body, f'trego_response_size_bytes_sum{labels}}}'), 0)
+
+    @override_settings(N_PLUS_ONE_THRESHOLD=1, SLOW_REQUEST_MS=60000)
+    def test_repeated_statement_is_logged(self):
+        with self.assertLogs('trego.requests', 'WARNING') as logs:
+            self.client.get('/api/products/')
+        record = logs.records[0]
+        self.assertTrue(record.getMessage().startswith('repeated query'))
+        self.assertEqual((record.route, record.repeats), ('product-list', 1))
+
+    def test_token_protects_endpoint(self):
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='')[0], 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer guess')[0], 403)
+        self.assertEqual(self.scrape()[0], 200)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION='')[0], 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.scrape(HTTP_AUTHORIZATION='')[0], 200)
+
+    def test_sums_live_worker_snapshots(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            for pid, count in ((os.getppid(), 3), (exited.pid, 7)):
+                with open(f'{directory}/{pid}.json', 'w') as f:
+                    json.dump({'counters': [['trego_slow_queries_total', ['product-list', 'GET'], count]],
+                               'histograms': []}, f)
+            registry.inc('trego_slow_queries_total', ('product-list', 'GET'), 2)
+            _, body = self.scrape()
+            self.assertFalse(os.path.exists(f'{directory}/{exited.pid}.json'))
+        self.assertEqual(self.sample(body, 'trego_slow_queries_total{route="product-list",method="GET"}'), 5)
+
+
+class SeedDataTests(TestCase):
+    def test_seeds_consistent_data(self):
+        data = seed(users=5, categories=2, products=30, orders=40, feedback=20, batch_size=7)
+        self.assertEqual(Profile.objects.filter(user__in=data['users']).count(), 5)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertFalse(Order.objects.filter(lines__isnull=True).exists())
+        self.assertEqual(
+            SalesRollup.objects.filter(category_id=0).aggregate(n=Sum('orders'))['n'], 40
+        )
+
+    def test_benchmark_covers_router(self):
+        names = dict(endpoints({basename: 1 for _, _, basename in router.registry}))
+        self.assertIn('product-search', names)
+        self.assertIn('order-order-history', names)
+        self.assertEqual(names['product-stock'], '/api/products/1/stock/')
+        self.assertNotIn('order-payment-status', names)
+        self.assertNotIn('cart-batch', names)
+        self.assertNotIn('order-export', names)
+
+
+@override_settings(PAYMENT_RUNNER='inline', PAYMENT_GATEWAY_DELAY=0)
+class SalesStatsTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user('buyer', password='secret')
+        self.admin = User.objects.create_user('boss', password='secret')
+        Profile.objects.filter(user=self.admin).update(user_type='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.bags = Category.objects.create(name='Bags')
+        self.tents = Category.objects.create(name='Tents')
+        self.tote = Product.objects.create(name='Tote', description='', price='10.00', category=self.bags)
+        self.tent = Product.objects.create(name='Tent', description='', price='100.00', category=self.tents)
+
+    def checkout(self, *items):
+        Cart.objects.bulk_create([Cart(user=self.buyer, product=p, quantity=q) for p, q in items])
+        with self.captureOnCommitCallbacks(execute=True):
+            return checkout_cart(self.buyer)
+
+    def stats(self, query=''):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        return client.get(f'/api/orders/stats/{query}')
+
+    def snapshot(self):
+        return sorted(SalesRollup.objects.exclude(orders=0).values_list(
+            'day', 'category_id', 'status', 'orders', 'units', 'revenue'
+        ))
+
+    def test_rollups_follow_orders_and_status_changes(self):
+        paid = self.checkout((self.tote, 2), (self.tent, 1))
+        cancelled = self.checkout((self.tote, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/orders/{paid.pk}/process-payment/')
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.get(pk=cancelled.pk)
+            order.status = 'cancelled'
+            order.save()
+
+        response = self.stats('?group_by=status')
+        self.assertEqual(response.status_code, 200)
+        by_status = {row['status']: row for row in response.data['results'] if row['orders']}
+        self.assertEqual(set(by_status), {'shipped', 'cancelled'})
+        self.assertEqual((by_status['shipped']['orders'], by_status['shipped']['revenue']), (1, Decimal('120.00')))
+        self.assertEqual(by_status['cancelled']['units'], 1)
+
+        response = self.stats('?group_by=category&status=shipped')
+        by_category = {row['category_name']: row['revenue'] for row in response.data['results']}
+        self.assertEqual(by_category, {'Bags': Decimal('20.00'), 'Tents': Decimal('100.00')})
+
+        # The incremental rollups match a rebuild from scratch
+        incremental = self.snapshot()
+        rebuild_rollups()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_deleting_an_order_removes_it(self):
+        order = self.checkout((self.tote, 3))
+        Order.objects.get(pk=order.pk).delete()
+        self.assertEqual(self.snapshot(), [])
+
+    def test_reads_only_rollups(self):
+        for _ in range(3):
+            self.checkout((self.tote, 1))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.stats('?group_by=month,status')
+        self.assertEqual(response.data['results'][0]['orders'], 3)
+        self.assertFalse(any('trego_order' in query['sql'] for query in ctx.captured_queries))
+
+    def test_admins_only_and_validation(self):
+        self.assertEqual(self.client.get('/api/orders/stats/').status_code, 403)
+        for query in ('?group_by=color', '?from=2026-02-01&to=2026-01-01', '?from=yesterday', '?status=lost'):
+            self.assertEqual(self.stats(query).status_code, 400, query)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create_user('buyer', email='buyer@example.com', password='secret')
+        admin = User.objects.create_user('boss', password='secret')
+        Profile.objects.filter(user=admin).update(user_type='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=admin.pk))
+        category = Category.objects.create(name='Bags')
+        self.tote = Product.objects.create(name='Tote, large', description='', price='10.00', category=category)
+        self.orders = [make_order(self.buyer, self.tote, quantity=n) for n in (1, 2, 3)]
+        Order.objects.filter(pk=self.orders[0].pk).update(status='paid',
+                                                          created_at=timezone.now() - timedelta(days=10))
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_csv(self):
+        body = self.export('/api/orders/export/')
+        rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(rows[0][:3], ['order_id', 'created_at', 'status'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(order.pk) for order in self.orders])
+        self.assertEqual(rows[1][4:8], ['buyer', 'buyer@example.com', str(self.tote.pk), 'Tote, large'])
+
+        body = self.export('/api/orders/export/?status=pending')
+        self.assertEqual(len(body.splitlines()), 3)
+        since = (timezone.localdate() - timedelta(days=1)).isoformat()
+        body = self.export(f'/api/orders/export/?from={since}')
+        self.assertNotIn(f'\n{self.orders[0].pk},', body)
+
+    def test_ndjson(self):
+        body = self.export('/api/products/export/?as=ndjson')
+        self.assertEqual([json.loads(line)['price'] for line in body.splitlines()], ['10.00'])
+        Feedback.objects.create(user=self.buyer, product=self.tote, rating=4, comment='Solid')
+        record = json.loads(self.export('/api/feedback/export/?as=ndjson'))
+        self.assertEqual((record['username'], record['rating']), ('buyer', 4))
+
+    def test_rejects_customers_and_bad_filters(self):
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/orders/export/').status_code, 403)
+        self.client.force_authenticate(User.objects.get(username='boss'))
+        for query in ('as=xml', 'from=yesterday', 'status=lost'):
+            self.assertEqual(self.client.get(f'/api/orders/export/?{query}').status_code, 400, query)
+        self.assertEqual(self.client.get('/api/products/export/?status=paid').status_code, 400)
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class ProductImportTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_user('boss', password='secret')
+        Profile.objects.filter(user=admin).update(user_type='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=admin.pk))
+        self.bags = Category.objects.create(name='Bags')
+        Product.objects.create(sku='TOTE-1', name='Tote', description='', price='10.00', category=self.bags)
+
+    def upload(self, body, file_format='csv'):
+        return self.client.generic('POST', f'/api/products/import/?as={file_format}', body.encode(),
+                                   content_type='text/csv' if file_format == 'csv' else 'application/x-ndjson')
+
+    def test_csv_upserts_by_sku_and_reports_bad_rows(self):
+        body = (
+            'sku,name,description,price,category_id\n'
+            f'TOTE-1,Tote,,12.50,{self.bags.pk}\n'
+            f'PACK-1,"Pack, 30l",Roomy,80,{self.bags.pk}\n'
+            f'PACK-2,Pack,,cheap,{self.bags.pk}\n'
+            'PACK-3,Pack,,5,999999\n'
+            f'PACK-1,"Pack, 30l",Roomy,80,{self.bags.pk}\n'
+        )
+        response = self.upload(body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('created', 'updated', 'unchanged', 'failed')},
+            {'created': 1, 'updated': 1, 'unchanged': 1, 'failed': 2},
+        )
+        self.assertEqual([error['row'] for error in response.data['errors']], [4, 5])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(Product.objects.get(sku='TOTE-1').price, Decimal('12.50'))
+        self.assertEqual(Product.objects.get(sku='PACK-1').name, 'Pack, 30l')
+        self.assertEqual(Product.objects.filter(name__startswith='Tote').count(), 1)
+
+    def test_ndjson_and_queries_per_batch(self):
+        lines = [json.dumps({'sku': f'SKU-{n}', 'name': f'Item {n}', 'price': '1.00', 'category_id': self.bags.pk})
+                 for n in range(6)]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.upload('\n'.join(lines + ['{oops']), 'ndjson')
+        self.assertEqual((response.data['created'], response.data['failed']), (6, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 7)
+        # One category lookup in all, then per batch of 2: existing skus
+        # and the upsert (each in its own savepoint)
+        self.assertLessEqual(len(ctx.captured_queries), 1 + 4 * 4)
+        self.assertEqual(Product.objects.filter(sku__startswith='SKU-').count(), 6)
+
+    def test_admins_only(self):
+        self.client.force_authenticate(User.objects.create_user('shopper', password='secret'))
+        self.assertEqual(self.upload('sku,name,price,category_id\n').status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], REPLICA_CHECK_SECONDS=60)
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        # Stand-ins for the lag checks: replica2 is too far behind
+        routers._health.update({'replica1': (time.monotonic(), True), 'replica2': (time.monotonic(), False)})
+        self.addCleanup(routers._health.clear)
+
+    def test_reads_go_to_usable_replicas_only_when_allowed(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            self.assertIsNone(self.router.db_for_read(Product))
+        with replica_reads():
+            routers._health['replica1'] = (time.monotonic(), False)
+            self.assertEqual(self.router.db_for_read(Category), 'default')
+
+    def test_raw_writes_pin_the_primary(self):
+        execute = lambda *args: None
+        with replica_reads():
+            routers.pin_after_writes(execute, 'SELECT 1', (), False, {})
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+        with replica_reads():
+            routers.pin_after_writes(execute, 'UPDATE trego_product SET price = 1', (), False, {})
+            self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_replicas_are_not_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'trego'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'trego'))
+
+
+class RecommendationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Bags')
+        self.tote, self.pack, self.tent, self.stove = [
+            Product.objects.create(name=name, description='', price='10.00', category=category)
+            for name in ('Tote', 'Pack', 'Tent', 'Stove')
+        ]
+        self.basket(self.tote, self.pack)
+        self.basket(self.tote, self.pack)
+        self.basket(self.tote, self.tent)
+        Order.objects.filter(pk=self.basket(self.tote, self.stove).pk).update(status='cancelled')
+
+    def basket(self, *products):
+        order = Order.objects.create(user=self.user)
+        OrderLine.objects.bulk_create([OrderLine(order=order, product=p, unit_price=p.price) for p in products])
+        return order
+
+    def test_builds_top_neighbours_and_serves_them(self):
+        build = build_recommendations()
+        self.assertTrue(build.full)
+        recommendation = ProductRecommendation.objects.get(product=self.tote)
+        self.assertEqual(recommendation.neighbours, [self.pack.pk, self.tent.pk])
+        self.assertGreater(recommendation.scores[0], recommendation.scores[1])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/api/products/{self.tote.pk}/recommendations/')
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.pack.pk, self.tent.pk])
+        self.assertEqual(set(response.data['results'][0]), set(ProductSerializer.summary_fields))
+        self.assertEqual(self.client.get(f'/api/products/{self.stove.pk}/recommendations/').data['results'], [])
+
+    def test_incremental_build_only_touches_new_baskets(self):
+        build_recommendations()
+        before = ProductRecommendation.objects.get(product=self.tote).computed_at
+        self.basket(self.tent, self.stove)
+        Feedback.objects.create(user=self.user, product=self.stove, rating=5)
+        build = build_recommendations()
+        self.assertFalse(build.full)
+        # Tent and stove, from the new order and review; the cancelled order doesn't count
+        self.assertEqual(build.products, 2)
+        self.assertEqual(ProductRecommendation.objects.get(product=self.tote).computed_at, before)
+        self.assertEqual(ProductRecommendation.objects.get(product=self.stove).neighbours, [self.tent.pk])
+
+    def test_repeated_review_counts_once(self):
+        Feedback.objects.create(user=self.user, product=self.tote, rating=5)
+        Feedback.objects.create(user=self.user, product=self.tent, rating=5)
+        build_recommendations()
+        scores = ProductRecommendation.objects.get(product=self.tote).scores
+        Feedback.objects.create(user=self.user, product=self.tent, rating=4)
+        build_recommendations(full=True)
+        self.assertEqual(ProductRecommendation.objects.get(product=self.tote).scores, scores)
+
+
+def throttle_rates(**rates):
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+class ThrottlingTests(TestCase):
+
+    def setUp(self):
+        caches['throttle'].clear()
+        latencies.clear()
+        throttling._shedding[:] = [0.0, False]
+        self.addCleanup(latencies.clear)
+        self.addCleanup(throttling._shedding.__setitem__, slice(None), [0.0, False])
+        self.user = User.objects.create_user('limited', password='secret')
+        self.other = User.objects.create_user('unlimited', password='secret')
+
+    def as_user(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(auth='3/min'))
+    def test_login_attempts_limited_per_ip_and_username(self):
+        for _ in range(3):
+            response = self.client.post('/api/token/', {'username': 'limited', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post('/api/token/', {'username': 'limited', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 429)
+        # One token back every 20 seconds
+        self.assertTrue(1 <= int(response['Retry-After']) <= 20)
+
+        # Another address guessing the same username is refused too
+        response = self.client.post('/api/token/', {'username': 'Limited', 'password': 'secret'},
+                                    REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+        response = self.client.post('/api/token/', {'username': 'unlimited', 'password': 'secret'},
+                                    REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(checkout='2/min', write='100/min'))
+    def test_checkout_limited_per_user(self):
+        client = self.as_user(self.user)
+        for _ in range(2):
+            self.assertEqual(client.post('/api/orders/checkout/').status_code, 400)
+        self.assertEqual(client.post('/api/orders/checkout/').status_code, 429)
+        self.assertEqual(self.as_user(self.other).post('/api/orders/checkout/').status_code, 400)
+        # Reads aren't limited
+        self.assertEqual(client.get('/api/categories/').status_code, 200)
+
+    def test_bucket_refills(self):
+        self.assertEqual(throttling.take_token('throttle:test', 2, 1), 0)
+        self.assertEqual(throttling.take_token('throttle:test', 2, 1), 0)
+        wait = throttling.take_token('throttle:test', 2, 1)
+        self.assertTrue(0 < wait <= 0.5)
+        time.sleep(wait + 0.01)
+        self.assertEqual(throttling.take_token('throttle:test', 2, 1), 0)
+
+    def test_idle_bucket_holds_only_capacity(self):
+        def burst():
+            return sum(throttling.take_token('throttle:idle', 10, 1) == 0 for _ in range(30))
+        self.assertEqual(burst(), 10)
+        # Refilled, while the key is still there
+        time.sleep(1.5)
+        self.assertEqual(burst(), 10)
+
+    @override_settings(SHED_P99_MS=100, SHED_RETRY_AFTER=7)
+    def test_sheds_reads_when_slow(self):
+        for _ in range(50):
+            latencies.add(0.5)
+        client = self.as_user(self.user)
+        response = client.get('/api/categories/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(client.get('/api/async/categories/').status_code, 503)
+        # Checkout isn't low priority
+        self.assertEqual(client.post('/api/orders/checkout/').status_code, 400)
+
+        latencies.clear()
+        throttling._shedding[0] = 0.0
+        self.assertEqual(client.get('/api/categories/').status_code, 200)
+
+
+class OrderPartitionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('archivist', password='secret')
+        product = Product.objects.create(name='Tote', description='', price='5.00',
+                                         category=Category.objects.create(name='Bags'))
+        long_ago = timezone.now() - timedelta(days=400)
+        self.old_completed = make_order(self.user, product)
+        self.old_pending = make_order(self.user, product)
+        self.recent_completed = make_order(self.user, product)
+        Order.objects.filter(pk=self.old_completed.pk).update(status='completed', created_at=long_ago)
+        Order.objects.filter(pk=self.old_pending.pk).update(created_at=long_ago)
+        Order.objects.filter(pk=self.recent_completed.pk).update(status='completed')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        # Partitions can't be attached while this transaction's rows still
+        # have deferred foreign key checks pending
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+    def partition_of(self, order):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM trego_order WHERE id = %s", [order.pk])
+            return cursor.fetchone()[0]
+
+    def listed(self, url):
+        return [order['id'] for order in self.client.get(url).json()['results']]
+
+    def test_rows_move_out_of_default_partition(self):
+        self.assertEqual(self.partition_of(self.old_completed), HOT_DEFAULT)
+        since = timezone.now() - timedelta(days=400)
+        self.assertTrue(ensure_order_partitions(since=since, months_ahead=0))
+        self.assertEqual(self.partition_of(self.old_completed), f'trego_order_y{since:%Y}m{since:%m}')
+        self.assertEqual(ensure_order_partitions(since=since, months_ahead=0), [])
+
+    def test_archives_old_finished_orders(self):
+        self.assertEqual(archive_orders(months=6, batch_size=1), 1)
+        self.assertEqual(archive_orders(months=6), 0)
+        self.assertTrue(self.partition_of(self.old_completed).startswith('trego_order_archive_y'))
+        self.assertEqual(self.partition_of(self.recent_completed)[:13], 'trego_order_y')
+
+        live = [self.recent_completed.pk, self.old_pending.pk]
+        self.assertEqual(self.listed('/api/orders/order-history/'), live)
+        self.assertEqual(self.listed('/api/orders/'), live)
+        self.assertEqual(self.listed('/api/async/orders/order-history/'), live)
+        for url in ('/api/orders/order-history/?archived=true', '/api/async/orders/order-history/?archived=true'):
+            self.assertEqual(self.listed(url), [self.old_completed.pk])
+        response = self.client.get(f'/api/orders/{self.old_completed.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['lines']), 1)
@@ -0,0 +1,146 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import mark_shed, recent_p99
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttle_scope(request):
+    # THROTTLE_SCOPES names scopes by URL name (e.g. 'order-checkout');
+    # anything else is 'read' or 'write' by method
+    match = getattr(request, 'resolver_match', None)
+    scope = settings.THROTTLE_SCOPES.get(match.view_name) if match else None
+    return scope or ('read' if request.method in SAFE_METHODS else 'write')
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60): a bucket of 10 tokens refilled over 60 seconds."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def take_token(key, capacity, period):
+    """
+    Takes a token from the bucket under `key`, returning 0, or returns the
+    seconds until one is available.
+
+    The bucket is stored as one number, the time (in ms) at which it would
+    be full again (GCRA's "theoretical arrival time"), advanced by one
+    token's worth per request with cache.incr. That is atomic on Redis and
+    Memcached, which THROTTLE_CACHE_ALIAS is outside DEBUG and tests (see
+    SHARED_CACHES), so every process and node draws from the same bucket.
+    The key expires once the bucket is full.
+    """
+    cache = caches[settings.THROTTLE_CACHE_ALIAS]
+    interval = max(1, round(period * 1000 / capacity))
+    tolerance = period * 1000 - interval
+    now = int(time.time() * 1000)
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        if cache.add(key, now + interval, timeout=math.ceil(interval / 1000) + 1):
+            return 0
+        full_at = cache.incr(key, interval)
+
+    before = full_at - interval
+    if before < now:
+        # The bucket was already full, its key not yet expired: count from
+        # now, or an idle client would get the time since as extra tokens
+        full_at = cache.incr(key, now - before)
+        before = full_at - interval
+    if before - now > tolerance:
+        # Denied requests don't use up tokens
+        cache.decr(key, interval)
+        return (before - tolerance - now) / 1000
+    cache.touch(key, math.ceil((full_at - now) / 1000) + 1)
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token buckets per scope (see throttle_scope) and client, sized and
+    refilled by the scope's DEFAULT_THROTTLE_RATES entry ('10/min': bursts
+    of 10, then one every 6 seconds); scopes without a rate aren't limited.
+    Clients are users when authenticated, else IP addresses, and the
+    'auth' scope also limits each username tried, whatever the IP.
+    """
+
+    def allow_request(self, request, view):
+        scope = throttle_scope(request)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        self.wait_seconds = 0
+        if not rate:
+            return True
+        capacity, period = parse_rate(rate)
+        for ident in self.idents(request, scope):
+            self.wait_seconds = take_token(f'throttle:{scope}:{ident}', capacity, period)
+            if self.wait_seconds:
+                return False
+        return True
+
+    def idents(self, request, scope):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            idents = [f'user:{user.pk}']
+        else:
+            idents = [f'ip:{self.get_ident(request)}']
+        if scope == 'auth':
+            data = request.data if hasattr(request.data, 'get') else {}
+            username = str(data.get('username') or '').strip().lower()
+            if username:
+                idents.append(f"username:{hashlib.md5(username.encode()).hexdigest()}")
+        return idents
+
+    def wait(self):
+        return math.ceil(self.wait_seconds)
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Server is busy, please retry shortly."
+    default_code = 'overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler
+        self.wait = wait
+
+
+# (time.monotonic() of the last look at the latency, whether shedding)
+_shedding = [0.0, False]
+
+
+def shedding():
+    """
+    Whether this process's p99 latency over the last SHED_WINDOW_SECONDS
+    is above SHED_P99_MS, re-evaluated at most once a second. Shed
+    requests don't count towards it, so shedding stops once the requests
+    still served are fast again.
+    """
+    if not settings.SHED_P99_MS:
+        return False
+    now = time.monotonic()
+    if now - _shedding[0] >= 1:
+        p99 = recent_p99(settings.SHED_WINDOW_SECONDS)
+        _shedding[:] = [now, p99 is not None and p99 * 1000 > settings.SHED_P99_MS]
+    return _shedding[1]
+
+
+class LoadSheddingThrottle(BaseThrottle):
+    # Turns away SHED_SCOPES requests with a 503 while shedding(), so the
+    # workers they'd hold stay free for checkout, payments and sign-in
+    def allow_request(self, request, view):
+        if throttle_scope(request) in settings.SHED_SCOPES and shedding():
+            mark_shed()
+            raise Overloaded(settings.SHED_RETRY_AFTER)
+        return True
@@ -1,117 +1,304 @@
+import codecs
+import logging
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated, BasePermission
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.reverse import reverse
 
 from .serializers import (ProfileSerializer, CategorySerializer,
-                           ProductSerializer, CartSerializer, OrderSerializer, FeedbackSerializer)
+                           ProductSerializer, CartSerializer, OrderSerializer, FeedbackSerializer,
+                           PaymentJobSerializer)
 
-from .models import Category, Product, Profile, Cart, Order, Feedback
-from django.db import transaction
+from .models import Category, Product, Profile, Cart, Order, OrderLine, Feedback, PaymentJob
+from .mixins import FastReadMixin, OptimizedQuerySetMixin, select_for_serializer
+from .cache import CachedResponseMixin
+from .authentication import get_user_type
+from .cart import MAX_BATCH_ITEMS, add_to_cart, change_quantity, parse_product_id, parse_quantity, set_quantity
+from .checkout import checkout_cart
+from .exports import ExportMixin
+from .imports import FORMATS as IMPORT_FORMATS, import_products
+from .inventory import InsufficientStock, hold_stock, release_holds, set_stock, stock_levels
+from .payments import enqueue_payment
+from .routers import ReplicaReadMixin
+from .search import filter_products, search_products
+from .stats import parse_stats_params, sales_stats
+
+logger = logging.getLogger(__name__)
+
+
+def order_lines(serializer):
+    # Prefetch for Order.lines loading only the columns `serializer`
+    # (an OrderSerializer) renders for them; None if lines aren't shown
+    lines = serializer.fields.get('lines')
+    if lines is None:
+        return None
+    return Prefetch('lines', queryset=select_for_serializer(
+        OrderLine.objects.order_by('pk'), lines, ('product__category',), keep=('order',)
+    ))
 
-import random
-import time
 
 class IsAdmin(BasePermission):
     def has_permission(self, request, view):
         if request.method in ['GET', 'HEAD', 'OPTIONS']:
             return True
-        return request.user.profile.user_type == 'admin'
+        return get_user_type(request.user) == 'admin'
 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(OptimizedQuerySetMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
+    select_related_fields = ('user',)
+    cursor_ordering = ('id',)
+    only_fields = ('id', 'user_type', 'bio', 'user__id', 'user__username', 'user__email')
 
     def get_queryset(self):
-        return Profile.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, CachedResponseMixin, FastReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated, IsAdmin]
+    cache_versions = ('category',)
+    cursor_ordering = ('id',)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, CachedResponseMixin, FastReadMixin, ExportMixin, OptimizedQuerySetMixin,
+                     viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
+    select_related_fields = ('category',)
+    defer_fields = ('search_vector',)
+    defer_unrendered = True
+    cache_versions = ('product', 'category')
+    export_name = 'products'
+    replica_actions = ('list', 'retrieve', 'search', 'recommendations')
+    # ?ordering= choices; each is a keyset the paginator can seek on
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'rating': ('-rating_avg', '-rating_count', '-id'),
+    }
+
+    @property
+    def cursor_ordering(self):
+        return self.orderings.get(self.request.query_params.get('ordering'), self.orderings['newest'])
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            try:
+                queryset = filter_products(queryset, self.request.query_params)
+            except ValueError as e:
+                raise ValidationError({"error": str(e)})
+        return queryset
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        term = request.query_params.get('q', '').strip()
+        if not term:
+            return Response({"error": "Query parameter 'q' is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            products = filter_products(self.get_queryset(), request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = search_products(products, term, limit)
+        serializer = self.get_serializer(results, many=True)
+        return Response({"results": serializer.data}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get', 'put'], url_path='stock')
+    def stock(self, request, pk=None):
+        # PUT {"quantity": n} replaces the stock (admins only, see IsAdmin)
+        product = get_object_or_404(Product.objects.only('id'), pk=pk)
+        if request.method == 'PUT':
+            try:
+                quantity = int(request.data.get('quantity'))
+                if quantity < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                return Response({"error": "quantity must be a non-negative integer"}, status=status.HTTP_400_BAD_REQUEST)
+            set_stock(product.id, quantity)
+        available = stock_levels([product.id]).get(product.id)
+        return Response({"product": product.id, "tracked": available is not None, "available": available})
+
+    @action(detail=True, methods=['get'], url_path='recommendations')
+    def recommendations(self, request, pk=None):
+        # Precomputed by `manage.py build_recommendations`: the product with
+        # its neighbour ids, then those K products
+        product = get_object_or_404(
+            Product.objects.select_related('recommendation').only('id', 'recommendation__neighbours'), pk=pk
+        )
+        recommendation = getattr(product, 'recommendation', None)
+        neighbours = recommendation.neighbours if recommendation else []
+        serializer = ProductSerializer(context=self.get_serializer_context(),
+                                       default_fields=ProductSerializer.summary_fields)
+        products = select_for_serializer(Product.objects.filter(pk__in=neighbours), serializer, ('category',))
+        by_id = {item.pk: item for item in products}
+        data = ProductSerializer([by_id[i] for i in neighbours if i in by_id], many=True, context=serializer.context,
+                                 default_fields=ProductSerializer.summary_fields).data
+        return Response({"product": product.id, "results": data}, status=status.HTTP_200_OK)
 
-class CartViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        # The body is the CSV or NDJSON file itself (?as=, default csv),
+        # read line by line as it arrives. Admins only, see IsAdmin.
+        file_format = request.query_params.get('as', 'csv')
+        if file_format not in IMPORT_FORMATS:
+            return Response({"error": f"as must be one of: {', '.join(IMPORT_FORMATS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:
+            return Response({"error": "Request body is empty"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = import_products(codecs.iterdecode(request.stream, 'utf-8-sig'), file_format)
+        except UnicodeDecodeError:
+            return Response({"error": "Request body must be UTF-8"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK)
+
+class CartViewSet(OptimizedQuerySetMixin, viewsets.ModelViewSet):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
+    select_related_fields = ('product__category',)
+    defer_fields = ('product__search_vector',)
+    defer_unrendered = True
+    cursor_ordering = ('-added_at', '-id')
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
     
     def create(self, request, *args, **kwargs):
         try:
-            product_id = request.data.get('product_id')
-            quantity = request.data.get('quantity', 1)
+            product_id = parse_product_id(request.data.get('product_id'))
+            quantity = parse_quantity(request.data.get('quantity', 1))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Validate product exists
-            try:
-                product = Product.objects.get(id=product_id)
-            except Product.DoesNotExist:
-                return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+        with transaction.atomic():
+            if hold_stock(request.user, {product_id: quantity}):
+                return Response({"error": "Insufficient stock"}, status=status.HTTP_409_CONFLICT)
+            added = add_to_cart(request.user, [(product_id, quantity)])
+        if product_id not in added:
+            return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        cart_item = self.get_queryset().get(pk=added[product_id])
+        serializer = self.get_serializer(cart_item)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def add_batch(self, request):
+        # Body: {"items": [{"product_id": 1, "quantity": 2}, ...]}
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "items must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_BATCH_ITEMS:
+            return Response(
+                {"error": f"At most {MAX_BATCH_ITEMS} items per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            pairs = [
+                (int(item['product_id']), parse_quantity(item.get('quantity', 1)))
+                for item in items
+            ]
+        except (TypeError, ValueError, KeyError, AttributeError):
+            return Response({"error": "Each item needs a product_id and a positive quantity"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        amounts = Counter()
+        for product_id, quantity in pairs:
+            amounts[product_id] += quantity
+        with transaction.atomic():
+            out_of_stock = hold_stock(request.user, amounts)
+            added = add_to_cart(request.user, [pair for pair in pairs if pair[0] not in out_of_stock])
+        cart_items = self.get_queryset().filter(pk__in=added.values()).order_by('-added_at', '-id')
+        return Response({
+            "items": self.get_serializer(cart_items, many=True).data,
+            "not_found": sorted(amounts.keys() - added.keys() - out_of_stock),
+            "out_of_stock": sorted(out_of_stock),
+        }, status=status.HTTP_201_CREATED)
 
-            # Check for existing cart item
-            try:
-                cart_item = Cart.objects.get(user=request.user, product=product)
-                # If exists, update quantity
-                cart_item.quantity += int(quantity)
-                cart_item.save()
-            except Cart.DoesNotExist:
-                # If not exists, create new cart item
-                cart_item = Cart.objects.create(
-                    user=request.user,
-                    product=product,
-                    quantity=int(quantity)
-                )
-
-            serializer = self.get_serializer(cart_item)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        except Exception as e:
-            print(f"Error in CartViewSet.create: {str(e)}")  # Debug log
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        
     @action(detail=True, methods=['patch'], url_path='update-quantity')
     def update_quantity(self, request, pk=None):
+        # `quantity` sets the amount, `delta` changes it relative to the
+        # current one (e.g. -1 for a "remove one" button)
         try:
-            cart_item = self.get_object()
-            quantity = request.data.get('quantity')
-            if quantity is None or quantity <= 0:
+            if 'delta' in request.data:
+                updated = change_quantity(request.user, pk, parse_quantity(request.data['delta'], allow_negative=True))
+            else:
+                updated = set_quantity(request.user, pk, parse_quantity(request.data.get('quantity')))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not updated:
+            if self.get_queryset().filter(pk=pk).exists():
                 return Response({"error": "Invalid quantity"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            cart_item.quantity = quantity
-            cart_item.save()
-            serializer = self.get_serializer(cart_item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Exception as e:
-                print(f"Error in CartViewSet.update_quantity: {str(e)}")
-                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
+        serializer = self.get_serializer(self.get_queryset().get(pk=pk))
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def perform_destroy(self, instance):
+        # Both DELETE /api/cart/{id}/ and .../delete/ hand the stock back
+        with transaction.atomic():
+            instance.delete()
+            release_holds(self.request.user, [instance.product_id])
 
     @action(detail=True, methods=['delete'], url_path='delete')
     def delete_item(self, request, pk=None):
         try:
-            cart_item = self.get_object()
-            cart_item.delete()
+            self.perform_destroy(self.get_object())
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
-            print(f"Error in CartViewSet.delete_item: {str(e)}")
+            logger.exception("Error in CartViewSet.delete_item")
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderViewSet(viewsets.ModelViewSet):
+
+def wants_archived(request):
+    # Order listings show live orders; ?archived=true lists the archive
+    # instead (see trego/partitions.py)
+    return request.query_params.get('archived') in ('1', 'true')
+
+
+class OrderViewSet(ReplicaReadMixin, FastReadMixin, ExportMixin, OptimizedQuerySetMixin, viewsets.ModelViewSet):
+    # One row per order with its total summed in SQL; lines come in one
+    # extra query for the whole page
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    defer_unrendered = True
+    export_name = 'orders'
+    replica_actions = ('list', 'order_history')
+
+    @property
+    def prefetch_related_fields(self):
+        lines = order_lines(self.rendered_serializer())
+        return (lines,) if lines else ()
 
     def get_queryset(self):
         # Admins see all orders, users see only their own
-        if self.request.user.profile.user_type == 'admin':
-            return Order.objects.all()
-        return Order.objects.filter(user=self.request.user)
+        queryset = super().get_queryset()
+        if 'total' in self.rendered_serializer().fields:
+            queryset = queryset.with_totals()
+        if self.action in ('list', 'order_history'):
+            queryset = queryset.filter(archived=wants_archived(self.request))
+            order_status = self.request.query_params.get('status')
+            if order_status:
+                if order_status not in dict(Order.ORDER_STATUS_CHOICES):
+                    raise ValidationError({"error": f"Unknown status: {order_status}"})
+                queryset = queryset.filter(status=order_status)
+        if get_user_type(self.request.user) == 'admin':
+            return queryset
+        return queryset.filter(user=self.request.user)
 
     def perform_create(self, serializer):
         # Automatically set user to the authenticated user
@@ -120,77 +307,91 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'], url_path='checkout')
     def checkout(self, request):
         try:
-            with transaction.atomic():
-                cart_items = Cart.objects.filter(user=request.user)
-                if not cart_items.exists():
-                    return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-                
-                for cart in cart_items:
-                    # Create order for each cart item
-                    Order.objects.create(
-                        user=request.user,
-                        product=cart.product,
-                        quantity=cart.quantity,
-                        status='pending'
-                    )
-                # Remove all cart items after order creation
-                cart_items.delete()  # Fixed from cart.delete()
-                return Response({"message": "Order placed successfully, proceed to payment"}, status=status.HTTP_201_CREATED)
+            order = checkout_cart(request.user)
+            if order is None:
+                return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+            data = self.get_serializer(self.get_queryset().get(pk=order.pk)).data
+            data['message'] = "Order placed successfully, proceed to payment"
+            return Response(data, status=status.HTTP_201_CREATED)
+        except InsufficientStock as e:
+            return Response({"error": "Insufficient stock", "product_ids": e.product_ids},
+                            status=status.HTTP_409_CONFLICT)
         except Exception as e:
-            print(f"Error in OrderViewSet.checkout: {str(e)}")
+            logger.exception("Error in OrderViewSet.checkout")
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     @action(detail=False, methods=['get'], url_path='order-history')
     def order_history(self, request):
         try:
-            orders = self.get_queryset().order_by('-created_at')
-            serializer = self.get_serializer(orders, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            # Paginated newest-first on (created_at, id)
+            response = self.fast_list(self.get_queryset())
+            if response is not None:
+                return response
+            page = self.paginate_queryset(self.get_queryset())
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         except Exception as e:
-            print(f"Error in OrderViewSet.order_history: {str(e)}")
+            logger.exception("Error in OrderViewSet.order_history")
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
+    @action(detail=False, methods=['get'], url_path='stats')
+    def stats(self, request):
+        # Served from the sales rollups, never from the orders themselves
+        if get_user_type(request.user) != 'admin':
+            return Response({"error": "Only admins can view sales stats"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            params = parse_stats_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "from": params['start'],
+            "to": params['end'],
+            "group_by": params['group_by'],
+            "results": sales_stats(**params),
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='process-payment')
     def process_payment(self, request, pk=None):
         try:
-            print(f"User: {request.user.username}, Is admin: {request.user.profile.user_type == 'admin'}")
             order = self.get_object()
-            print(f"Before payment - Order {order.id} status: {order.status}, Owner: {order.user.username}")
-            
-            # Simulate network delay
-            time.sleep(1)
-            
-            # Forced success for testing
-            payment_success = True
-            print(f"Payment success: {payment_success}")
-            
-            if payment_success:
-                try:
-                    # Update order status
-                    order.status = 'shipped'
-                    order.save(update_fields=['status'])
-                    
-                    # Verify the update
-                    order.refresh_from_db()
-                    print(f"After save - Order {order.id} status: {order.status}")
-                    
-                    if order.status != 'shipped':
-                        raise Exception(f"Status update failed for Order {order.id}, still {order.status}")
-                    
-                    return Response({"message": "Payment successful, order shipped"}, status=status.HTTP_200_OK)
-                except Exception as save_error:
-                    print(f"Save error for Order {order.id}: {str(save_error)}")
-                    return Response({"error": "Failed to update order status"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                print(f"Payment failed for Order {order.id}")
-                return Response({"error": "Payment failed, please try again"}, status=status.HTTP_400_BAD_REQUEST)
+            if order.status != 'pending':
+                return Response({"error": f"Order is already {order.status}"}, status=status.HTTP_409_CONFLICT)
+
+            # The gateway call happens in the background; poll the job for the result
+            job = enqueue_payment(order)
+            data = PaymentJobSerializer(job).data
+            data['message'] = "Payment accepted, processing"
+            data['status_url'] = reverse('order-payment-status', kwargs={'job_id': job.pk}, request=request)
+            return Response(data, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
-            print(f"Error in OrderViewSet.process_payment: {str(e)}")
+            logger.exception("Error in OrderViewSet.process_payment")
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'], url_path=r'payments/(?P<job_id>[0-9a-f-]+)', url_name='payment-status')
+    def payment_status(self, request, job_id=None):
+        job = get_object_or_404(PaymentJob, pk=job_id, order__in=self.get_queryset())
+        return Response(PaymentJobSerializer(job).data, status=status.HTTP_200_OK)
         
-class FeedbackViewSet(viewsets.ModelViewSet):
+class FeedbackViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = Feedback.objects.all()
+    serializer_class = FeedbackSerializer
     permission_classes = [IsAuthenticated]
+    export_name = 'feedback'
+
+    def get_queryset(self):
+        # ?product= lists one product's reviews (feedback_product_created_idx)
+        queryset = super().get_queryset()
+        product_id = self.request.query_params.get('product')
+        if self.action == 'list' and product_id:
+            try:
+                queryset = queryset.filter(product_id=int(product_id))
+            except ValueError:
+                raise ValidationError({"error": "product must be an integer"})
+        # Reviews move their product's rating aggregates: only their author
+        # (or an admin) may change or delete them
+        if self.action in ('update', 'partial_update', 'destroy') and get_user_type(self.request.user) != 'admin':
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
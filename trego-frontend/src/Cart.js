@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useNavigate, useParams } from 'react-router-dom';
-import { getCart, updateCartQuantity, deleteCartItem, checkout, processPayment, getOrderHistory, setAuthToken, getToken } from './api/api';
+import { getCart, updateCartQuantity, deleteCartItem, checkout, processPayment, setAuthToken, getToken } from './api/api';
 
 function Cart() {
   const [cartItems, setCartItems] = useState([]);
@@ -79,8 +79,7 @@ function Cart() {
 
   const handleCheckout = async () => {
     try {
-      await checkout();
-      const orderId = (await getOrderHistory()).slice(-1)[0]?.id;
+      const orderId = (await checkout()).id;
       if (orderId) {
         navigate(`/payment/${orderId}`);
       } else {
@@ -72,9 +72,12 @@ function OrderHistory() {
             <div key={order.id} className="card">
               <h2 className="text-lg font-semibold text-white">Order #{order.id}</h2>
               <p className="text-sm text-gray-300">Date: {new Date(order.created_at).toLocaleString()}</p>
-              <p className="text-sm text-gray-300">Product: {order.product.name}</p>
-              <p className="text-sm text-gray-300">Quantity: {order.quantity}</p>
-              <p className="text-sm text-gray-300">Total: ${parseFloat(order.product.price * order.quantity).toFixed(2)}</p>
+              {order.lines.map((line) => (
+                <p key={line.id} className="text-sm text-gray-300">
+                  {line.product.name} x {line.quantity} @ ${line.unit_price}
+                </p>
+              ))}
+              <p className="text-sm text-gray-300">Total: ${order.total}</p>
               <p className="text-sm text-gray-300">Status: {order.status}</p>
             </div>
           ))}
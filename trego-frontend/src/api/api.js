@@ -1,9 +1,25 @@
 import axios from 'axios';
 
 const API_URL = 'http://localhost:8000/api/';
+// Cart items embed a compact product; the cart page also shows its description
+const CART_PARAMS = { expand: 'product.description' };
 
 let authToken = localStorage.getItem('token');
 
+// List endpoints return one keyset page at a time; ask for the largest the
+// API allows and follow `next` (which keeps the query string) to the end
+const PAGE_SIZE = 100;
+
+const getAllPages = async (url, params) => {
+  let response = await axios.get(url, { params: { page_size: PAGE_SIZE, ...params } });
+  const results = [...response.data.results];
+  while (response.data.next) {
+    response = await axios.get(response.data.next);
+    results.push(...response.data.results);
+  }
+  return results;
+};
+
 export const setAuthToken = (token) => {
   authToken = token;
   if (token) {
@@ -38,15 +54,13 @@ export const getProducts = async () => {
     }
     setAuthToken(token);
     console.log('Fetching products with token:', token);
-    const response = await axios.get(`${API_URL}products/`);
-    return response.data;
+    return await getAllPages(`${API_URL}products/`);
   } catch (error) {
     console.error('Get products error:', error.response?.status, error.message);
     if (error.response?.status === 401) {
       const newToken = await getToken('admin', 'admin123');
       setAuthToken(newToken);
-      const response = await axios.get(`${API_URL}products/`);
-      return response.data;
+      return await getAllPages(`${API_URL}products/`);
     }
     throw error;
   }
@@ -61,16 +75,15 @@ export const getCart = async () => {
     }
     setAuthToken(token);
     console.log('Fetching cart with token:', token);
-    const response = await axios.get(`${API_URL}cart/`);
-    console.log('Cart response:', response.data);
-    return response.data;
+    const items = await getAllPages(`${API_URL}cart/`, CART_PARAMS);
+    console.log('Cart response:', items);
+    return items;
   } catch (error) {
     console.error('Get cart error:', error.response?.status, error.message);
     if (error.response?.status === 401) {
       const newToken = await getToken('admin', 'admin123');
       setAuthToken(newToken);
-      const response = await axios.get(`${API_URL}cart/`);
-      return response.data;
+      return await getAllPages(`${API_URL}cart/`, CART_PARAMS);
     }
     throw error;
   }
@@ -153,8 +166,7 @@ export const getOrderHistory = async () => {
       token = await getToken('admin', 'admin123');
     }
     setAuthToken(token);
-    const response = await axios.get(`${API_URL}orders/order-history/`);
-    return response.data;
+    return await getAllPages(`${API_URL}orders/order-history/`);
   } catch (error) {
     throw error;
   }